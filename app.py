@@ -1,106 +1,409 @@
 # app.py - Flask主应用文件（集成AI服务版 + 百度情感分析 + WebSocket + 主动关怀）
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
 import config
-from services.ai_service import get_ai_reply
-from services.emotion_analyzer import BaiduEmotionAnalyzer
-import sqlite3
+from services.ai_service import get_ai_reply, get_ai_service_stats
+from services.baidu_token import BaiduTokenManager
+from services.emotion_analyzer import DEFAULT_BAIDU_BASE_URL, BaiduEmotionAnalyzer
+from services.local_emotion import get_local_classifier
+from services.emotion_labeler import EmotionLabeler
+from services.circuit_breaker import get_breaker_states
+from services.context_builder import estimate_message_tokens, fold_into_summary
+from services.idempotency import IdempotencyConflict, get_idempotency_store, make_fingerprint
+from services.cancellation import (ClientDisconnectWatcher, RequestCancelled, get_cancellation_stats,
+                                   raise_if_cancelled)
+from services.deadline import Deadline, get_deadline_stats
+from services.sqlite_pool import get_pool_stats
+from services.chat_shards import ChatShards
+from services.data_export import iter_chat_records, iter_ndjson_bytes, iter_schedule_records
+from services.search_index import (SEARCH_MAX_OFFSET, SEARCH_PAGE_MAX, delete_session_index, get_search_stats,
+                                   index_new_messages, search_messages)
+from services.migrations import CHAT_HISTORY_MIGRATIONS, migrate
+from services.write_behind import WriteBehindQueue
+from services.session_cache import SessionHistoryCache
+from services.message_archive import (DEFAULT_CHUNK_MESSAGES, archive_messages, combine_archive_stats, delete_archive,
+                                      get_archive_stats, iter_full_history, read_archived_before)
+import atexit
+import hmac
 import os
+import time
 
 # 导入 WebSocket 和调度器模块
 from websocket_handler import init_socketio, get_connection_stats, get_online_users
 from scheduler import init_scheduler, get_scheduler_status, schedule_user_tasks, remove_user_tasks
-from models import init_user_schedule_db, get_user_schedule, create_or_update_user_schedule
+from models import (init_user_schedule_db, get_user_schedule, create_or_update_user_schedule, init_emotion_db,
+                    record_emotion, get_emotion_trend, clear_emotion_history, EMOTION_EWMA_ALPHA)
+from models import get_db_connection as get_companion_db_connection
 from utils.persona_utils import get_persona_prompt, get_all_personas
 
 # 数据库文件（项目根目录）
 DB_PATH = os.path.join(os.path.dirname(__file__), 'chat_history.db')
+# 聊天记录按 session_id 哈希分片到 CHAT_DB_SHARDS 个文件（分片 0 即 DB_PATH；修改分片数前先运行
+# scripts/rebalance_chat_shards.py 搬迁会话）
+chat_shards = ChatShards(DB_PATH, getattr(config, 'CHAT_DB_SHARDS', 1))
+
+# 情感分析模式：
+#   local   - 本地分类器（默认，不走网络）；百度按 EMOTION_LABEL_SAMPLE_RATE 抽样在后台标注
+#   compare - 本地分类器 + 百度在后台标注每一条消息，统计两者一致率
+#   baidu   - 同步调用百度接口（旧行为）
+EMOTION_MODE = getattr(config, 'EMOTION_MODE', 'local')
 
 # 初始化百度情感分析器（如果API Key已配置）
 emotion_analyzer = None
 if config.BAIDU_API_KEY and config.BAIDU_SECRET_KEY:
-    emotion_analyzer = BaiduEmotionAnalyzer(config.BAIDU_API_KEY, config.BAIDU_SECRET_KEY)
+    # Access Token 由后台线程提前刷新，并持久化到 BAIDU_TOKEN_STORE（为空字符串时不持久化）
+    baidu_token_manager = BaiduTokenManager(
+        config.BAIDU_API_KEY, config.BAIDU_SECRET_KEY,
+        getattr(config, 'BAIDU_BASE_URL', None) or DEFAULT_BAIDU_BASE_URL,
+        store_path=getattr(config, 'BAIDU_TOKEN_STORE', None),
+        refresh_margin=getattr(config, 'BAIDU_TOKEN_REFRESH_MARGIN', 86400),
+    )
+    emotion_analyzer = BaiduEmotionAnalyzer(
+        config.BAIDU_API_KEY, config.BAIDU_SECRET_KEY, getattr(config, 'BAIDU_BASE_URL', None),
+        token_manager=baidu_token_manager
+    )
+
+local_emotion_classifier = get_local_classifier() if EMOTION_MODE != 'baidu' else None
+emotion_labeler = None
+if emotion_analyzer and EMOTION_MODE != 'baidu':
+    label_rate = 1.0 if EMOTION_MODE == 'compare' else getattr(config, 'EMOTION_LABEL_SAMPLE_RATE', 0.0)
+    if label_rate > 0:
+        emotion_labeler = EmotionLabeler(emotion_analyzer, getattr(config, 'EMOTION_LABEL_LOG', None), label_rate)
+
+# 请求级截止时间：一次聊天的总预算，以及情感分析等可选阶段需要给 LLM 预留的预算（秒）
+CHAT_REQUEST_BUDGET = getattr(config, 'CHAT_REQUEST_BUDGET', 20.0)
+CHAT_LLM_RESERVE = getattr(config, 'CHAT_LLM_RESERVE', 5.0)
+# 预留 LLM 预算后剩余不足该值时跳过情感分析
+EMOTION_MIN_BUDGET = 0.5
+# 分页历史接口每页最多返回的消息数
+HISTORY_PAGE_MAX = 100
 
 
 
 def init_db():
-    """初始化SQLite数据库和表"""
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    """初始化SQLite数据库：每个分片执行尚未执行的版本化迁移（services/migrations.py，启动时执行一次）"""
+    for index, path in enumerate(chat_shards.paths):
+        conn = chat_shards.connect_shard(index)
+        try:
+            migrate(conn, CHAT_HISTORY_MIGRATIONS, os.path.basename(path))
+        finally:
+            conn.close()
 
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+def get_db_connection(session_id):
+    """从会话所在分片的连接池借出连接（WAL 模式，线程内复用；用完 close() 归还）"""
+    return chat_shards.connect(session_id)
+
+
+def _get_writer(session_id):
+    """会话所在分片的异步写入队列（未开启异步写入时为 None）"""
+    return message_writers[chat_shards.index(session_id)] if message_writers else None
 
 
 def save_message(session_id, role, content):
-    conn = get_db_connection()
+    conn = get_db_connection(session_id)
     try:
         conn.execute(
             'INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)',
             (session_id, role, content)
         )
+        _index_new_messages(conn)
         conn.commit()
     finally:
         conn.close()
+    conversation_sessions.invalidate(session_id)
+
+
+def get_session_history(session_id, limit=50, max_tokens=None):
+    """
+    从数据库读取会话历史，按时间升序返回最近的 `limit` 条消息（role/content 列表）。
+
+    只读取最近 limit 行（ORDER BY id DESC LIMIT，走 (session_id, id) 索引），耗时与会话总长度无关；
+    指定 max_tokens 时从最新的消息往前取，估算 token 数超出预算即停止。
+    """
+    # 最近活跃的会话直接从进程内缓存读取（services/session_cache.py）
+    messages = conversation_sessions.get(session_id, limit, lambda count: _load_session_history(session_id, count))
+    if max_tokens is None:
+        return messages
+
+    history = []
+    used_tokens = 0
+    for message in reversed(messages):
+        used_tokens += estimate_message_tokens(message)
+        if used_tokens > max_tokens:
+            break
+        history.append(message)
+    history.reverse()
+    return history
+
+
+def _load_session_history(session_id, limit):
+    """从数据库读取最近 limit 条消息（按时间升序）；开启异步写入时叠加该会话尚未提交的对话（读己之写）"""
+    def read_db():
+        conn = get_db_connection(session_id)
+        try:
+            return conn.execute(
+                'SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?',
+                (session_id, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    writer = _get_writer(session_id)
+    if writer is None:
+        messages = [{'role': r['role'], 'content': r['content']} for r in read_db()]
+    else:
+        rows, pending = writer.read(session_id, read_db)
+        messages = [{'role': r['role'], 'content': r['content']} for r in rows]
+        for _, user_message, ai_reply, _ in pending:
+            messages[:0] = [{'role': 'assistant', 'content': ai_reply}, {'role': 'user', 'content': user_message}]
+        messages = messages[:limit]
+    messages.reverse()
+    return messages
+
+
+def get_history_page(session_id, before_id=None, limit=20):
+    """
+    分页读取会话历史（keyset 分页：按消息 id 倒序翻页，耗时只与页大小有关；messages 表翻完后继续翻归档）
+
+    参数:
+        before_id: 只返回 id 小于该值的消息（上一页返回的 next_before_id），为空时从最新一条开始
+        limit: 每页条数
+
+    返回:
+        {'messages': 按时间升序的消息列表, 'has_more': 是否还有更早的消息, 'next_before_id': 下一页的 before_id}
+    """
+    # 尚未提交的消息还没有 id，先等它们写入
+    _flush_pending_writes(session_id)
+    conn = get_db_connection(session_id)
+    try:
+        # 多取一条用来判断是否还有下一页
+        if before_id is None:
+            rows = conn.execute(
+                'SELECT id, role, content, created_at FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?',
+                (session_id, limit + 1)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT id, role, content, created_at FROM messages WHERE session_id = ? AND id < ? '
+                'ORDER BY id DESC LIMIT ?',
+                (session_id, before_id, limit + 1)
+            ).fetchall()
+        rows = [dict(r) for r in rows]
+        if len(rows) <= limit:
+            # 更早的消息已被裁剪进归档（id 都小于 messages 表中剩余的消息）
+            upper = rows[-1]['id'] if rows else before_id
+            rows += reversed(read_archived_before(conn, session_id, upper, limit + 1 - len(rows)))
+    finally:
+        conn.close()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'messages': rows[::-1],
+        'has_more': has_more,
+        'next_before_id': rows[-1]['id'] if has_more else None,
+    }
 
 
-def get_session_history(session_id, limit=50):
-    """从数据库读取会话历史，按时间升序返回最近的 `limit` 条消息（role/content 列表）。"""
-    conn = get_db_connection()
+def trim_history(session_id, max_items=10):
+    """裁剪数据库中指定会话的历史消息，保留最近 max_items 条；被删除的消息先折叠进会话摘要。"""
+    conn = get_db_connection(session_id)
     try:
-        cur = conn.execute(
-            'SELECT role, content FROM messages WHERE session_id = ? ORDER BY id ASC',
-            (session_id,)
-        )
-        rows = cur.fetchall()
-        history = [{'role': r['role'], 'content': r['content']} for r in rows]
-        # 只保留最近 limit 条
-        if len(history) > limit:
-            history = history[-limit:]
-        return history
+        _trim_session(conn, session_id, max_items)
+        conn.commit()
     finally:
         conn.close()
+    conversation_sessions.invalidate(session_id)
+
+
+def commit_turn(session_id, user_message, ai_reply, max_items=10):
+    """
+    在一个事务中保存一轮对话：写入用户消息和AI回复、裁剪历史（被删除的消息折叠进会话摘要）
+
+    参数:
+        session_id: 会话ID
+        user_message / ai_reply: 本轮的用户消息和AI回复
+        max_items: 裁剪后保留的消息条数
+
+    返回:
+        裁剪后该会话的历史消息条数
+    """
+    with conversation_sessions.writing(session_id):
+        writer = _get_writer(session_id)
+        if writer is not None:
+            # 异步写入：放入队列即返回，由后台线程批量提交
+            writer.submit(session_id, (session_id, user_message, ai_reply, max_items))
+            history_length = None
+        else:
+            conn = get_db_connection(session_id)
+            try:
+                conn.executemany(
+                    'INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)',
+                    [(session_id, 'user', user_message), (session_id, 'assistant', ai_reply)]
+                )
+                _index_new_messages(conn)
+                history_length = _trim_session(conn, session_id, max_items)
+                conn.commit()
+            finally:
+                conn.close()
+        # 写穿：同步更新会话历史缓存
+        conversation_sessions.append_turn(
+            session_id, [{'role': 'user', 'content': user_message}, {'role': 'assistant', 'content': ai_reply}],
+            max_items
+        )
+    if history_length is None:
+        history_length = len(get_session_history(session_id, limit=max_items))
+    return history_length
+
+
+def _write_turns(conn, turns):
+    """异步写入队列的批量写入：一批对话（同一分片）的消息一次插入，每个会话裁剪一次（由队列统一提交）"""
+    conn.executemany(
+        'INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)',
+        [row for session_id, user_message, ai_reply, _ in turns
+         for row in ((session_id, 'user', user_message), (session_id, 'assistant', ai_reply))]
+    )
+    _index_new_messages(conn)
+    max_items = {session_id: keep for session_id, _, _, keep in turns}
+    for session_id, keep in max_items.items():
+        _trim_session(conn, session_id, keep)
+
+
+def _index_new_messages(conn):
+    """新写入的消息加入全文检索索引（与写入同一事务；SEARCH_INDEX_ENABLED 关闭时跳过）"""
+    if getattr(config, 'SEARCH_INDEX_ENABLED', True):
+        index_new_messages(conn)
+
+
+def _flush_pending_writes(session_id):
+    """该会话还有未提交的异步写入时，等待写入完成"""
+    writer = _get_writer(session_id)
+    if writer is not None and writer.has_pending(session_id):
+        writer.flush()
+
+
+def _trim_session(conn, session_id, max_items):
+    """
+    把 max_items 条之前的旧消息移出 messages 表（按 (session_id, id) 索引定位分界 id，一条 DELETE），返回剩余条数；
+    被移出的消息先折叠进会话摘要，并压缩归档到 message_archive（ARCHIVE_TRIMMED_MESSAGES 关闭时直接删除）。
+    调用方负责提交
+    """
+    # 第 max_items 新的消息；不存在说明消息不足 max_items 条，无需裁剪
+    row = conn.execute(
+        'SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?',
+        (session_id, max_items - 1)
+    ).fetchone()
+    if row is None:
+        return conn.execute('SELECT COUNT(*) FROM messages WHERE session_id = ?', (session_id,)).fetchone()[0]
+    trimmed = conn.execute(
+        'SELECT id, role, content, created_at FROM messages WHERE session_id = ? AND id < ? ORDER BY id ASC',
+        (session_id, row['id'])
+    ).fetchall()
+    if trimmed:
+        _fold_session_summary(conn, session_id, trimmed)
+        if getattr(config, 'ARCHIVE_TRIMMED_MESSAGES', True):
+            archive_messages(conn, session_id, trimmed,
+                             chunk_size=getattr(config, 'ARCHIVE_CHUNK_MESSAGES', DEFAULT_CHUNK_MESSAGES))
+        else:
+            # 不归档时消息被永久删除，检索结果里也不再出现
+            delete_session_index(conn, session_id, before_id=row['id'])
+        conn.execute('DELETE FROM messages WHERE session_id = ? AND id < ?', (session_id, row['id']))
+    return max_items
+
+
+def _fold_session_summary(conn, session_id, rows):
+    """把即将移出 messages 表且尚未折叠的消息增量折叠进会话摘要（与删除在同一事务中）"""
+    row = conn.execute(
+        'SELECT summary, last_message_id FROM session_summaries WHERE session_id = ?',
+        (session_id,)
+    ).fetchone()
+    old_summary = row['summary'] if row else ''
+    last_id = row['last_message_id'] if row else 0
+    new_rows = [r for r in rows if r['id'] > last_id]
+    if not new_rows:
+        return
+    summary = fold_into_summary(
+        old_summary,
+        [{'role': r['role'], 'content': r['content']} for r in new_rows],
+        max_tokens=getattr(config, 'CONTEXT_SUMMARY_BUDGET', 300)
+    )
+    conn.execute(
+        """
+        INSERT INTO session_summaries (session_id, summary, last_message_id, updated_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(session_id) DO UPDATE SET
+            summary = excluded.summary,
+            last_message_id = excluded.last_message_id,
+            updated_at = excluded.updated_at
+        """,
+        (session_id, summary, new_rows[-1]['id'])
+    )
+
+
+def iter_session_messages(session_id):
+    """
+    按时间顺序逐条读取会话的全部消息（先归档、再 messages 表），供导出和摘要使用；归档逐块解压，不一次读入内存
+
+    返回:
+        {'id', 'role', 'content', 'created_at'} 的迭代器
+    """
+    _flush_pending_writes(session_id)
+    yield from iter_full_history(lambda: get_db_connection(session_id), session_id)
+
+
+def get_archive_status():
+    """各分片归档统计的合计"""
+    stats = []
+    for index in range(chat_shards.shard_count):
+        conn = chat_shards.connect_shard(index)
+        try:
+            stats.append(get_archive_stats(conn))
+        finally:
+            conn.close()
+    return combine_archive_stats(stats)
 
 
-def trim_history(session_id, max_items=10):
-    """裁剪数据库中指定会话的历史消息，保留最近 max_items 条，其余删除。"""
-    conn = get_db_connection()
+def get_search_status():
+    """各分片全文检索索引的文档数和已索引水位"""
+    stats = []
+    for index in range(chat_shards.shard_count):
+        conn = chat_shards.connect_shard(index)
+        try:
+            stats.append(get_search_stats(conn))
+        finally:
+            conn.close()
+    return {
+        'enabled': getattr(config, 'SEARCH_INDEX_ENABLED', True),
+        'documents': sum(s['documents'] for s in stats),
+        'shards': stats,
+    }
+
+
+def get_session_summary(session_id):
+    """读取会话摘要（没有被裁剪过的会话返回空字符串）。"""
+    conn = get_db_connection(session_id)
     try:
-        cur = conn.execute('SELECT id FROM messages WHERE session_id = ? ORDER BY id ASC', (session_id,))
-        ids = [r['id'] for r in cur.fetchall()]
-        if len(ids) > max_items:
-            # 删除最旧的部分
-            delete_ids = ids[0:len(ids) - max_items]
-            conn.executemany('DELETE FROM messages WHERE id = ?', [(i,) for i in delete_ids])
-            conn.commit()
+        row = conn.execute(
+            'SELECT summary FROM session_summaries WHERE session_id = ?',
+            (session_id,)
+        ).fetchone()
+        return row['summary'] if row else ''
     finally:
         conn.close()
 
 
 def clear_history_db(session_id):
-    conn = get_db_connection()
+    _flush_pending_writes(session_id)
+    conn = get_db_connection(session_id)
     try:
         conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+        conn.execute('DELETE FROM session_summaries WHERE session_id = ?', (session_id,))
+        delete_archive(conn, session_id)
+        delete_session_index(conn, session_id)
         conn.commit()
     finally:
         conn.close()
+    conversation_sessions.invalidate(session_id)
 
 # 初始化Flask应用
 app = Flask(__name__)
@@ -110,6 +413,22 @@ CORS(app)
 # 初始化数据库
 init_db()
 init_user_schedule_db()
+init_emotion_db()
+
+# 聊天记录异步写入（write-behind）：开启后回复不等待 SQLite 提交，后台批量提交，退出时写完队列；
+# 每个分片一个队列和后台线程，各分片的批量提交并行进行
+message_writers = []
+if getattr(config, 'WRITE_BEHIND_ENABLED', False):
+    for shard in range(chat_shards.shard_count):
+        writer = WriteBehindQueue(
+            chat_shards.connector(shard), _write_turns,
+            batch_size=getattr(config, 'WRITE_BEHIND_BATCH_SIZE', 64),
+            flush_interval=getattr(config, 'WRITE_BEHIND_FLUSH_INTERVAL', 0.05),
+            max_queue=getattr(config, 'WRITE_BEHIND_MAX_QUEUE', 10000),
+            name='chat-history-writer' if chat_shards.shard_count == 1 else f'chat-history-writer-{shard}',
+        )
+        atexit.register(writer.close)
+        message_writers.append(writer)
 
 # 初始化 WebSocket
 socketio = init_socketio(app)
@@ -119,12 +438,15 @@ import sys
 if '--no-scheduler' not in sys.argv:
     init_scheduler(app)
 
-# 保留内存字典作为快速缓存（可选）
-conversation_sessions = {}
+# 会话历史缓存（LRU，按会话数和估算内存限制；写穿，清空历史时失效）
+conversation_sessions = SessionHistoryCache(
+    max_sessions=getattr(config, 'SESSION_CACHE_MAX_SESSIONS', 1024),
+    max_bytes=getattr(config, 'SESSION_CACHE_MAX_BYTES', 16 * 1024 * 1024),
+)
 
 # NOTE: 现在优先使用数据库持久化；get_session_history 会从数据库读取历史
-def get_session_history_db(session_id):
-    return get_session_history(session_id, limit=50)
+def get_session_history_db(session_id, max_tokens=None):
+    return get_session_history(session_id, limit=50, max_tokens=max_tokens)
 
 @app.route('/')
 def home():
@@ -161,7 +483,16 @@ def get_personas():
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    """接收用户消息，进行情感分析，并调用AI生成回复"""
+    """
+    接收用户消息，进行情感分析，并调用AI生成回复
+
+    支持幂等键（请求头 Idempotency-Key 或请求体 idempotency_key）：客户端超时重发同一条消息时，
+    正在处理的重复请求会等待第一次的结果，已完成的直接返回保存的结果，不会再次调用 LLM 或重复写库。
+
+    客户端在回复生成前断开时，取消上游生成且不保存本轮对话（返回 499）；带幂等键的请求断开后继续处理
+    IDEMPOTENCY_CANCEL_GRACE 秒，等待客户端超时重发的同一个键接上，期间没有重发才取消。
+    整轮对话共用 CHAT_REQUEST_BUDGET 秒的预算，各阶段只使用剩余预算。
+    """
     try:
         data = request.json
 
@@ -172,64 +503,176 @@ def chat():
         session_id = data.get('session_id', 'default_user')  # 简单的会话标识
         persona_id = data.get('persona_id', 'warm_partner')  # 获取人格标识，默认为暖心伴侣
 
-        # 获取该会话的历史记录（从数据库）
-        history = get_session_history_db(session_id)
-
-        print(f"[App] 收到消息: '{user_message[:30]}...' (会话: {session_id}, 历史长度: {len(history)})")
+        idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+        deadline = Deadline(CHAT_REQUEST_BUDGET)
+        with ClientDisconnectWatcher(request.environ) as cancel_event:
+            if not idempotency_key:
+                return jsonify(_process_chat_turn(user_message, session_id, persona_id, cancel_event, deadline))
 
-        # ========== 新增：情感分析 ==========
-        emotion_data = None
-        if emotion_analyzer:
+            fingerprint = make_fingerprint({'message': user_message, 'persona_id': persona_id})
             try:
-                emotion_data = emotion_analyzer.analyze_emotion(user_message)
-                print(f"[情感分析] 结果: {emotion_data}")
-            except Exception as e:
-                print(f"[情感分析] 失败: {e}")
-                emotion_data = None
-
-        # 获取人格对应的 system_prompt
-        system_prompt = get_persona_prompt(persona_id)
-
-        # 调用AI服务，并传递情感数据和 system_prompt 作为额外上下文
-        ai_reply = get_ai_reply(user_message, history, emotion_data=emotion_data, system_prompt=system_prompt)
-
-        # 持久化到数据库（保存用户消息和AI回复）
-        save_message(session_id, 'user', user_message)
-        save_message(session_id, 'assistant', ai_reply)
-        # 裁剪历史，保留最近5轮（10条消息）
-        trim_history(session_id, max_items=10)
-        # 重新读取当前历史长度以返回给客户端
-        history = get_session_history_db(session_id)
-
-        response_payload = {
-            'reply': ai_reply,
-            'status': 'success',
-            'session_id': session_id,
-            'history_length': len(history),
-            'emotion': emotion_data,  # 返回情感分析结果给前端（可选）
-            'emotion_type': type(emotion_data).__name__ if emotion_data is not None else 'NoneType'
-        }
-        try:
-            print(f"[Debug] 返回给客户端的 payload: {response_payload}")
-        except Exception:
-            pass
-        return jsonify(response_payload)
-
+                payload, replayed = get_idempotency_store().run(
+                    f"{session_id}:{idempotency_key}", fingerprint,
+                    lambda cancel_signal: _process_chat_turn(user_message, session_id, persona_id, cancel_signal,
+                                                             deadline),
+                    cancel_event=cancel_event
+                )
+            except IdempotencyConflict as e:
+                return jsonify({'error': str(e)}), 422
+        if replayed:
+            print(f"[App] 幂等键 {idempotency_key} 命中，直接返回已有结果（会话: {session_id}）")
+        response = jsonify(payload)
+        response.headers['Idempotent-Replayed'] = 'true' if replayed else 'false'
+        return response
+
+    except RequestCancelled as e:
+        # 客户端已断开，响应不会被读取（499 沿用 nginx 的 Client Closed Request）
+        print(f"[App] {e}")
+        return '', 499
     except Exception as e:
         print(f"[App] 错误: {e}")
         return jsonify({'error': f'服务器内部错误: {str(e)}'}), 500
 
 
+def _process_chat_turn(user_message, session_id, persona_id, cancel_event=None, deadline=None):
+    """
+    处理一轮对话：情感分析 -> 调用AI -> 持久化 -> 裁剪历史
+
+    cancel_event 被设置时（客户端断开）抛出 RequestCancelled，不调用或中止 LLM，也不保存本轮对话。
+    deadline 为请求截止时间：情感分析只在给 LLM 留出 CHAT_LLM_RESERVE 秒后仍有余量时进行。
+
+    返回:
+        返回给客户端的响应字典
+    """
+    # 获取该会话的历史记录（最多取上下文预算内的最近消息）和更早对话的摘要（从数据库）
+    history = get_session_history_db(session_id, max_tokens=getattr(config, 'CONTEXT_TOKEN_BUDGET', 2000))
+    summary = get_session_summary(session_id)
+
+    print(f"[App] 收到消息: '{user_message[:30]}...' (会话: {session_id}, 历史长度: {len(history)})")
+
+    # ========== 新增：情感分析 ==========
+    emotion_data = None
+    emotion_deadline = deadline.child(CHAT_LLM_RESERVE) if deadline is not None else None
+    if local_emotion_classifier is not None:
+        # 本地分类（亚毫秒级）；百度在后台标注，不阻塞本轮对话
+        emotion_data = local_emotion_classifier.analyze_emotion(user_message)
+        print(f"[情感分析] 本地结果: {emotion_data}")
+        if emotion_labeler is not None:
+            emotion_labeler.submit(user_message, emotion_data)
+    elif emotion_analyzer and emotion_deadline is not None and not emotion_deadline.allows(EMOTION_MIN_BUDGET):
+        get_deadline_stats().record_skipped('emotion')
+        print(f"[情感分析] 剩余预算 {deadline.remaining():.2f} 秒，跳过情感分析")
+    elif emotion_analyzer:
+        try:
+            emotion_data = emotion_analyzer.analyze_emotion(user_message, deadline=emotion_deadline)
+            print(f"[情感分析] 结果: {emotion_data}")
+        except Exception as e:
+            print(f"[情感分析] 失败: {e}")
+            emotion_data = None
+
+    # 用户近期情绪（增量维护的聚合，不扫描历史；不含本条消息）
+    emotion_trend = get_emotion_trend(session_id)
+
+    # 获取人格对应的 system_prompt
+    system_prompt = get_persona_prompt(persona_id)
+
+    # 调用AI服务，并传递情感数据和 system_prompt 作为额外上下文
+    raise_if_cancelled(cancel_event, "对话请求")
+    ai_reply = get_ai_reply(user_message, history, emotion_data=emotion_data, system_prompt=system_prompt,
+                            conversation_summary=summary, persona_id=persona_id, cancel_event=cancel_event,
+                            deadline=deadline, emotion_trend=emotion_trend)
+    if cancel_event is not None and cancel_event.is_set():
+        # 回复已生成但客户端已断开：不写入历史，避免出现用户没看到的回复
+        get_cancellation_stats().record_skipped_persist()
+        raise RequestCancelled("客户端已断开，本轮对话不保存")
+
+    # 持久化到数据库：保存用户消息和AI回复、裁剪历史（保留最近5轮，即10条消息）在同一事务中完成
+    history_length = commit_turn(session_id, user_message, ai_reply, max_items=10)
+    # 记录本条消息的情绪并更新该用户的近期情绪聚合
+    if emotion_data:
+        record_emotion(session_id, emotion_data, alpha=getattr(config, 'EMOTION_EWMA_ALPHA', EMOTION_EWMA_ALPHA))
+
+    response_payload = {
+        'reply': ai_reply,
+        'status': 'success',
+        'session_id': session_id,
+        'history_length': history_length,
+        'emotion': emotion_data,  # 返回情感分析结果给前端（可选）
+        'emotion_type': type(emotion_data).__name__ if emotion_data is not None else 'NoneType'
+    }
+    try:
+        print(f"[Debug] 返回给客户端的 payload: {response_payload}")
+    except Exception:
+        pass
+    return response_payload
+
+
+@app.route('/api/history', methods=['GET'])
+def history_page():
+    """
+    分页读取会话历史：GET /api/history?session_id=xxx&limit=20&before_id=123
+
+    返回按时间升序的一页消息；has_more 为 true 时把 next_before_id 作为下一次请求的 before_id 读取更早的消息。
+    """
+    session_id = request.args.get('session_id', 'default_user')
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), HISTORY_PAGE_MAX)
+        before_id = request.args.get('before_id')
+        before_id = int(before_id) if before_id else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit 和 before_id 必须是整数'}), 400
+
+    page = get_history_page(session_id, before_id=before_id, limit=limit)
+    return jsonify({'status': 'success', 'session_id': session_id, **page})
+
+
+@app.route('/api/search', methods=['GET'])
+def search_history():
+    """
+    全文检索一个会话的聊天记录：GET /api/search?q=关键词&session_id=xxx&role=user&limit=20&offset=0
+
+    session_id 必填，只检索该会话（跨会话检索见 /api/admin/search）；q 中空白分隔的多个词需同时出现。
+    结果按相关度排序、按会话分组，每条命中带原文摘录（snippet）和关键词位置（highlights）；
+    has_more 为 true 时把 next_offset 作为下一次请求的 offset。命中消息的 id 可作为 /api/history 的 before_id 定位上下文。
+    """
+    session_id = request.args.get('session_id')
+    if not session_id:
+        return jsonify({'status': 'error', 'message': '缺少会话ID session_id'}), 400
+    return _search_response(session_id)
+
+
+def _search_response(session_id):
+    """解析检索参数并检索；session_id 为 None 时检索全部会话"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'status': 'error', 'message': '缺少检索关键词 q'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), SEARCH_PAGE_MAX)
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit 和 offset 必须是整数'}), 400
+    if not 0 <= offset <= SEARCH_MAX_OFFSET:
+        return jsonify({'status': 'error', 'message': f'offset 需在 0 ~ {SEARCH_MAX_OFFSET} 之间'}), 400
+
+    if session_id is not None:
+        # 只检索一个会话时先等它尚未提交的对话写入（读己之写）
+        _flush_pending_writes(session_id)
+    result = search_messages(
+        [chat_shards.connector(index) for index in range(chat_shards.shard_count)], query,
+        session_id=session_id, role=request.args.get('role') or None, limit=limit, offset=offset,
+    )
+    return jsonify({'status': 'success', 'query': query, **result})
+
+
 @app.route('/api/clear_history', methods=['POST'])
 def clear_history():
     """清空指定会话的历史记录"""
     data = request.json
     session_id = data.get('session_id', 'default_user')
-    # 清理数据库中的历史
+    # 清理数据库中的历史（包括该会话的情绪记录）
+    # 会话历史缓存由 clear_history_db 一并失效
     clear_history_db(session_id)
-    # 清理内存缓存（如果存在）
-    if session_id in conversation_sessions:
-        conversation_sessions.pop(session_id, None)
+    clear_emotion_history(session_id)
 
     return jsonify({
         'status': 'success',
@@ -239,7 +682,11 @@ def clear_history():
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'ai_integrated': True}), 200
+    return jsonify({
+        'status': 'healthy',
+        'ai_integrated': True,
+        'circuit_breakers': get_breaker_states()
+    }), 200
 
 
 @app.route('/api/websocket/status', methods=['GET'])
@@ -262,6 +709,42 @@ def scheduler_status():
     })
 
 
+@app.route('/api/llm/status', methods=['GET'])
+def llm_status():
+    """获取AI服务状态（提供商路由、请求合并、熔断器、幂等键等统计）"""
+    return jsonify({
+        'status': 'success',
+        'llm': get_ai_service_stats(),
+        'idempotency': get_idempotency_store().get_stats(),
+        'emotion': _emotion_stats(),
+        'sqlite': get_pool_stats(),
+        'write_behind': _write_behind_stats(),
+        'session_cache': conversation_sessions.get_stats(),
+        'archive': get_archive_status(),
+        'search': get_search_status()
+    })
+
+
+def _write_behind_stats():
+    """异步写入队列统计（未开启时为 None；分片时为每个分片一项的列表）"""
+    if not message_writers:
+        return None
+    if len(message_writers) == 1:
+        return message_writers[0].get_stats()
+    return [writer.get_stats() for writer in message_writers]
+
+
+def _emotion_stats():
+    """情感分析模式、本地分类耗时、百度结果缓存、Token 状态和标注一致率"""
+    return {
+        'mode': EMOTION_MODE,
+        'cache': emotion_analyzer.cache.get_stats() if emotion_analyzer is not None else None,
+        'token': emotion_analyzer.tokens.get_stats() if emotion_analyzer is not None else None,
+        'local': local_emotion_classifier.get_stats() if local_emotion_classifier is not None else None,
+        'labeler': emotion_labeler.get_stats() if emotion_labeler is not None else None,
+    }
+
+
 @app.route('/api/user/schedule', methods=['GET', 'POST'])
 def user_schedule():
     """获取或设置用户的推送偏好"""
@@ -304,6 +787,15 @@ def user_schedule():
         })
 
 
+@app.route('/api/user/emotion_trend', methods=['GET'])
+def user_emotion_trend():
+    """获取用户的近期情绪（极性 EWMA、连续负面条数、近 7 天各情绪标签的条数）"""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'status': 'error', 'message': '缺少 user_id'}), 400
+    return jsonify({'status': 'success', 'trend': get_emotion_trend(user_id)})
+
+
 @app.route('/api/user/schedule/disable', methods=['POST'])
 def disable_user_schedule():
     """禁用用户的推送功能"""
@@ -333,6 +825,79 @@ def disable_user_schedule():
         'message': f'已禁用 {push_type} 推送'
     })
 
+
+def _check_admin_token():
+    """管理接口鉴权：请求头 X-Admin-Token 需与 config.ADMIN_TOKEN 一致；未配置 ADMIN_TOKEN 时管理接口关闭"""
+    token = getattr(config, 'ADMIN_TOKEN', None)
+    if not token:
+        return jsonify({'status': 'error', 'message': '未配置 ADMIN_TOKEN，管理接口已关闭'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+        return jsonify({'status': 'error', 'message': '管理口令错误'}), 401
+    return None
+
+
+def _ndjson_response(kind, records):
+    """流式输出 NDJSON（?gzip=1 时 gzip 压缩），结束后打印导出行数和速度"""
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    filename = f"{kind}.ndjson.gz" if compress else f"{kind}.ndjson"
+
+    def generate():
+        started = time.perf_counter()
+        rows = 0
+
+        def counted():
+            nonlocal rows
+            for record in records:
+                rows += 1
+                yield record
+
+        yield from iter_ndjson_bytes(kind, counted(), compress=compress)
+        elapsed = time.perf_counter() - started
+        print(f"[导出] {filename}: {rows} 行，耗时 {elapsed:.2f}s（{rows / elapsed if elapsed else 0:.0f} 行/秒）")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/gzip' if compress else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
+
+
+@app.route('/api/admin/export/chat', methods=['GET'])
+def export_chat():
+    """
+    流式导出聊天记录（含归档）为 NDJSON：GET /api/admin/export/chat?gzip=1&session_id=a&session_id=b
+
+    不指定 session_id 时导出全部会话；格式见 services/data_export.py，可用 scripts/ndjson_data.py import 导入
+    """
+    denied = _check_admin_token()
+    if denied:
+        return denied
+    records = iter_chat_records(
+        [chat_shards.connector(index) for index in range(chat_shards.shard_count)],
+        session_ids=request.args.getlist('session_id') or None,
+        iter_messages=iter_session_messages,
+    )
+    return _ndjson_response('chat', records)
+
+
+@app.route('/api/admin/search', methods=['GET'])
+def admin_search_history():
+    """跨会话全文检索聊天记录（客服排查用）：GET /api/admin/search?q=关键词&session_id=xxx&role=user&limit=20&offset=0，不指定 session_id 时检索全部会话"""
+    denied = _check_admin_token()
+    if denied:
+        return denied
+    return _search_response(request.args.get('session_id') or None)
+
+
+@app.route('/api/admin/export/schedules', methods=['GET'])
+def export_schedules():
+    """流式导出全部用户的推送偏好（user_schedule）为 NDJSON：GET /api/admin/export/schedules?gzip=1"""
+    denied = _check_admin_token()
+    if denied:
+        return denied
+    return _ndjson_response('schedules', iter_schedule_records(get_companion_db_connection))
+
+
 if __name__ == '__main__':
     print("=" * 60)
     print("MyEmotionCompanion 情感陪伴程序 (AI集成版 + 主动关怀)")
@@ -7,6 +7,8 @@ from flask import Flask
 from flask_cors import CORS
 
 from .config.settings import Settings
+from .models.chat_record import init_db
+from .models.emotion_record import init_emotion_db
 from .routes import register_blueprints
 from .services.socketio_service import init_socketio
 from .services.scheduler_service import init_scheduler
@@ -33,6 +35,10 @@ def create_app() -> Flask:
 
     CORS(app)
 
+    # 数据库迁移（聊天记录）和情绪时间序列表只在启动时执行一次，不在请求路径上建表
+    init_db()
+    init_emotion_db()
+
     # 初始化 Socket.IO（让前端在线状态/推送通道可用）
     init_socketio(app)
 
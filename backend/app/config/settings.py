@@ -27,20 +27,72 @@ def _project_env_path() -> str:
 class Settings:
     SECRET_KEY: str
     DEBUG: bool
+    # 管理接口（/api/admin/*）口令，请求头 X-Admin-Token；为空时管理接口关闭
+    ADMIN_TOKEN: str | None
 
     # AI / 其他配置：先预留字段，后续逐步迁移
     AI_PROVIDER: str
     DEEPSEEK_API_KEY: str | None
+    DEEPSEEK_BASE_URL: str
     VOLCENGINE_API_KEY: str | None
     VOLCENGINE_MODEL: str | None
     VOLCENGINE_BASE_URL: str | None
 
     BAIDU_API_KEY: str | None
     BAIDU_SECRET_KEY: str | None
+    BAIDU_BASE_URL: str
+    BAIDU_TOKEN_STORE: str | None
+    BAIDU_TOKEN_REFRESH_MARGIN: float
+
+    # 情感分析：local（本地分类器，默认）/ baidu（同步调用百度接口）
+    EMOTION_MODE: str
+    EMOTION_MODEL_PATH: str
+
+    # 百度情感分析结果缓存：容量、有效期（秒）、SQLite 持久化文件（为空时只缓存在内存）
+    EMOTION_CACHE_SIZE: int
+    EMOTION_CACHE_TTL: float
+    EMOTION_CACHE_DB: str | None
+    EMOTION_EWMA_ALPHA: float
+    SQLITE_POOL_SIZE: int
+    SQLITE_BUSY_TIMEOUT: float
+    SQLITE_WAL: bool
+    # 聊天记录分片数（按 session_id 哈希分到多个 SQLite 文件；修改前先运行 scripts/rebalance_chat_shards.py）
+    CHAT_DB_SHARDS: int
+    # 读取聊天历史作为上下文时的 token 预算（从最新的消息往前取）
+    HISTORY_TOKEN_BUDGET: int
+    # 聊天记录异步写入（write-behind）：是否开启、每批最多条数、最早一条最多等待秒数、队列上限
+    WRITE_BEHIND_ENABLED: bool
+    WRITE_BEHIND_BATCH_SIZE: int
+    WRITE_BEHIND_FLUSH_INTERVAL: float
+    WRITE_BEHIND_MAX_QUEUE: int
+    # 会话历史缓存（进程内 LRU）：最多缓存的会话数（0 为关闭）、估算内存上限（字节）
+    SESSION_CACHE_MAX_SESSIONS: int
+    SESSION_CACHE_MAX_BYTES: int
+    # 裁剪出的消息是否压缩归档（否则直接删除）、每个归档块最多的消息条数
+    ARCHIVE_TRIMMED_MESSAGES: bool
+    ARCHIVE_CHUNK_MESSAGES: int
+    # 聊天记录全文检索（FTS5 索引随消息写入同步维护，/api/search）
+    SEARCH_INDEX_ENABLED: bool
 
     # C3KG
     C3KG_DATA_PATH: str | None
 
+    # Prompt 前缀缓存（火山方舟上下文缓存；DeepSeek 前缀缓存自动生效）
+    PROMPT_CACHE_ENABLED: bool
+
+    # /api/chat 幂等键结果保留时间（秒）
+    IDEMPOTENCY_TTL: float
+
+    # /api/chat 请求总预算，以及可选阶段需要给 LLM 预留的预算（秒）
+    CHAT_REQUEST_BUDGET: float
+    CHAT_LLM_RESERVE: float
+
+    # 上游熔断器：窗口内失败率阈值、最少调用次数、滚动窗口（秒）、打开后多久进入半开（秒）
+    CIRCUIT_FAILURE_RATIO: float
+    CIRCUIT_MIN_CALLS: int
+    CIRCUIT_WINDOW_SECONDS: float
+    CIRCUIT_OPEN_SECONDS: float
+
     @staticmethod
     def load() -> "Settings":
         # 1) 先加载 backend/.env（如果你未来要独立部署后端，可只维护 backend/.env）
@@ -62,14 +114,48 @@ class Settings:
         return Settings(
             SECRET_KEY=os.getenv("SECRET_KEY", "dev-secret-key-change-in-production"),
             DEBUG=_get_bool("DEBUG", False),
+            ADMIN_TOKEN=os.getenv("ADMIN_TOKEN") or None,
             AI_PROVIDER=os.getenv("AI_PROVIDER", "deepseek"),
             DEEPSEEK_API_KEY=os.getenv("DEEPSEEK_API_KEY"),
+            DEEPSEEK_BASE_URL=os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1"),
             VOLCENGINE_API_KEY=os.getenv("VOLCENGINE_API_KEY"),
             VOLCENGINE_MODEL=os.getenv("VOLCENGINE_MODEL"),
             VOLCENGINE_BASE_URL=os.getenv("VOLCENGINE_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3"),
             BAIDU_API_KEY=os.getenv("BAIDU_API_KEY"),
             BAIDU_SECRET_KEY=os.getenv("BAIDU_SECRET_KEY"),
+            BAIDU_BASE_URL=os.getenv("BAIDU_BASE_URL", "https://aip.baidubce.com"),
+            BAIDU_TOKEN_STORE=os.getenv("BAIDU_TOKEN_STORE", os.path.join(project_root, "data", "baidu_token.json"))
+            or None,
+            BAIDU_TOKEN_REFRESH_MARGIN=float(os.getenv("BAIDU_TOKEN_REFRESH_MARGIN", "86400")),
+            EMOTION_MODE=os.getenv("EMOTION_MODE", "local").strip().lower(),
+            EMOTION_MODEL_PATH=os.getenv("EMOTION_MODEL_PATH", os.path.join(project_root, "data", "emotion_model.json")),
+            EMOTION_CACHE_SIZE=int(os.getenv("EMOTION_CACHE_SIZE", "4096")),
+            EMOTION_CACHE_TTL=float(os.getenv("EMOTION_CACHE_TTL", str(7 * 86400))),
+            EMOTION_CACHE_DB=os.getenv("EMOTION_CACHE_DB") or None,
+            EMOTION_EWMA_ALPHA=float(os.getenv("EMOTION_EWMA_ALPHA", "0.2")),
+            SQLITE_POOL_SIZE=int(os.getenv("SQLITE_POOL_SIZE", "8")),
+            SQLITE_BUSY_TIMEOUT=float(os.getenv("SQLITE_BUSY_TIMEOUT", "5")),
+            SQLITE_WAL=_get_bool("SQLITE_WAL", True),
+            CHAT_DB_SHARDS=int(os.getenv("CHAT_DB_SHARDS", "1")),
+            HISTORY_TOKEN_BUDGET=int(os.getenv("HISTORY_TOKEN_BUDGET", "2000")),
+            WRITE_BEHIND_ENABLED=_get_bool("WRITE_BEHIND_ENABLED", False),
+            WRITE_BEHIND_BATCH_SIZE=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "64")),
+            WRITE_BEHIND_FLUSH_INTERVAL=float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.05")),
+            WRITE_BEHIND_MAX_QUEUE=int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000")),
+            SESSION_CACHE_MAX_SESSIONS=int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "1024")),
+            SESSION_CACHE_MAX_BYTES=int(os.getenv("SESSION_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+            ARCHIVE_TRIMMED_MESSAGES=_get_bool("ARCHIVE_TRIMMED_MESSAGES", True),
+            ARCHIVE_CHUNK_MESSAGES=int(os.getenv("ARCHIVE_CHUNK_MESSAGES", "200")),
+            SEARCH_INDEX_ENABLED=_get_bool("SEARCH_INDEX_ENABLED", True),
             C3KG_DATA_PATH=os.getenv("C3KG_DATA_PATH", default_c3kg_path),
+            PROMPT_CACHE_ENABLED=_get_bool("PROMPT_CACHE_ENABLED", False),
+            IDEMPOTENCY_TTL=float(os.getenv("IDEMPOTENCY_TTL", "300")),
+            CHAT_REQUEST_BUDGET=float(os.getenv("CHAT_REQUEST_BUDGET", "20")),
+            CHAT_LLM_RESERVE=float(os.getenv("CHAT_LLM_RESERVE", "5")),
+            CIRCUIT_FAILURE_RATIO=float(os.getenv("CIRCUIT_FAILURE_RATIO", "0.5")),
+            CIRCUIT_MIN_CALLS=int(os.getenv("CIRCUIT_MIN_CALLS", "5")),
+            CIRCUIT_WINDOW_SECONDS=float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60")),
+            CIRCUIT_OPEN_SECONDS=float(os.getenv("CIRCUIT_OPEN_SECONDS", "30")),
         )
 
 
@@ -2,13 +2,40 @@
 chat_record.py - 聊天记录模型（SQLite）
 
 兼容旧 app.py 的 chat_history.db 表结构：messages(session_id, role, content, created_at)
+表结构由 migrations.py 的版本化迁移维护（与旧实现共用 schema_version）。
+开启 WRITE_BEHIND_ENABLED 时每轮对话经 write_behind_utils 的队列异步批量提交，读取历史时叠加未提交的对话。
+最近活跃会话的历史缓存在进程内（session_cache_utils，写穿，清空 / 裁剪历史时失效）。
+裁剪出 messages 表的消息压缩归档到 message_archive（见 message_archive.py），分页读取和导出时接着读取归档。
+会话按 session_id 哈希分片到 CHAT_DB_SHARDS 个文件（shard_utils，与旧实现分片一致），按会话的读写只访问所在分片。
+写入消息的事务里同步更新全文检索索引（search_index.py，SEARCH_INDEX_ENABLED），归档的消息仍可检索。
 """
 
 from __future__ import annotations
 
+import atexit
 import os
-import sqlite3
-from typing import List, Dict
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+from .message_archive import (
+    archive_messages,
+    combine_archive_stats,
+    delete_archive,
+    get_archive_stats,
+    iter_full_history,
+    read_archived_before,
+)
+from .migrations import CHAT_HISTORY_MIGRATIONS, migrate
+from .search_index import delete_session_index, get_search_stats, index_new_messages, search_messages
+from ..utils.session_cache_utils import SessionHistoryCache
+from ..utils.shard_utils import ChatShards
+from ..utils.write_behind_utils import WriteBehindQueue
+
+_writers: List[WriteBehindQueue] = []
+_writer_checked = False
+_writer_lock = threading.Lock()
+_session_cache: Optional[SessionHistoryCache] = None
+_shards: Optional[ChatShards] = None
 
 
 def _db_path() -> str:
@@ -18,78 +45,363 @@ def _db_path() -> str:
     return os.path.join(project_root, "chat_history.db")
 
 
+def get_shards() -> ChatShards:
+    """聊天记录分片（分片数来自 Settings.CHAT_DB_SHARDS）"""
+    global _shards
+    if _shards is None:
+        with _writer_lock:
+            if _shards is None:
+                from ..config.settings import Settings
+
+                _shards = ChatShards(_db_path(), Settings.load().CHAT_DB_SHARDS)
+    return _shards
+
+
 def init_db() -> None:
-    conn = sqlite3.connect(_db_path())
-    try:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    """每个分片执行尚未执行的版本化迁移（见 migrations.py）；由应用工厂在启动时调用一次"""
+    shards = get_shards()
+    for index, path in enumerate(shards.paths):
+        conn = shards.connect_shard(index)
+        try:
+            migrate(conn, CHAT_HISTORY_MIGRATIONS, os.path.basename(path))
+        finally:
+            conn.close()
+
+
+def _get_conn(session_id: str):
+    # 会话所在分片的连接池借出（WAL 模式，线程内复用）；close() 归还
+    return get_shards().connect(session_id)
+
 
+def _get_writers() -> List[WriteBehindQueue]:
+    # 每个分片一个异步写入队列（未开启 WRITE_BEHIND_ENABLED 时为空）；首次调用时创建，进程退出时写完队列
+    global _writer_checked
+    if not _writer_checked:
+        shards = get_shards()
+        with _writer_lock:
+            if not _writer_checked:
+                from ..config.settings import Settings
 
-def _get_conn():
-    conn = sqlite3.connect(_db_path())
-    conn.row_factory = sqlite3.Row
-    return conn
+                settings = Settings.load()
+                if settings.WRITE_BEHIND_ENABLED:
+                    for index in range(shards.shard_count):
+                        writer = WriteBehindQueue(
+                            shards.connector(index),
+                            _write_turns,
+                            batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+                            flush_interval=settings.WRITE_BEHIND_FLUSH_INTERVAL,
+                            max_queue=settings.WRITE_BEHIND_MAX_QUEUE,
+                            name="chat-history-writer" if shards.shard_count == 1 else f"chat-history-writer-{index}",
+                        )
+                        atexit.register(writer.close)
+                        _writers.append(writer)
+                _writer_checked = True
+    return _writers
+
+
+def get_message_writer(session_id: str) -> Optional[WriteBehindQueue]:
+    """会话所在分片的异步写入队列（未开启 WRITE_BEHIND_ENABLED 时为 None）"""
+    writers = _get_writers()
+    return writers[get_shards().index(session_id)] if writers else None
+
+
+def get_session_cache() -> SessionHistoryCache:
+    """会话历史缓存（容量来自 Settings.SESSION_CACHE_*）"""
+    global _session_cache
+    if _session_cache is None:
+        with _writer_lock:
+            if _session_cache is None:
+                from ..config.settings import Settings
+
+                settings = Settings.load()
+                _session_cache = SessionHistoryCache(
+                    max_sessions=settings.SESSION_CACHE_MAX_SESSIONS,
+                    max_bytes=settings.SESSION_CACHE_MAX_BYTES,
+                )
+    return _session_cache
+
+
+def get_write_behind_stats() -> Optional[Any]:
+    # 未开启时为 None；分片时为每个分片一项的列表
+    writers = _get_writers()
+    if not writers:
+        return None
+    if len(writers) == 1:
+        return writers[0].get_stats()
+    return [writer.get_stats() for writer in writers]
+
+
+def _flush_pending_writes(session_id: str) -> None:
+    writer = get_message_writer(session_id)
+    if writer is not None and writer.has_pending(session_id):
+        writer.flush()
+
+
+def _index_new_messages(conn) -> None:
+    # 在写入消息的事务中把新消息加入全文检索索引（裁剪之前调用，被裁剪的消息也先进入索引）
+    from ..config.settings import Settings
+
+    if Settings.load().SEARCH_INDEX_ENABLED:
+        index_new_messages(conn)
 
 
 def save_message(session_id: str, role: str, content: str) -> None:
-    conn = _get_conn()
+    conn = _get_conn(session_id)
     try:
         conn.execute(
             "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
             (session_id, role, content),
         )
+        _index_new_messages(conn)
         conn.commit()
     finally:
         conn.close()
+    get_session_cache().invalidate(session_id)
+
 
+def get_session_history(session_id: str, limit: int = 50, max_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+    """
+    按时间升序返回最近 limit 条消息；只读取这 limit 行（ORDER BY id DESC LIMIT，走 (session_id, id) 索引）。
+    指定 max_tokens 时从最新的消息往前取，估算 token 数超出预算即停止。
+    """
+    messages = get_session_cache().get(session_id, limit, lambda count: _load_session_history(session_id, count))
+    if max_tokens is None:
+        return messages
 
-def get_session_history(session_id: str, limit: int = 50) -> List[Dict[str, str]]:
-    conn = _get_conn()
+    from ..services.prompt_service import estimate_message_tokens
+
+    history: List[Dict[str, str]] = []
+    used_tokens = 0
+    for message in reversed(messages):
+        used_tokens += estimate_message_tokens(message)
+        if used_tokens > max_tokens:
+            break
+        history.append(message)
+    history.reverse()
+    return history
+
+
+def _load_session_history(session_id: str, limit: int) -> List[Dict[str, str]]:
+    # 从数据库读取最近 limit 条（按时间升序）；开启异步写入时叠加该会话尚未提交的对话（读己之写）
+    def read_db():
+        conn = _get_conn(session_id)
+        try:
+            return conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    writer = get_message_writer(session_id)
+    if writer is None:
+        messages = [{"role": r["role"], "content": r["content"]} for r in read_db()]
+    else:
+        rows, pending = writer.read(session_id, read_db)
+        messages = [{"role": r["role"], "content": r["content"]} for r in rows]
+        for _, user_message, ai_reply, _ in pending:
+            messages[:0] = [{"role": "assistant", "content": ai_reply}, {"role": "user", "content": user_message}]
+        messages = messages[:limit]
+    messages.reverse()
+    return messages
+
+
+def get_history_page(session_id: str, before_id: Optional[int] = None, limit: int = 20) -> Dict[str, Any]:
+    """
+    keyset 分页读取会话历史（按消息 id 倒序翻页，耗时只与页大小有关；messages 表翻完后继续翻归档）
+
+    返回 {messages: 按时间升序的一页消息, has_more, next_before_id}；
+    has_more 为 True 时把 next_before_id 作为下一次的 before_id 读取更早的消息。
+    """
+    # 尚未提交的消息还没有 id，先等它们写入
+    _flush_pending_writes(session_id)
+    conn = _get_conn(session_id)
     try:
-        cur = conn.execute(
-            "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id ASC",
-            (session_id,),
-        )
-        rows = cur.fetchall()
-        history = [{"role": r["role"], "content": r["content"]} for r in rows]
-        if len(history) > limit:
-            history = history[-limit:]
-        return history
+        # 多取一条用来判断是否还有下一页
+        if before_id is None:
+            rows = conn.execute(
+                "SELECT id, role, content, created_at FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit + 1),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, role, content, created_at FROM messages WHERE session_id = ? AND id < ? "
+                "ORDER BY id DESC LIMIT ?",
+                (session_id, before_id, limit + 1),
+            ).fetchall()
+        rows = [dict(r) for r in rows]
+        if len(rows) <= limit:
+            # 更早的消息已被裁剪进归档（id 都小于 messages 表中剩余的消息）
+            upper = rows[-1]["id"] if rows else before_id
+            rows += reversed(read_archived_before(conn, session_id, upper, limit + 1 - len(rows)))
     finally:
         conn.close()
 
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "messages": rows[::-1],
+        "has_more": has_more,
+        "next_before_id": rows[-1]["id"] if has_more else None,
+    }
+
 
 def trim_history(session_id: str, max_items: int = 10) -> None:
-    conn = _get_conn()
+    conn = _get_conn(session_id)
     try:
-        cur = conn.execute("SELECT id FROM messages WHERE session_id = ? ORDER BY id ASC", (session_id,))
-        ids = [r["id"] for r in cur.fetchall()]
-        if len(ids) > max_items:
-            delete_ids = ids[0 : len(ids) - max_items]
-            conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in delete_ids])
-            conn.commit()
+        _trim_session(conn, session_id, max_items)
+        conn.commit()
     finally:
         conn.close()
+    get_session_cache().invalidate(session_id)
+
+
+def commit_turn(session_id: str, user_message: str, ai_reply: str, max_items: int = 10) -> int:
+    """
+    在一个事务中保存一轮对话：写入用户消息和 AI 回复、裁剪到最近 max_items 条。
+    返回裁剪后该会话的历史消息条数。
+    """
+    cache = get_session_cache()
+    writer = get_message_writer(session_id)
+    history_length: Optional[int] = None
+    with cache.writing(session_id):
+        if writer is not None:
+            # 异步写入：放入队列即返回，由后台线程批量提交
+            writer.submit(session_id, (session_id, user_message, ai_reply, max_items))
+        else:
+            conn = _get_conn(session_id)
+            try:
+                conn.executemany(
+                    "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+                    [(session_id, "user", user_message), (session_id, "assistant", ai_reply)],
+                )
+                _index_new_messages(conn)
+                history_length = _trim_session(conn, session_id, max_items)
+                conn.commit()
+            finally:
+                conn.close()
+        # 写穿：同步更新会话历史缓存
+        cache.append_turn(
+            session_id,
+            [{"role": "user", "content": user_message}, {"role": "assistant", "content": ai_reply}],
+            max_items,
+        )
+    if history_length is None:
+        history_length = len(get_session_history(session_id, limit=max_items))
+    return history_length
+
+
+def _write_turns(conn, turns: List[tuple]) -> None:
+    # 一批对话的消息一次插入，每个会话裁剪一次；由写入队列统一提交
+    conn.executemany(
+        "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+        [
+            row
+            for session_id, user_message, ai_reply, _ in turns
+            for row in ((session_id, "user", user_message), (session_id, "assistant", ai_reply))
+        ],
+    )
+    _index_new_messages(conn)
+    max_items = {session_id: keep for session_id, _, _, keep in turns}
+    for session_id, keep in max_items.items():
+        _trim_session(conn, session_id, keep)
+
+
+def _trim_session(conn, session_id: str, max_items: int) -> int:
+    # 按 (session_id, id) 索引定位第 max_items 新的消息，一条 DELETE 移出更早的消息（先压缩归档，
+    # ARCHIVE_TRIMMED_MESSAGES 关闭时直接删除）；调用方负责提交
+    from ..config.settings import Settings
+
+    row = conn.execute(
+        "SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+        (session_id, max_items - 1),
+    ).fetchone()
+    if row is None:
+        return conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+    settings = Settings.load()
+    if settings.ARCHIVE_TRIMMED_MESSAGES:
+        trimmed = conn.execute(
+            "SELECT id, role, content, created_at FROM messages WHERE session_id = ? AND id < ? ORDER BY id ASC",
+            (session_id, row["id"]),
+        ).fetchall()
+        archive_messages(conn, session_id, trimmed, chunk_size=settings.ARCHIVE_CHUNK_MESSAGES)
+    elif settings.SEARCH_INDEX_ENABLED:
+        # 不归档时被裁剪的消息不再可读，从检索索引中一并删除
+        delete_session_index(conn, session_id, before_id=row["id"])
+    conn.execute("DELETE FROM messages WHERE session_id = ? AND id < ?", (session_id, row["id"]))
+    return max_items
+
+
+def iter_session_messages(session_id: str) -> Iterator[Dict[str, Any]]:
+    """按时间顺序逐条读取会话的全部消息（先归档、再 messages 表），归档逐块解压，不一次读入内存"""
+    _flush_pending_writes(session_id)
+    yield from iter_full_history(lambda: _get_conn(session_id), session_id)
+
+
+def get_archive_status() -> Dict[str, Any]:
+    # 各分片归档统计的合计
+    shards = get_shards()
+    stats = []
+    for index in range(shards.shard_count):
+        conn = shards.connect_shard(index)
+        try:
+            stats.append(get_archive_stats(conn))
+        finally:
+            conn.close()
+    return combine_archive_stats(stats)
+
+
+def search_history(
+    query: str,
+    session_id: Optional[str] = None,
+    role: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> Dict[str, Any]:
+    """全文检索聊天记录（含归档的消息），结果结构见 search_index.search_messages"""
+    if session_id is not None:
+        # 只检索一个会话时先等它尚未提交的对话写入（读己之写）
+        _flush_pending_writes(session_id)
+    shards = get_shards()
+    return search_messages(
+        [shards.connector(index) for index in range(shards.shard_count)],
+        query,
+        session_id=session_id,
+        role=role,
+        limit=limit,
+        offset=offset,
+    )
+
+
+def get_search_status() -> Dict[str, Any]:
+    # 各分片全文检索索引的文档数和已索引水位
+    from ..config.settings import Settings
+
+    shards = get_shards()
+    stats = []
+    for index in range(shards.shard_count):
+        conn = shards.connect_shard(index)
+        try:
+            stats.append(get_search_stats(conn))
+        finally:
+            conn.close()
+    return {
+        "enabled": Settings.load().SEARCH_INDEX_ENABLED,
+        "documents": sum(s["documents"] for s in stats),
+        "shards": stats,
+    }
 
 
 def clear_history(session_id: str) -> None:
-    conn = _get_conn()
+    _flush_pending_writes(session_id)
+    conn = _get_conn(session_id)
     try:
         conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        delete_archive(conn, session_id)
+        delete_session_index(conn, session_id)
         conn.commit()
     finally:
         conn.close()
+    get_session_cache().invalidate(session_id)
 
 
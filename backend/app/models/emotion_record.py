@@ -0,0 +1,200 @@
+"""
+emotion_record.py - 用户情绪时间序列（SQLite）
+
+移植自旧 models.py 的情绪记录（不依赖旧代码），与旧实现共用 companion.db 中的表：
+- emotion_events：逐条记录情感分析结果（整数列，紧凑存储）
+- emotion_aggregates：每个用户一行，写入时增量更新极性 EWMA、连续负面条数
+- emotion_daily：按天、按标签计数，近 N 天的统计只读 N 天的行，不扫描历史
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+from ..utils.sqlite_utils import get_pool
+
+# 极性 EWMA 的平滑系数（越大越偏向最近几条消息）
+EMOTION_EWMA_ALPHA = 0.2
+# 近期情绪统计的天数窗口
+EMOTION_TREND_DAYS = 7
+
+_label_codes: Dict[str, int] = {}
+_label_lock = threading.Lock()
+
+
+def _db_path() -> str:
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.normpath(os.path.join(this_dir, "..", "..", ".."))
+    return os.path.join(project_root, "companion.db")
+
+
+def _get_conn():
+    # 连接池借出（WAL 模式，线程内复用）；close() 归还
+    return get_pool(_db_path()).connect()
+
+
+def init_emotion_db() -> None:
+    conn = _get_conn()
+    try:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS emotion_labels (
+                code INTEGER PRIMARY KEY,
+                label TEXT NOT NULL UNIQUE
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS emotion_events (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                polarity INTEGER NOT NULL,
+                label INTEGER NOT NULL,
+                confidence INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_emotion_events_user_ts ON emotion_events (user_id, ts)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS emotion_aggregates (
+                user_id TEXT PRIMARY KEY,
+                samples INTEGER NOT NULL,
+                ewma_polarity REAL NOT NULL,
+                negative_streak INTEGER NOT NULL,
+                last_polarity INTEGER NOT NULL,
+                last_label INTEGER NOT NULL,
+                last_ts INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS emotion_daily (
+                user_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                label INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                polarity_sum INTEGER NOT NULL,
+                PRIMARY KEY (user_id, day, label)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _label_code(conn: sqlite3.Connection, label: str) -> int:
+    code = _label_codes.get(label)
+    if code is not None:
+        return code
+    with _label_lock:
+        conn.execute("INSERT OR IGNORE INTO emotion_labels (label) VALUES (?)", (label,))
+        code = conn.execute("SELECT code FROM emotion_labels WHERE label = ?", (label,)).fetchone()["code"]
+        _label_codes[label] = code
+        return code
+
+
+def _label_names(conn: sqlite3.Connection, codes: Iterable[int]) -> Dict[int, str]:
+    codes = list(codes)
+    if set(codes) - set(_label_codes.values()):
+        with _label_lock:
+            for row in conn.execute("SELECT code, label FROM emotion_labels"):
+                _label_codes[row["label"]] = row["code"]
+    names = {code: label for label, code in _label_codes.items()}
+    return {code: names.get(code, "中性") for code in codes}
+
+
+def record_emotion(user_id: str, emotion_data: Optional[dict], alpha: float = EMOTION_EWMA_ALPHA) -> None:
+    """记录一条情感分析结果，并在同一事务中增量更新聚合（EWMA 在 SQL 中原地更新，不读旧值）"""
+    if not user_id or not emotion_data:
+        return
+    polarity = emotion_data.get("polarity", 1)
+    if polarity not in (0, 1, 2):
+        polarity = 1
+    score = polarity - 1  # -1 负面 / 0 中性 / 1 正面
+    confidence = int(round(float(emotion_data.get("confidence") or 0) * 100))
+    now = int(time.time())
+    day = datetime.now().strftime("%Y-%m-%d")
+
+    conn = _get_conn()
+    try:
+        label = _label_code(conn, emotion_data.get("emotion") or "中性")
+        conn.execute(
+            "INSERT INTO emotion_events (user_id, ts, polarity, label, confidence) VALUES (?, ?, ?, ?, ?)",
+            (user_id, now, polarity, label, confidence),
+        )
+        conn.execute(
+            """
+            INSERT INTO emotion_aggregates
+                (user_id, samples, ewma_polarity, negative_streak, last_polarity, last_label, last_ts)
+            VALUES (?, 1, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                samples = samples + 1,
+                ewma_polarity = ewma_polarity + ? * (excluded.ewma_polarity - ewma_polarity),
+                negative_streak = CASE WHEN excluded.last_polarity = 0 THEN negative_streak + 1 ELSE 0 END,
+                last_polarity = excluded.last_polarity,
+                last_label = excluded.last_label,
+                last_ts = excluded.last_ts
+            """,
+            (user_id, score, 1 if polarity == 0 else 0, polarity, label, now, alpha),
+        )
+        conn.execute(
+            """
+            INSERT INTO emotion_daily (user_id, day, label, count, polarity_sum)
+            VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT(user_id, day, label) DO UPDATE SET
+                count = count + 1,
+                polarity_sum = polarity_sum + excluded.polarity_sum
+            """,
+            (user_id, day, label, score),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_emotion_trend(user_id: str, days: int = EMOTION_TREND_DAYS) -> Optional[Dict]:
+    """
+    返回用户近期情绪（结构与旧 models.get_emotion_trend 一致）；没有记录时返回 None
+    只读聚合行和最近 days 天的按天计数。
+    """
+    conn = _get_conn()
+    try:
+        agg = conn.execute("SELECT * FROM emotion_aggregates WHERE user_id = ?", (user_id,)).fetchone()
+        if not agg:
+            return None
+        since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        rows = conn.execute(
+            "SELECT label, SUM(count) AS count, SUM(polarity_sum) AS polarity_sum FROM emotion_daily "
+            "WHERE user_id = ? AND day >= ? GROUP BY label",
+            (user_id, since),
+        ).fetchall()
+        names = _label_names(conn, [agg["last_label"]] + [r["label"] for r in rows])
+    finally:
+        conn.close()
+
+    recent_samples = sum(r["count"] for r in rows)
+    ewma = agg["ewma_polarity"]
+    return {
+        "samples": agg["samples"],
+        "ewma_polarity": round(ewma, 3),
+        "mood": "低落" if ewma <= -0.3 else ("积极" if ewma >= 0.3 else "平稳"),
+        "negative_streak": agg["negative_streak"],
+        "last_emotion": names[agg["last_label"]],
+        "last_at": datetime.fromtimestamp(agg["last_ts"]).isoformat(timespec="seconds"),
+        "recent": {
+            "days": days,
+            "samples": recent_samples,
+            "avg_polarity": round(sum(r["polarity_sum"] for r in rows) / recent_samples, 3) if recent_samples else None,
+            "labels": {names[r["label"]]: r["count"] for r in sorted(rows, key=lambda r: -r["count"])},
+        },
+    }
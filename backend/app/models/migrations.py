@@ -0,0 +1,130 @@
+"""
+migrations.py - 数据库版本化迁移
+
+移植自旧 services/migrations.py（不依赖旧代码）：
+- 表结构变更按版本号顺序执行一次，记录在 schema_version 表中；已发布的迁移不修改，新变更追加新版本
+- 与旧 app.py 共用 chat_history.db，CHAT_HISTORY_MIGRATIONS 的版本号与旧实现一一对应
+- 在应用工厂中启动时执行一次，不在请求路径上建表
+"""
+
+from __future__ import annotations
+
+import logging
+import sqlite3
+from typing import List, Sequence, Tuple
+
+
+logger = logging.getLogger("backend-models")
+
+# (版本号, 说明, SQL 语句)
+Migration = Tuple[int, str, Sequence[str]]
+
+# chat_history.db
+CHAT_HISTORY_MIGRATIONS: List[Migration] = [
+    (1, "创建 messages / session_summaries 表", [
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # 会话摘要：被裁剪的旧对话折叠成摘要，作为长期记忆
+        """
+        CREATE TABLE IF NOT EXISTS session_summaries (
+            session_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    # 按会话读取 / 裁剪 / 清空历史不再全表扫描（ORDER BY id 直接走索引）
+    (2, "messages 增加 (session_id, id) 复合索引", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id)",
+    ]),
+    # 裁剪出 messages 表的消息压缩归档（message_archive.py），按会话、按 id 分块
+    (3, "增加 message_archive 归档表", [
+        """
+        CREATE TABLE IF NOT EXISTS message_archive (
+            id INTEGER PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            first_message_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            raw_bytes INTEGER NOT NULL,
+            codec TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_message_archive_session ON message_archive (session_id, first_message_id)",
+    ]),
+    # 全文检索（search_index.py）：无内容 FTS5 索引 + 原文表 + 已索引水位；
+    # 水位从当前最大消息 id 开始，升级前的历史用项目根的 scripts/rebuild_search_index.py 补建
+    (4, "增加 message_search 全文检索索引", [
+        """
+        CREATE TABLE IF NOT EXISTS message_search_docs (
+            id INTEGER PRIMARY KEY,
+            message_id INTEGER NOT NULL,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_message_search_docs_session ON message_search_docs (session_id, message_id)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(tokens, content='', tokenize='unicode61')",
+        "CREATE TABLE IF NOT EXISTS search_index_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO search_index_state (name, value) "
+        "SELECT 'last_message_id', COALESCE(MAX(id), 0) FROM messages",
+    ]),
+]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """数据库当前的 schema 版本（从未迁移过时为 0）"""
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn: sqlite3.Connection, migrations: Sequence[Migration], name: str = "database") -> int:
+    """
+    执行尚未执行的迁移
+
+    参数:
+        conn: 数据库连接
+        migrations: 迁移列表（按版本号升序）
+        name: 数据库名称（用于日志）
+
+    返回:
+        迁移后的版本号
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+    conn.commit()
+    version = current_version(conn)
+    for target, description, statements in migrations:
+        if target <= version:
+            continue
+        # IMMEDIATE 先拿写锁，再确认版本号：多个进程同时启动时只有一个执行迁移
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = current_version(conn)
+            if target <= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (target, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+        logger.info("%s migrated to version %s: %s", name, target, description)
+    return version
@@ -0,0 +1,228 @@
+"""
+search_index.py - 聊天记录全文检索（SQLite FTS5）
+
+移植自旧 services/search_index.py（不依赖旧代码），与旧实现共用 chat_history.db 的 message_search 索引：
+- 中日韩字符按二元组（bigram）切分并附加末字（单字查询用前缀匹配），英文、数字按单词切分并转小写；
+  切分在 Python 中完成，FTS5 只用 unicode61 按空格分词，不依赖 ICU 等扩展；两边切分规则必须一致
+- message_search 是无内容（content=''）的 FTS5 表，原文、会话、角色、时间存在 message_search_docs（rowid 一一对应）
+- 写入消息的事务里调用 index_new_messages()，按 search_index_state 中的水位补齐新消息；
+  裁剪进归档的消息仍可检索，清空历史或不归档直接删除时从索引中删除
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ..utils.shard_utils import shard_index
+
+# 每页最多返回的结果数、最大翻页偏移
+SEARCH_PAGE_MAX = 50
+SEARCH_MAX_OFFSET = 500
+# 摘录（snippet）的长度（字符）
+SNIPPET_CHARS = 60
+
+# 按二元组切分的字符：CJK 统一汉字（含扩展 A、兼容汉字）、日文假名、韩文音节
+_CJK = "぀-ヿ㐀-䶿一-鿿豈-﫿가-힯"
+_TOKEN_RE = re.compile(f"[{_CJK}]+|(?:(?![{_CJK}])[^\\W_])+")
+_CJK_RE = re.compile(f"[{_CJK}]")
+
+
+def _runs(text: str) -> List[Tuple[bool, str]]:
+    """切成 (是否中日韩字符, 连续片段) 列表，已转小写"""
+    return [(bool(_CJK_RE.match(m.group())), m.group()) for m in _TOKEN_RE.finditer(text.lower())]
+
+
+def tokenize(text: str) -> List[str]:
+    """索引用的切分：中日韩字符切成二元组并附加末字，其他按单词"""
+    tokens: List[str] = []
+    for cjk, run in _runs(text):
+        if cjk:
+            tokens += [run[i:i + 2] for i in range(len(run) - 1)]
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """用户输入 -> FTS5 MATCH 表达式：空白分隔的每个词是一个短语，词之间为 AND；没有可检索的字符时返回 None"""
+    phrases = []
+    for term in query.split():
+        runs = _runs(term)
+        tokens: List[str] = []
+        for i, (cjk, run) in enumerate(runs):
+            if not cjk or len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens += [run[j:j + 2] for j in range(len(run) - 1)]
+                # 同一个词里后面还有别的片段时，文档中末字单独的 token 紧挨着后面的片段
+                if i < len(runs) - 1:
+                    tokens.append(run[-1])
+        if not tokens:
+            continue
+        phrase = '"' + " ".join(tokens) + '"'
+        # 以单个汉字结尾（如 "累"、"第3次"）：文档里该字是某个二元组的首字或单独的末字，用前缀匹配
+        if runs[-1][0] and len(runs[-1][1]) == 1:
+            phrase += " *"
+        phrases.append(phrase)
+    return " AND ".join(phrases) if phrases else None
+
+
+# ---------- 索引维护（都不提交，与消息写入在同一事务中） ----------
+
+
+def _index_rows(conn, rows: Iterable) -> int:
+    count = 0
+    for row in rows:
+        cursor = conn.execute(
+            "INSERT INTO message_search_docs (message_id, session_id, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+            (row["id"], row["session_id"], row["role"], row["content"], row["created_at"]),
+        )
+        conn.execute(
+            "INSERT INTO message_search (rowid, tokens) VALUES (?, ?)",
+            (cursor.lastrowid, " ".join(tokenize(row["content"]))),
+        )
+        count += 1
+    return count
+
+
+def index_new_messages(conn) -> int:
+    """把 id 大于已索引水位的新消息加入索引并推进水位；在写入消息之后、裁剪之前调用。返回新索引的条数"""
+    row = conn.execute("SELECT value FROM search_index_state WHERE name = 'last_message_id'").fetchone()
+    rows = conn.execute(
+        "SELECT id, session_id, role, content, created_at FROM messages WHERE id > ? ORDER BY id ASC",
+        (row[0] if row else 0,),
+    ).fetchall()
+    if not rows:
+        return 0
+    _index_rows(conn, rows)
+    conn.execute(
+        "INSERT OR REPLACE INTO search_index_state (name, value) VALUES ('last_message_id', ?)",
+        (rows[-1]["id"],),
+    )
+    return len(rows)
+
+
+def delete_session_index(conn, session_id: str, before_id: Optional[int] = None) -> int:
+    """从索引中删除会话的消息（before_id 不为空时只删除 id 小于它的消息）；返回删除的条数"""
+    sql = "SELECT id, content FROM message_search_docs WHERE session_id = ?"
+    params: list = [session_id]
+    if before_id is not None:
+        sql += " AND message_id < ?"
+        params.append(before_id)
+    rows = conn.execute(sql, params).fetchall()
+    if not rows:
+        return 0
+    conn.executemany(
+        "INSERT INTO message_search (message_search, rowid, tokens) VALUES ('delete', ?, ?)",
+        [(r["id"], " ".join(tokenize(r["content"]))) for r in rows],
+    )
+    conn.executemany("DELETE FROM message_search_docs WHERE id = ?", [(r["id"],) for r in rows])
+    return len(rows)
+
+
+# ---------- 检索 ----------
+
+
+def make_snippet(content: str, query: str, width: int = SNIPPET_CHARS) -> Tuple[str, List[List[int]]]:
+    """截取包含关键词的一段原文，返回 (摘录, 摘录中关键词的位置 [[开始, 结束), ...])"""
+    lower = content.lower()
+    terms = [t for t in query.lower().split() if t]
+    positions = [p for p in (lower.find(t) for t in terms) if p >= 0]
+    first = min(positions, default=0)
+    start = max(0, min(first - width // 3, len(content) - width))
+    end = min(len(content), start + width)
+    snippet = content[start:end]
+    window = lower[start:end]
+    highlights = []
+    for term in terms:
+        pos = window.find(term)
+        while pos >= 0:
+            highlights.append([pos, pos + len(term)])
+            pos = window.find(term, pos + len(term))
+    highlights.sort()
+    if start > 0:
+        snippet = "…" + snippet
+        highlights = [[a + 1, b + 1] for a, b in highlights]
+    if end < len(content):
+        snippet += "…"
+    return snippet, highlights
+
+
+def _search_shard(
+    connect: Callable, match: str, session_id: Optional[str], role: Optional[str], limit: int
+) -> List[Dict]:
+    sql = (
+        "SELECT d.message_id, d.session_id, d.role, d.content, d.created_at, bm25(message_search) AS score "
+        "FROM message_search JOIN message_search_docs d ON d.id = message_search.rowid "
+        "WHERE message_search MATCH ?"
+    )
+    params: list = [match]
+    if session_id is not None:
+        sql += " AND d.session_id = ?"
+        params.append(session_id)
+    if role is not None:
+        sql += " AND d.role = ?"
+        params.append(role)
+    sql += " ORDER BY score LIMIT ?"
+    params.append(limit)
+    conn = connect()
+    try:
+        return [dict(r) for r in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def search_messages(
+    connects: Sequence[Callable],
+    query: str,
+    session_id: Optional[str] = None,
+    role: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> Dict:
+    """
+    检索聊天记录，按相关度（bm25）排序分页，结果按会话分组；connects 为各分片获取连接的函数。
+
+    返回 {sessions: [{session_id, hits: [{id, role, created_at, snippet, highlights, score}]}],
+          total_hits: 本页条数, has_more, next_offset}
+    """
+    match = build_match_query(query)
+    hits: List[Dict] = []
+    if match:
+        # 每个分片取前 offset + limit + 1 条再合并（分片之间的 bm25 分数近似可比）
+        targets = [connects[shard_index(session_id, len(connects))]] if session_id is not None else connects
+        for connect in targets:
+            hits += _search_shard(connect, match, session_id, role, offset + limit + 1)
+        hits.sort(key=lambda h: h["score"])
+    page = hits[offset:offset + limit]
+    has_more = len(hits) > offset + limit
+
+    sessions: Dict[str, List[Dict]] = {}
+    for hit in page:
+        snippet, highlights = make_snippet(hit["content"], query)
+        sessions.setdefault(hit["session_id"], []).append(
+            {
+                "id": hit["message_id"],
+                "role": hit["role"],
+                "created_at": hit["created_at"],
+                "snippet": snippet,
+                "highlights": highlights,
+                "score": round(hit["score"], 4),
+            }
+        )
+    return {
+        "sessions": [{"session_id": sid, "hits": items} for sid, items in sessions.items()],
+        "total_hits": len(page),
+        "has_more": has_more,
+        "next_offset": offset + limit if has_more else None,
+    }
+
+
+def get_search_stats(conn) -> Dict:
+    row = conn.execute(
+        "SELECT (SELECT COUNT(*) FROM message_search_docs) AS documents, "
+        "(SELECT value FROM search_index_state WHERE name = 'last_message_id') AS last_message_id"
+    ).fetchone()
+    return {"documents": row["documents"], "last_message_id": row["last_message_id"] or 0}
@@ -7,10 +7,11 @@ user_memory.py - 用户推送偏好/记忆（SQLite）
 from __future__ import annotations
 
 import os
-import sqlite3
 from datetime import datetime
 from typing import Optional, Dict, List
 
+from ..utils.sqlite_utils import get_pool
+
 
 def _db_path() -> str:
     this_dir = os.path.dirname(os.path.abspath(__file__))
@@ -19,9 +20,8 @@ def _db_path() -> str:
 
 
 def _get_conn():
-    conn = sqlite3.connect(_db_path())
-    conn.row_factory = sqlite3.Row
-    return conn
+    # 连接池借出（WAL 模式，线程内复用）；close() 归还
+    return get_pool(_db_path()).connect()
 
 
 def init_user_schedule_db() -> None:
@@ -4,6 +4,7 @@ backend/app/routes - 路由层
 
 from flask import Flask
 
+from .admin import bp as admin_bp
 from .chat import bp as chat_bp
 from .persona import bp as persona_bp
 from .user import bp as user_bp
@@ -15,5 +16,6 @@ def register_blueprints(app: Flask) -> None:
     app.register_blueprint(persona_bp, url_prefix="/api")
     app.register_blueprint(user_bp, url_prefix="/api")
     app.register_blueprint(system_bp, url_prefix="/api")
+    app.register_blueprint(admin_bp, url_prefix="/api")
 
 
@@ -0,0 +1,89 @@
+"""
+admin.py - 管理接口（需要请求头 X-Admin-Token 与 ADMIN_TOKEN 一致；未配置 ADMIN_TOKEN 时关闭）
+提供：
+- /api/admin/export/chat       流式导出聊天记录（含归档）为 NDJSON
+- /api/admin/export/schedules  流式导出推送偏好为 NDJSON
+- /api/admin/search            跨会话全文检索聊天记录（客服排查用）
+"""
+
+from __future__ import annotations
+
+import hmac
+import logging
+import time
+from typing import Dict, Iterable
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+from ..services.export_service import iter_chat_records, iter_ndjson_bytes, iter_schedule_records
+from .chat import search_response
+
+logger = logging.getLogger("backend-admin")
+
+bp = Blueprint("admin", __name__)
+
+
+@bp.before_request
+def check_admin_token():
+    from ..config.settings import Settings
+
+    token = Settings.load().ADMIN_TOKEN
+    if not token:
+        return jsonify({"error": "未配置 ADMIN_TOKEN，管理接口已关闭"}), 403
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token):
+        return jsonify({"error": "管理口令错误"}), 401
+    return None
+
+
+def _ndjson_response(kind: str, records: Iterable[Dict]) -> Response:
+    # ?gzip=1 时 gzip 压缩；结束后记录导出行数和速度
+    compress = request.args.get("gzip", "").lower() in ("1", "true", "yes")
+    filename = f"{kind}.ndjson.gz" if compress else f"{kind}.ndjson"
+
+    def generate():
+        started = time.perf_counter()
+        rows = 0
+
+        def counted():
+            nonlocal rows
+            for record in records:
+                rows += 1
+                yield record
+
+        yield from iter_ndjson_bytes(kind, counted(), compress=compress)
+        elapsed = time.perf_counter() - started
+        logger.info("export %s: %s rows in %.2fs (%.0f rows/s)", filename, rows, elapsed, rows / elapsed if elapsed else 0)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+@bp.get("/admin/export/chat")
+def export_chat():
+    """GET /api/admin/export/chat?gzip=1&session_id=a&session_id=b（不指定 session_id 时导出全部会话）"""
+    from ..models.chat_record import get_shards, iter_session_messages
+
+    shards = get_shards()
+    records = iter_chat_records(
+        [shards.connector(index) for index in range(shards.shard_count)],
+        iter_session_messages,
+        session_ids=request.args.getlist("session_id") or None,
+    )
+    return _ndjson_response("chat", records)
+
+
+@bp.get("/admin/search")
+def search_chat():
+    """GET /api/admin/search?q=关键词&session_id=xxx&role=user&limit=20&offset=0（不指定 session_id 时检索全部会话）"""
+    return search_response(request.args.get("session_id") or None)
+
+
+@bp.get("/admin/export/schedules")
+def export_schedules():
+    """GET /api/admin/export/schedules?gzip=1"""
+    from ..models.user_memory import _get_conn
+
+    return _ndjson_response("schedules", iter_schedule_records(_get_conn))
@@ -6,12 +6,21 @@ chat.py - 聊天相关路由
 - GET  /test        测试页
 - GET  /health      健康检查（backend 工厂服务标识）
 - POST /api/chat    聊天接口（与旧 app.py 保持返回结构兼容）
+- GET  /api/history 分页读取会话历史（keyset 分页，与旧 app.py 一致）
+- GET  /api/search  全文检索一个会话的聊天记录（FTS5，与旧 app.py 一致；跨会话检索见 admin.py）
 """
 
+from typing import Optional
+
 from flask import Blueprint, jsonify, render_template, request
 
 bp = Blueprint("chat", __name__)
 
+# 预留 LLM 预算后剩余不足该值（秒）时跳过情感分析
+EMOTION_MIN_BUDGET = 0.5
+# 分页历史接口每页最多返回的消息数
+HISTORY_PAGE_MAX = 100
+
 
 @bp.get("/")
 def index():
@@ -32,14 +41,16 @@ def health():
 def api_chat():
     """
     兼容旧接口：POST /api/chat
-    请求体: {message, session_id, persona_id}
+    请求体: {message, session_id, persona_id, idempotency_key?}
     响应: {status, reply, emotion, session_id, history_length}
+
+    幂等键（请求头 Idempotency-Key 或请求体 idempotency_key）：重发的同一条消息复用第一次的结果。
+    整轮对话共用 CHAT_REQUEST_BUDGET 秒的预算，各阶段只使用剩余预算。
     """
     from ..utils.request_utils import get_json_required
-    from ..models.chat_record import init_db, get_session_history, save_message, trim_history
-    from ..services.emotion_service import analyze_emotion
-    from ..services.llm_service import get_reply
-    from .persona import get_persona_prompt
+    from ..config.settings import Settings
+    from ..services.idempotency_service import IdempotencyConflict, get_idempotency_store, make_fingerprint
+    from ..utils.deadline_utils import Deadline
 
     try:
         data = get_json_required(request)
@@ -50,37 +61,131 @@ def api_chat():
         session_id = data.get("session_id", "default_user")
         persona_id = data.get("persona_id", "warm_partner")
 
-        init_db()
-        history = get_session_history(session_id)
-
-        emotion_data = analyze_emotion(user_message)
-        system_prompt = get_persona_prompt(persona_id)
-
-        ai_reply = get_reply(
-            user_message=user_message,
-            conversation_history=history,
-            emotion_data=emotion_data,
-            system_prompt=system_prompt,
-        )
-
-        save_message(session_id, "user", user_message)
-        save_message(session_id, "assistant", ai_reply)
-        trim_history(session_id, max_items=10)
-        history2 = get_session_history(session_id)
-
-        return jsonify(
-            {
-                "reply": ai_reply,
-                "status": "success",
-                "session_id": session_id,
-                "history_length": len(history2),
-                "emotion": emotion_data,
-                "emotion_type": type(emotion_data).__name__ if emotion_data is not None else "NoneType",
-            }
-        )
+        idempotency_key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+        deadline = Deadline(Settings.load().CHAT_REQUEST_BUDGET)
+        if not idempotency_key:
+            return jsonify(_process_chat_turn(user_message, session_id, persona_id, deadline))
+
+        try:
+            payload, replayed = get_idempotency_store().run(
+                f"{session_id}:{idempotency_key}",
+                make_fingerprint({"message": user_message, "persona_id": persona_id}),
+                lambda: _process_chat_turn(user_message, session_id, persona_id, deadline),
+            )
+        except IdempotencyConflict as e:
+            return jsonify({"error": str(e)}), 422
+        resp = jsonify(payload)
+        resp.headers["Idempotent-Replayed"] = "true" if replayed else "false"
+        return resp
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"服务器内部错误: {str(e)}"}), 500
 
 
+def _process_chat_turn(user_message: str, session_id: str, persona_id: str, deadline=None) -> dict:
+    from ..config.settings import Settings
+    from ..models.chat_record import commit_turn, get_session_history
+    from ..models.emotion_record import get_emotion_trend, record_emotion
+    from ..services.emotion_service import analyze_emotion
+    from ..services.llm_service import get_reply
+    from .persona import get_persona_prompt
+
+    # 只读取上下文预算内的最近消息
+    history = get_session_history(session_id, max_tokens=Settings.load().HISTORY_TOKEN_BUDGET)
+
+    # 情感分析是可选阶段：给 LLM 预留 CHAT_LLM_RESERVE 秒后预算不足时跳过
+    emotion_data = None
+    emotion_deadline = deadline.child(Settings.load().CHAT_LLM_RESERVE) if deadline is not None else None
+    if emotion_deadline is None or emotion_deadline.allows(EMOTION_MIN_BUDGET):
+        emotion_data = analyze_emotion(user_message, emotion_deadline)
+    system_prompt = get_persona_prompt(persona_id)
+    # 用户近期情绪（增量维护的聚合，不扫描历史；不含本条消息）
+    emotion_trend = get_emotion_trend(session_id)
+
+    ai_reply = get_reply(
+        user_message=user_message,
+        conversation_history=history,
+        emotion_data=emotion_data,
+        system_prompt=system_prompt,
+        deadline=deadline,
+        emotion_trend=emotion_trend,
+    )
+
+    # 用户消息、AI 回复和历史裁剪在同一事务中写入
+    history_length = commit_turn(session_id, user_message, ai_reply, max_items=10)
+    if emotion_data:
+        record_emotion(session_id, emotion_data, alpha=Settings.load().EMOTION_EWMA_ALPHA)
+
+    return {
+        "reply": ai_reply,
+        "status": "success",
+        "session_id": session_id,
+        "history_length": history_length,
+        "emotion": emotion_data,
+        "emotion_type": type(emotion_data).__name__ if emotion_data is not None else "NoneType",
+    }
+
+
+@bp.get("/api/history")
+def api_history():
+    """
+    分页读取会话历史：GET /api/history?session_id=xxx&limit=20&before_id=123
+
+    响应: {status, session_id, messages, has_more, next_before_id}
+    messages 按时间升序；has_more 为 true 时把 next_before_id 作为下一次请求的 before_id。
+    """
+    from ..models.chat_record import get_history_page
+
+    session_id = request.args.get("session_id", "default_user")
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), HISTORY_PAGE_MAX)
+        before_id = request.args.get("before_id")
+        before_id = int(before_id) if before_id else None
+    except ValueError:
+        return jsonify({"error": "limit 和 before_id 必须是整数"}), 400
+
+    page = get_history_page(session_id, before_id=before_id, limit=limit)
+    return jsonify({"status": "success", "session_id": session_id, **page})
+
+
+@bp.get("/api/search")
+def api_search():
+    """
+    全文检索一个会话的聊天记录：GET /api/search?q=关键词&session_id=xxx&role=user&limit=20&offset=0
+
+    响应: {status, query, sessions: [{session_id, hits: [{id, role, created_at, snippet, highlights, score}]}],
+           total_hits, has_more, next_offset}
+    session_id 必填；q 中空白分隔的多个词需同时出现；结果按相关度排序、按会话分组，
+    has_more 为 true 时把 next_offset 作为下一次的 offset。
+    """
+    session_id = request.args.get("session_id")
+    if not session_id:
+        return jsonify({"error": "请提供会话ID session_id"}), 400
+    return search_response(session_id)
+
+
+def search_response(session_id: Optional[str]):
+    """解析检索参数并检索；session_id 为 None 时检索全部会话（仅管理接口使用）"""
+    from ..models.chat_record import search_history
+    from ..models.search_index import SEARCH_MAX_OFFSET, SEARCH_PAGE_MAX
+
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "请提供检索关键词 q"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), SEARCH_PAGE_MAX)
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "limit 和 offset 必须是整数"}), 400
+    if not 0 <= offset <= SEARCH_MAX_OFFSET:
+        return jsonify({"error": f"offset 需在 0 ~ {SEARCH_MAX_OFFSET} 之间"}), 400
+
+    result = search_history(
+        query,
+        session_id=session_id,
+        role=request.args.get("role") or None,
+        limit=limit,
+        offset=offset,
+    )
+    return jsonify({"status": "success", "query": query, **result})
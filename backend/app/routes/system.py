@@ -3,12 +3,18 @@ system.py - 系统状态相关路由
 提供：
 - /api/websocket/status
 - /api/scheduler/status
+- /api/emotion/status
+- /api/storage/status
+- /api/llm/status
 """
 
 from flask import Blueprint, jsonify
 
 from ..services.socketio_service import get_connection_stats
 from ..services.scheduler_service import get_scheduler_status
+from ..services.emotion_cache_service import get_emotion_cache
+from ..services.emotion_service import get_token_stats
+from ..utils.circuit_breaker_utils import get_breaker_states
 
 
 bp = Blueprint("system", __name__)
@@ -24,3 +30,42 @@ def scheduler_status():
     return jsonify({"status": "success", "scheduler": get_scheduler_status()})
 
 
+@bp.get("/emotion/status")
+def emotion_status():
+    from ..config.settings import Settings
+
+    return jsonify({
+        "status": "success",
+        "emotion": {
+            "mode": Settings.load().EMOTION_MODE,
+            "cache": get_emotion_cache().get_stats(),
+            "token": get_token_stats(),
+            "circuit_breaker": get_breaker_states().get("baidu_emotion"),
+        },
+    })
+
+
+@bp.get("/storage/status")
+def storage_status():
+    from ..models.chat_record import get_archive_status, get_search_status, get_session_cache, get_write_behind_stats
+    from ..utils.sqlite_utils import get_pool_stats
+
+    return jsonify({
+        "status": "success",
+        "sqlite": get_pool_stats(),
+        "write_behind": get_write_behind_stats(),
+        "session_cache": get_session_cache().get_stats(),
+        "archive": get_archive_status(),
+        "search": get_search_status(),
+    })
+
+
+@bp.get("/llm/status")
+def llm_status():
+    from ..config.settings import Settings
+
+    return jsonify({
+        "status": "success",
+        "provider": (Settings.load().AI_PROVIDER or "deepseek").strip().lower(),
+        "circuit_breakers": get_breaker_states(),
+    })
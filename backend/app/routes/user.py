@@ -73,3 +73,15 @@ def disable_user_schedule():
     return jsonify({"status": "success", "message": f"已禁用 {push_type} 推送"})
 
 
+@bp.get("/user/emotion_trend")
+def user_emotion_trend():
+    """
+    兼容旧接口：GET /api/user/emotion_trend?user_id=
+    返回极性 EWMA、连续负面条数、近 7 天各情绪标签的条数
+    """
+    from ..models.emotion_record import get_emotion_trend
+
+    user_id = request.args.get("user_id")
+    if not user_id:
+        return jsonify({"status": "error", "message": "缺少 user_id"}), 400
+    return jsonify({"status": "success", "trend": get_emotion_trend(user_id)})
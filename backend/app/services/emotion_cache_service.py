@@ -0,0 +1,210 @@
+"""
+emotion_cache_service.py - 情感分析结果缓存
+
+移植自旧 services/emotion_cache.py（不依赖旧代码）：
+- 归一化文本作为缓存键（全半角、大小写、空白/标点/表情折叠，过长的消息不缓存）
+- 有界 LRU + TTL，可选持久化到 SQLite（EMOTION_CACHE_DB）
+- 统计命中率和节省的延迟
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+logger = logging.getLogger("backend-emotion")
+
+# 归一化后超过该长度的消息不缓存
+DEFAULT_MAX_KEY_LENGTH = 32
+# 连续重复字符最多保留几个（“哈哈哈哈哈” -> “哈哈哈”）
+MAX_CHAR_REPEAT = 3
+
+
+def normalize_text(text: str, max_length: int = DEFAULT_MAX_KEY_LENGTH) -> Optional[str]:
+    """
+    把消息归一化为缓存键
+
+    参数:
+        text: 原始消息
+        max_length: 归一化后的长度上限
+
+    返回:
+        缓存键；消息为空或过长（不值得缓存）时返回 None
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    chars = []
+    for ch in text:
+        category = unicodedata.category(ch)
+        # 去掉空白(Z*)、标点(P*)、符号/表情(S*)、控制与格式字符(C*，含零宽连接符和变体选择符)
+        if category[0] in ("Z", "P", "S", "C"):
+            continue
+        if len(chars) >= MAX_CHAR_REPEAT and all(c == ch for c in chars[-MAX_CHAR_REPEAT:]):
+            continue
+        chars.append(ch)
+        if len(chars) > max_length:
+            return None
+    return "".join(chars) or None
+
+
+class EmotionCache:
+    """情感分析结果缓存（线程安全）"""
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 7 * 86400,
+                 max_key_length: int = DEFAULT_MAX_KEY_LENGTH, db_path: Optional[str] = None):
+        """
+        参数:
+            max_entries: 最多缓存的条目数（LRU 淘汰）
+            ttl: 每条结果的有效期（秒）
+            max_key_length: 归一化后超过该长度的消息不缓存
+            db_path: SQLite 持久化文件，为空时只缓存在内存中
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_key_length = max_key_length
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # {键: (结果, 过期时间)}
+
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.evictions = 0
+        self._miss_seconds = 0.0
+        self._stored_misses = 0
+
+        if self.db_path:
+            self._load()
+
+    def key(self, text: str) -> Optional[str]:
+        """计算缓存键（None 表示该消息不缓存）"""
+        key = normalize_text(text, self.max_key_length)
+        if key is None:
+            with self._lock:
+                self.uncacheable += 1
+        return key
+
+    def get(self, key: Optional[str]) -> Optional[dict]:
+        """读取缓存（返回结果的副本），未命中返回 None"""
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[0])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Optional[str], result: dict, latency: float = 0.0) -> None:
+        """
+        写入一条接口返回的结果
+
+        参数:
+            key: 缓存键（None 时只记录耗时）
+            result: 情感分析结果
+            latency: 本次接口调用耗时（秒），用于估算命中节省的延迟
+        """
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._miss_seconds += latency
+            self._stored_misses += 1
+            if key is None:
+                return
+            self._entries[key] = (dict(result), expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        if self.db_path:
+            self._persist(key, result, expires_at)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS emotion_cache ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        return conn
+
+    def _load(self) -> None:
+        """启动时从 SQLite 加载未过期的条目（最近过期的优先淘汰）"""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = self._connect()
+            try:
+                now = time.time()
+                conn.execute("DELETE FROM emotion_cache WHERE expires_at <= ?", (now,))
+                conn.commit()
+                rows = conn.execute(
+                    "SELECT key, result, expires_at FROM emotion_cache ORDER BY expires_at DESC LIMIT ?",
+                    (self.max_entries,)
+                ).fetchall()
+            finally:
+                conn.close()
+            for key, result, expires_at in reversed(rows):
+                self._entries[key] = (json.loads(result), expires_at)
+            logger.info("emotion cache loaded %s entries from %s", len(rows), self.db_path)
+        except (sqlite3.Error, ValueError, OSError) as e:
+            logger.warning("failed to load emotion cache, starting empty: %s", e)
+
+    def _persist(self, key: str, result: dict, expires_at: float) -> None:
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO emotion_cache (key, result, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(result, ensure_ascii=False), expires_at)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning("failed to persist emotion cache entry: %s", e)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_miss = self._miss_seconds / self._stored_misses if self._stored_misses else 0.0
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "uncacheable": self.uncacheable,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "avg_miss_latency": round(avg_miss, 4),
+                "saved_seconds": round(self.hits * avg_miss, 3),
+                "persistent": bool(self.db_path),
+            }
+
+
+_cache: Optional[EmotionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_emotion_cache() -> EmotionCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from ..config.settings import Settings
+
+                settings = Settings.load()
+                _cache = EmotionCache(
+                    max_entries=settings.EMOTION_CACHE_SIZE,
+                    ttl=settings.EMOTION_CACHE_TTL,
+                    db_path=settings.EMOTION_CACHE_DB,
+                )
+    return _cache
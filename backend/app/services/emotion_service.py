@@ -3,56 +3,71 @@ emotion_service.py - 情感分析服务层
 
 第 3 步：服务层内聚实现
 - 直接在 backend/services 内实现百度情感分析（不再依赖旧 config.py / 旧 services）。
+- 默认使用本地分类器（local_emotion_service），EMOTION_MODE=baidu 时同步调用百度接口。
+- 百度接口由熔断器保护：故障期间直接返回中性结果，不再每个请求都等到超时。
 """
 
 from __future__ import annotations
 
+import logging
 import time
 from typing import Optional
 
 import requests
 
 from ..config.settings import Settings
+from .baidu_token_service import INVALID_TOKEN_ERROR_CODES, BaiduTokenManager, TokenUnavailable
+from .emotion_cache_service import EmotionCache, get_emotion_cache
+from ..utils.circuit_breaker_utils import CircuitBreaker, get_breaker
+from ..utils.deadline_utils import Deadline, stage_timeout
+
+
+logger = logging.getLogger("backend-emotion")
 
 
 class BaiduEmotionAnalyzer:
     """百度AI情感倾向分析工具类（移植自旧实现，保持返回结构一致）"""
 
-    def __init__(self, api_key: str, secret_key: str):
+    def __init__(self, api_key: str, secret_key: str, base_url: str = "https://aip.baidubce.com",
+                 cache: Optional[EmotionCache] = None, token_manager: Optional[BaiduTokenManager] = None):
         self.api_key = api_key
         self.secret_key = secret_key
-        self.access_token: Optional[str] = None
-        self.token_expire_time = 0.0
-
-    def _get_access_token(self) -> str:
-        token_url = (
-            "https://aip.baidubce.com/oauth/2.0/token"
-            f"?grant_type=client_credentials&client_id={self.api_key}&client_secret={self.secret_key}"
-        )
-        resp = requests.get(token_url, timeout=10)
-        resp.raise_for_status()
-        result = resp.json()
-        if "access_token" not in result:
-            raise RuntimeError(f"获取Token失败：{result}")
-        self.access_token = result["access_token"]
-        # expires_in 单位秒，提前 1 天过期
-        self.token_expire_time = time.time() + (float(result.get("expires_in", 0)) - 86400.0)
-        return self.access_token
-
-    def analyze_emotion(self, text: str) -> dict:
-        if not self.access_token or time.time() > self.token_expire_time:
-            self._get_access_token()
+        self.base_url = base_url.rstrip("/")
+        self.cache = cache if cache is not None else get_emotion_cache()
+        # Token 由后台线程获取和提前刷新，请求线程只读取
+        self.tokens = token_manager or BaiduTokenManager(api_key, secret_key, self.base_url)
+        self.tokens.start()
+
+    def analyze_emotion(self, text: str, deadline: Optional[Deadline] = None) -> dict:
+        cache_key = self.cache.key(text)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        started = time.monotonic()
+
+        # 不请求网络；冷启动还没拿到 Token 时抛出 TokenUnavailable，由调用方按中性处理
+        access_token = self.tokens.get_token()
 
         emotion_url = (
-            "https://aip.baidubce.com/rpc/2.0/nlp/v1/sentiment_classify"
-            f"?access_token={self.access_token}"
+            f"{self.base_url}/rpc/2.0/nlp/v1/sentiment_classify"
+            f"?access_token={access_token}"
         )
         payload = {"text": text, "mode": "precise"}
-        resp = requests.post(emotion_url, json=payload, timeout=10)
-        resp.raise_for_status()
-        result = resp.json()
+        breaker = get_breaker("baidu_emotion")
+        if not breaker.allow():
+            # 熔断期间直接返回中性结果，不再等待网络超时
+            logger.info("baidu emotion skipped: circuit open")
+            return {"polarity": 1, "confidence": 0.9, "emotion": "中性"}
+        try:
+            resp = requests.post(emotion_url, json=payload, timeout=stage_timeout(deadline, 10, "百度情感分析"))
+            resp.raise_for_status()
+            result = resp.json()
+        except Exception:
+            self._record_failure(breaker, deadline)
+            raise
 
         if "items" in result and result["items"]:
+            breaker.record_success()
             item = result["items"][0]
             emotion_result = {
                 "polarity": item.get("sentiment", 1),
@@ -76,32 +91,72 @@ class BaiduEmotionAnalyzer:
                 emotion_result["emotion"] = emotion_map.get(str(emotion_result["emotion"]).lower(), "中性")
             except Exception:
                 emotion_result["emotion"] = "中性"
+            self.cache.put(cache_key, emotion_result, time.monotonic() - started)
             return emotion_result
 
-        return {"polarity": 1, "confidence": 0.9, "emotion": "中性"}
+        emotion_result = {"polarity": 1, "confidence": 0.9, "emotion": "中性"}
+        if "error_code" in result:
+            # 接口报错（令牌失效、QPS 超限等）计一次熔断器失败，结果不缓存
+            breaker.record_failure()
+            if result.get("error_code") in INVALID_TOKEN_ERROR_CODES:
+                self.tokens.invalidate(access_token)
+            return emotion_result
+        # 接口正常但没有情绪结果：按中性处理
+        breaker.record_success()
+        self.cache.put(cache_key, emotion_result, time.monotonic() - started)
+        return emotion_result
+
+    @staticmethod
+    def _record_failure(breaker: CircuitBreaker, deadline: Optional[Deadline]) -> None:
+        # 请求预算耗尽导致的超时不算百度接口的失败，只释放熔断器的试探名额
+        if deadline is not None and deadline.expired():
+            breaker.release()
+        else:
+            breaker.record_failure()
 
 
 _analyzer: Optional[BaiduEmotionAnalyzer] = None
 
 
-def analyze_emotion(text: str) -> Optional[dict]:
+def analyze_emotion(text: str, deadline: Optional[Deadline] = None) -> Optional[dict]:
     """
     返回与旧后端一致的结构：
     { polarity: 0/1/2, confidence: 0-1, emotion: 中文标签 }
-    未配置百度 Key 时返回 None（保持“可选”特性）。
+    EMOTION_MODE=local（默认）时使用本地分类器，不走网络；
+    EMOTION_MODE=baidu 时调用百度接口，未配置百度 Key 时返回 None（保持“可选”特性）。
+    deadline 为请求截止时间，Token 和情感分析请求只使用剩余预算。
     """
     global _analyzer
     settings = Settings.load()
+    if settings.EMOTION_MODE != "baidu":
+        from .local_emotion_service import get_local_classifier
+
+        return get_local_classifier(settings.EMOTION_MODEL_PATH).analyze_emotion(text)
     if not settings.BAIDU_API_KEY or not settings.BAIDU_SECRET_KEY:
         return None
 
     if _analyzer is None:
-        _analyzer = BaiduEmotionAnalyzer(settings.BAIDU_API_KEY, settings.BAIDU_SECRET_KEY)
+        token_manager = BaiduTokenManager(
+            settings.BAIDU_API_KEY,
+            settings.BAIDU_SECRET_KEY,
+            settings.BAIDU_BASE_URL,
+            store_path=settings.BAIDU_TOKEN_STORE,
+            refresh_margin=settings.BAIDU_TOKEN_REFRESH_MARGIN,
+        )
+        _analyzer = BaiduEmotionAnalyzer(
+            settings.BAIDU_API_KEY, settings.BAIDU_SECRET_KEY, settings.BAIDU_BASE_URL, token_manager=token_manager
+        )
 
     try:
-        return _analyzer.analyze_emotion(text)
+        return _analyzer.analyze_emotion(text, deadline)
+    except TokenUnavailable as e:
+        logger.info("baidu emotion skipped: %s", e)
+        return {"polarity": 1, "confidence": 0.9, "emotion": "中性"}
     except Exception:
         # 保持稳定：异常时不让接口崩
         return {"polarity": 1, "confidence": 0.9, "emotion": "中性"}
 
 
+def get_token_stats() -> Optional[dict]:
+    """百度 Access Token 状态（尚未创建百度分析器时返回 None）"""
+    return _analyzer.tokens.get_stats() if _analyzer is not None else None
@@ -0,0 +1,136 @@
+"""
+export_service.py - 聊天记录 / 推送偏好 NDJSON 流式导出
+
+移植自旧 services/data_export.py 的导出部分（不依赖旧代码），输出格式与旧实现相同（FORMAT_VERSION 一致），
+可用项目根的 scripts/ndjson_data.py import 导入：
+- 会话 ID、用户 ID 按主键 keyset 翻页，消息经 iter_full_history 逐块读取，内存占用与数据总量无关
+- 每个会话依次输出 session、message（按时间顺序）、summary 记录；summary.folded_messages 为已折叠进摘要的消息条数
+"""
+
+from __future__ import annotations
+
+import json
+import zlib
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, Optional, Sequence
+
+from ..utils.shard_utils import shard_index
+
+FORMAT_VERSION = 1
+KEYSET_PAGE_SIZE = 500
+STREAM_CHUNK_BYTES = 64 * 1024
+
+SESSION_TABLES = ("messages", "session_summaries", "message_archive")
+
+
+def iter_session_ids(connect: Callable, page_size: int = KEYSET_PAGE_SIZE) -> Iterator[str]:
+    """按 session_id 升序列出数据库中的全部会话（消息、摘要、归档任一表中有数据即算）"""
+    after = ""
+    while True:
+        conn = connect()
+        try:
+            pages = [
+                [
+                    r[0]
+                    for r in conn.execute(
+                        f"SELECT DISTINCT session_id FROM {table} WHERE session_id > ? ORDER BY session_id LIMIT ?",
+                        (after, page_size),
+                    )
+                ]
+                for table in SESSION_TABLES
+            ]
+        finally:
+            conn.close()
+        # 取满一页的表只能保证到本页最后一个 ID，超出部分留到下一页
+        full = [page[-1] for page in pages if len(page) == page_size]
+        bound = min(full) if full else None
+        ids = sorted({sid for page in pages for sid in page if bound is None or sid <= bound})
+        if not ids:
+            return
+        yield from ids
+        after = ids[-1]
+
+
+def _read_summary(connect: Callable, session_id: str) -> Optional[Dict]:
+    conn = connect()
+    try:
+        row = conn.execute(
+            "SELECT summary, last_message_id, updated_at FROM session_summaries WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def iter_chat_records(
+    connects: Sequence[Callable],
+    iter_messages: Callable[[str], Iterator[Dict]],
+    session_ids: Optional[Iterable[str]] = None,
+) -> Iterator[Dict]:
+    """导出聊天记录（不含 meta 行）；connects 为各分片获取连接的函数，session_ids 为空时导出全部会话"""
+    if session_ids is None:
+        session_ids = (sid for connect in connects for sid in iter_session_ids(connect))
+    for session_id in session_ids:
+        connect = connects[shard_index(session_id, len(connects))]
+        yield {"type": "session", "session_id": session_id}
+        summary = _read_summary(connect, session_id)
+        folded = 0
+        for message in iter_messages(session_id):
+            if summary and message["id"] <= summary["last_message_id"]:
+                folded += 1
+            yield {"type": "message", "session_id": session_id, **message}
+        if summary:
+            yield {
+                "type": "summary",
+                "session_id": session_id,
+                "summary": summary["summary"],
+                "folded_messages": folded,
+                "updated_at": summary["updated_at"],
+            }
+
+
+def iter_schedule_records(connect: Callable, page_size: int = KEYSET_PAGE_SIZE) -> Iterator[Dict]:
+    """导出 user_schedule（按 user_id keyset 翻页）"""
+    after = ""
+    while True:
+        conn = connect()
+        try:
+            rows = [
+                dict(r)
+                for r in conn.execute(
+                    "SELECT * FROM user_schedule WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, page_size)
+                )
+            ]
+        finally:
+            conn.close()
+        for row in rows:
+            yield {"type": "schedule", **row}
+        if len(rows) < page_size:
+            return
+        after = rows[-1]["user_id"]
+
+
+def _encode(record: Dict) -> bytes:
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def iter_ndjson_bytes(kind: str, records: Iterable[Dict], compress: bool = False) -> Iterator[bytes]:
+    """NDJSON 字节流（第一行为 meta），每次输出约 STREAM_CHUNK_BYTES；compress 时为 gzip 格式"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = bytearray(_encode({
+        "type": "meta",
+        "format": FORMAT_VERSION,
+        "kind": kind,
+        "exported_at": datetime.now().isoformat(),
+    }))
+    for record in records:
+        buffer += _encode(record)
+        if len(buffer) >= STREAM_CHUNK_BYTES:
+            data = compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+            buffer.clear()
+            if data:
+                yield data
+    tail = compressor.compress(bytes(buffer)) + compressor.flush() if compressor else bytes(buffer)
+    if tail:
+        yield tail
@@ -0,0 +1,100 @@
+"""
+idempotency_service.py - /api/chat 幂等键
+
+移植自旧 services/idempotency.py（不依赖旧代码）：
+- 同一个幂等键的请求正在处理时，重复请求等待并共享第一次的结果
+- 已完成的结果保留 IDEMPOTENCY_TTL 秒，重试直接返回
+- 同一个键对应不同请求内容时视为冲突
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+def make_fingerprint(payload: Dict[str, Any]) -> str:
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.expires_at = 0.0
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: float = 300.0, max_entries: int = 2048):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _Entry] = {}
+        self._done: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    def run(self, key: str, fingerprint: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """返回 (结果, 是否为重放)；fn 失败时结果不保留，重复请求收到同样的异常"""
+        with self._lock:
+            entry = self._done.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                del self._done[key]
+                entry = None
+            entry = entry or self._inflight.get(key)
+            if entry is not None and entry.fingerprint != fingerprint:
+                raise IdempotencyConflict(f"幂等键 {key} 已用于不同的请求")
+            if entry is not None and entry.event.is_set():
+                return entry.result, True
+            leader = entry is None
+            if leader:
+                entry = _Entry(fingerprint)
+                self._inflight[key] = entry
+
+        if not leader:
+            entry.event.wait()
+            if entry.error is not None:
+                raise entry.error
+            return entry.result, True
+
+        try:
+            entry.result = fn()
+        except BaseException as e:
+            entry.error = e
+            with self._lock:
+                self._inflight.pop(key, None)
+            entry.event.set()
+            raise
+
+        with self._lock:
+            self._inflight.pop(key, None)
+            entry.expires_at = time.monotonic() + self.ttl
+            self._done[key] = entry
+            while len(self._done) > self.max_entries:
+                self._done.popitem(last=False)
+        entry.event.set()
+        return entry.result, False
+
+
+_store: Optional[IdempotencyStore] = None
+_store_lock = threading.Lock()
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                from ..config.settings import Settings
+
+                _store = IdempotencyStore(ttl=Settings.load().IDEMPOTENCY_TTL)
+    return _store
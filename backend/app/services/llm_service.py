@@ -4,17 +4,32 @@ llm_service.py - LLM 服务层
 第 3 步：服务层内聚实现
 - 直接在 backend/services 内实现 DeepSeek / 火山引擎 调用
 - 在这里统一做 C3KG 常识注入 + 情感提示词注入（由 routes 传入 persona 的 system_prompt）
+- 消息布局由 prompt_service 统一组装：静态人格前缀在前，动态上下文在后，便于上游复用前缀缓存
+- 请求截止时间（deadline）：C3KG 检索只在给 LLM 预留足够预算时进行，上游调用只使用剩余预算
+- 上游调用由熔断器保护：故障期间立即返回兜底回复，不再每个请求都等到超时
 """
 
 from __future__ import annotations
 
+import logging
 from typing import List, Optional, Dict
 
 import requests
 from openai import OpenAI
 
 from ..config.settings import Settings
+from ..utils.circuit_breaker_utils import CircuitBreaker, get_breaker
 from ..utils.common_sense_utils import get_c3kg_knowledge
+from ..utils.deadline_utils import Deadline, DeadlineExceeded, stage_timeout
+from .prompt_service import build_prompt
+
+
+logger = logging.getLogger("backend-llm")
+
+# 预留 LLM 预算后剩余不足该值（秒）时跳过 C3KG 检索
+C3KG_MIN_BUDGET = 0.2
+# 上游失败、熔断或预算用完时的兜底回复
+FALLBACK_REPLY = "抱歉，我现在有点连接不稳定，请稍后再和我聊天吧。"
 
 
 def get_reply(
@@ -22,113 +37,112 @@ def get_reply(
     conversation_history: Optional[List[Dict[str, str]]] = None,
     emotion_data: Optional[dict] = None,
     system_prompt: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
+    emotion_trend: Optional[dict] = None,
 ) -> str:
     settings = Settings.load()
     provider = (settings.AI_PROVIDER or "deepseek").strip().lower()
 
-    # 1) 组装系统提示词（人格 prompt + C3KG 常识 + 情感提示）
+    # 1) 组装 Prompt（人格 prompt 作为静态前缀 + 历史 + C3KG 常识/情感提示）
     base_system_prompt = system_prompt or "你是一个温暖、善解人意且知识渊博的伴侣。"
 
-    # C3KG 注入
-    try:
-        c3kg = get_c3kg_knowledge(user_message, top_k=3)
-        if c3kg:
-            base_system_prompt += (
-                f"\n\n{c3kg}\n\n请参考上述相关常识来理解和回复用户的问题，让回复更加符合常识和逻辑。"
-            )
-    except Exception:
-        pass
-
-    # 情感注入（如果有）
-    if emotion_data and emotion_data.get("emotion"):
-        emotion_label = emotion_data.get("emotion", "中性")
-        polarity_text = ["失望", "平常", "开心"][emotion_data.get("polarity", 1)]
-        base_system_prompt += f"""
-
-【用户当前情感状态】
-- 情绪标签：{emotion_label}
-- 情感极性：{polarity_text}
-- 可信度：{emotion_data.get('confidence', 0.5):.1%}
-
-请根据用户的情绪状态，调整你的回复方式：
-- 如果用户感到负面（如疲惫、委屈、生气），请更加温柔、理解、贴心，多用安慰和鼓励。
-- 如果用户感到正面（如开心、兴奋），请分享他的快乐，用更活跃、热情的语气回应。
-- 始终保持同理心，让用户感受到你真的在倾听和关心他的情绪。
-"""
-
-    history = conversation_history or []
+    # C3KG 检索
+    c3kg = ""
+    if deadline is not None and not deadline.child(settings.CHAT_LLM_RESERVE).allows(C3KG_MIN_BUDGET):
+        logger.info("skip c3kg: remaining budget %.2fs", deadline.remaining())
+    else:
+        try:
+            c3kg = get_c3kg_knowledge(user_message, top_k=3)
+        except Exception:
+            pass
+
+    prompt = build_prompt(
+        base_system_prompt,
+        user_message,
+        history=conversation_history or [],
+        knowledge=c3kg,
+        emotion_data=emotion_data,
+        emotion_trend=emotion_trend,
+    )
+    logger.info(
+        "prompt prefix=%s tokens=%s cacheable_ratio=%.2f",
+        prompt["prefix_hash"],
+        prompt["total_tokens"],
+        prompt["cacheable_ratio"],
+    )
 
     # 2) 调用模型
     if provider == "volcengine":
-        return _call_volcengine(settings, base_system_prompt, history, user_message)
-    return _call_deepseek(settings, base_system_prompt, history, user_message)
+        return _call_volcengine(settings, prompt["messages"], deadline)
+    return _call_deepseek(settings, prompt["messages"], deadline)
 
-def _call_deepseek(
-    settings: Settings,
-    system_prompt: str,
-    history: List[Dict[str, str]],
-    user_message: str,
-) -> str:
+def _call_deepseek(settings: Settings, messages: List[Dict[str, str]], deadline: Optional[Deadline] = None) -> str:
     if not settings.DEEPSEEK_API_KEY:
         return "抱歉，我现在还没有配置好（缺少 DEEPSEEK_API_KEY）。"
 
-    api_url = "https://api.deepseek.com/v1/chat/completions"
+    api_url = f"{settings.DEEPSEEK_BASE_URL.rstrip('/')}/chat/completions"
     headers = {"Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}", "Content-Type": "application/json"}
 
-    messages: List[Dict[str, str]] = [{"role": "system", "content": system_prompt}]
-    # history: [{'role':'user'|'assistant', 'content': '...'}]
-    for m in history:
-        role = m.get("role")
-        content = m.get("content")
-        if role in {"user", "assistant"} and isinstance(content, str):
-            messages.append({"role": role, "content": content})
-    messages.append({"role": "user", "content": user_message})
-
     payload = {"model": "deepseek-chat", "messages": messages, "max_tokens": 500, "temperature": 0.7, "stream": False}
 
+    breaker = get_breaker("deepseek")
+    if not breaker.allow():
+        logger.info("deepseek skipped: circuit open")
+        return FALLBACK_REPLY
     try:
-        resp = requests.post(api_url, json=payload, headers=headers, timeout=30)
+        resp = requests.post(api_url, json=payload, headers=headers, timeout=stage_timeout(deadline, 30, "DeepSeek"))
         resp.raise_for_status()
         data = resp.json()
-        return data["choices"][0]["message"]["content"]
-    except Exception:
-        return "抱歉，我现在有点连接不稳定，请稍后再和我聊天吧。"
-
-
-def _call_volcengine(
-    settings: Settings,
-    system_prompt: str,
-    history: List[Dict[str, str]],
-    user_message: str,
-) -> str:
+        reply = data["choices"][0]["message"]["content"]
+    except Exception as e:
+        _record_failure(breaker, e)
+        return FALLBACK_REPLY
+    breaker.record_success()
+    usage = data.get("usage") or {}
+    if usage:
+        logger.info(
+            "deepseek prompt_tokens=%s cache_hit_tokens=%s",
+            usage.get("prompt_tokens"),
+            usage.get("prompt_cache_hit_tokens"),
+        )
+    return reply
+
+
+def _call_volcengine(settings: Settings, messages: List[Dict[str, str]], deadline: Optional[Deadline] = None) -> str:
     if not settings.VOLCENGINE_API_KEY:
         return "抱歉，我现在还没有配置好（缺少 VOLCENGINE_API_KEY）。"
 
     model = settings.VOLCENGINE_MODEL or "deepseek-v3-2-251201"
     client = OpenAI(base_url=settings.VOLCENGINE_BASE_URL or "https://ark.cn-beijing.volces.com/api/v3", api_key=settings.VOLCENGINE_API_KEY)
 
-    # 这里沿用你旧 volcengine_service 的“responses.create + input 列表”形式，确保兼容
-    input_messages: List[Dict[str, str]] = [
-        {"role": "user", "content": system_prompt},
-        {"role": "assistant", "content": "好的，我明白了。"},
-    ]
-    for m in history:
-        role = m.get("role")
-        content = m.get("content")
-        if role in {"user", "assistant"} and isinstance(content, str):
-            input_messages.append({"role": role, "content": content})
-    input_messages.append({"role": "user", "content": user_message})
+    # 沿用旧 volcengine_service 的“responses.create + input 列表”形式；
+    # 人格提示词以 system 消息作为静态前缀，开启 PROMPT_CACHE_ENABLED 时使用方舟上下文缓存
+    extra_body = {"caching": {"type": "enabled"}} if settings.PROMPT_CACHE_ENABLED else None
 
+    breaker = get_breaker("volcengine")
+    if not breaker.allow():
+        logger.info("volcengine skipped: circuit open")
+        return FALLBACK_REPLY
     try:
-        resp = client.responses.create(model=model, input=input_messages)
+        options = {"timeout": deadline.timeout(None, "火山引擎")} if deadline is not None else {}
+        resp = client.responses.create(model=model, input=messages, extra_body=extra_body, **options)
         if resp.status == "completed" and resp.output:
             for msg in resp.output:
                 if hasattr(msg, "content"):
                     for c in msg.content:
                         if hasattr(c, "text"):
+                            breaker.record_success()
                             return c.text
         raise RuntimeError(f"volcengine status abnormal: {getattr(resp, 'status', None)}")
-    except Exception:
-        return "抱歉，我现在有点连接不稳定，请稍后再和我聊天吧。"
-
-
+    except Exception as e:
+        _record_failure(breaker, e)
+        return FALLBACK_REPLY
+
+
+def _record_failure(breaker: CircuitBreaker, error: Exception) -> None:
+    # 调用前请求预算已用完不算上游的失败，只释放熔断器的试探名额
+    if isinstance(error, DeadlineExceeded):
+        breaker.release()
+    else:
+        logger.info("%s call failed: %s", breaker.name, error)
+        breaker.record_failure()
@@ -0,0 +1,113 @@
+"""
+prompt_service.py - 缓存友好的 Prompt 组装
+
+统一 DeepSeek / 火山引擎的消息布局：
+1. 人格 system_prompt（静态前缀，逐字节稳定）
+2. 历史对话
+3. 本轮动态上下文（C3KG 常识 + 情感状态），作为一条 system 消息
+4. 用户当前消息
+
+动态内容放在历史之后，上游（DeepSeek 磁盘缓存 / 火山方舟上下文缓存）可以复用相同前缀。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import Dict, List, Optional
+
+# 中日韩字符（含全角标点）大约 1 字 1 token；其余字符大约 4 个字符 1 token
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_message_tokens(message: Dict[str, str]) -> int:
+    return estimate_tokens(message.get("content")) + _MESSAGE_OVERHEAD_TOKENS
+
+
+def format_emotion(emotion_data: Optional[dict]) -> str:
+    if not emotion_data or not emotion_data.get("emotion"):
+        return ""
+    emotion_label = emotion_data.get("emotion", "中性")
+    polarity_text = ["失望", "平常", "开心"][emotion_data.get("polarity", 1)]
+    return f"""【用户当前情感状态】
+- 情绪标签：{emotion_label}
+- 情感极性：{polarity_text}
+- 可信度：{emotion_data.get('confidence', 0.5):.1%}
+
+请根据用户的情绪状态，调整你的回复方式：
+- 如果用户感到负面（如疲惫、委屈、生气），请更加温柔、理解、贴心，多用安慰和鼓励。
+- 如果用户感到正面（如开心、兴奋），请分享他的快乐，用更活跃、热情的语气回应。
+- 始终保持同理心，让用户感受到你真的在倾听和关心他的情绪。"""
+
+
+def format_emotion_trend(emotion_trend: Optional[dict], min_samples: int = 3) -> str:
+    """用户近期情绪（models.emotion_record.get_emotion_trend）的提示词片段；样本太少时不注入"""
+    if not emotion_trend:
+        return ""
+    recent = emotion_trend.get("recent") or {}
+    if (recent.get("samples") or 0) < min_samples:
+        return ""
+    labels = [label for label in (recent.get("labels") or {}) if label != "中性"][:2]
+    label_text = f"情绪以{'、'.join(labels)}为主，" if labels else ""
+    lines = [
+        "【用户近期情绪】",
+        f"- 最近 {recent.get('days', 7)} 天共 {recent['samples']} 条消息，{label_text}整体{emotion_trend.get('mood', '平稳')}",
+    ]
+    if emotion_trend.get("negative_streak", 0) >= 3:
+        lines.append(f"- 已连续 {emotion_trend['negative_streak']} 条消息情绪负面")
+    lines.append("请结合用户近期的情绪变化来理解和关心对方，但不要直接复述这些统计。")
+    return "\n".join(lines)
+
+
+def build_prompt(
+    system_prompt: str,
+    user_message: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    knowledge: str = "",
+    emotion_data: Optional[dict] = None,
+    emotion_trend: Optional[dict] = None,
+) -> Dict:
+    """
+    返回：
+    {messages, prefix_hash, prefix_tokens, cacheable_tokens, total_tokens, cacheable_ratio}
+    """
+    messages: List[Dict[str, str]] = [{"role": "system", "content": system_prompt}]
+    # history: [{'role':'user'|'assistant', 'content': '...'}]
+    for m in history or []:
+        role = m.get("role")
+        content = m.get("content")
+        if role in {"user", "assistant"} and isinstance(content, str):
+            messages.append({"role": role, "content": content})
+    # 只有人格前缀在多轮之间稳定：历史窗口会随裁剪和 token 预算整体滑动，下一轮与本轮共享的通常只有前缀
+    cacheable_tokens = estimate_message_tokens(messages[0])
+
+    dynamic_sections = []
+    if knowledge:
+        dynamic_sections.append(f"{knowledge}\n\n请参考上述相关常识来理解和回复用户的问题，让回复更加符合常识和逻辑。")
+    emotion_section = format_emotion(emotion_data)
+    if emotion_section:
+        dynamic_sections.append(emotion_section)
+    trend_section = format_emotion_trend(emotion_trend)
+    if trend_section:
+        dynamic_sections.append(trend_section)
+    if dynamic_sections:
+        messages.append({"role": "system", "content": "\n\n".join(dynamic_sections)})
+    messages.append({"role": "user", "content": user_message})
+
+    total_tokens = sum(estimate_message_tokens(m) for m in messages)
+    return {
+        "messages": messages,
+        "prefix_hash": hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16],
+        "prefix_tokens": cacheable_tokens,
+        "cacheable_tokens": cacheable_tokens,
+        "total_tokens": total_tokens,
+        "cacheable_ratio": round(cacheable_tokens / total_tokens, 4) if total_tokens else 0.0,
+    }
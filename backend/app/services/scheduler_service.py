@@ -22,6 +22,8 @@ from apscheduler.triggers.cron import CronTrigger
 
 from .llm_service import get_reply
 from .socketio_service import push_to_user
+from .prompt_service import format_emotion_trend
+from ..models.emotion_record import get_emotion_trend
 from ..models.user_memory import get_all_active_users, get_user_schedule
 
 
@@ -60,6 +62,10 @@ def push_care_message(user_id: str, message_type: str = "care") -> None:
 3. 长度控制在50字以内
 4. 适当使用表情符号
 5. 这是主动发起的关怀，不要问问题等待回复，而是表达关心和爱意"""
+        # 结合用户近期情绪（增量维护的聚合，按主键读取）
+        trend_section = format_emotion_trend(get_emotion_trend(user_id))
+        if trend_section:
+            system_prompt = f"{system_prompt}\n\n{trend_section}"
 
         ai_reply = get_reply(
             user_message="请生成一条关怀消息",
@@ -0,0 +1,178 @@
+"""
+circuit_breaker_utils.py - 上游服务熔断器
+
+移植自旧 services/circuit_breaker.py（不依赖旧代码）：DeepSeek / 火山引擎 / 百度故障时快速失败
+- closed（关闭）：正常放行，按滚动时间窗口统计失败率
+- open（打开）：失败率超过 CIRCUIT_FAILURE_RATIO 后直接拒绝请求，调用方立即走兜底逻辑
+- half_open（半开）：打开 CIRCUIT_OPEN_SECONDS 秒后放行少量试探请求，成功则关闭，失败则重新打开
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger("backend-breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被快速拒绝"""
+
+
+class CircuitBreaker:
+    """单个上游端点的熔断器（线程安全）"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_ratio: float = 0.5,
+        min_calls: int = 5,
+        window_seconds: float = 60.0,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._events: deque = deque()  # [(timestamp, ok)]
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._half_open_inflight = 0
+
+        self.rejected = 0
+        self.times_opened = 0
+
+    def _prune(self, now: float) -> None:
+        while self._events and self._events[0][0] < now - self.window_seconds:
+            self._events.popleft()
+
+    def _current_state(self, now: float) -> str:
+        # 根据时间推进状态（调用方需持有锁）
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._half_open_inflight = 0
+            logger.info("breaker %s half-open, allowing probe requests", self.name)
+        return self._state
+
+    def _open(self, now: float) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self.times_opened += 1
+        logger.warning("breaker %s opened, failing fast for %.0fs", self.name, self.open_seconds)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def allow(self) -> bool:
+        """是否放行本次请求（放行后调用方必须调用 record_success 或 record_failure）"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._half_open_inflight < self.half_open_max_calls:
+                self._half_open_inflight += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self._events.clear()
+                logger.info("breaker %s closed after successful probe", self.name)
+            self._events.append((now, True))
+            self._prune(now)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._state == HALF_OPEN:
+                self._open(now)
+                return
+            self._events.append((now, False))
+            self._prune(now)
+            if self._state == CLOSED and len(self._events) >= self.min_calls:
+                failures = sum(1 for _, ok in self._events if not ok)
+                if failures / len(self._events) >= self.failure_ratio:
+                    self._open(now)
+
+    def release(self) -> None:
+        """放弃已放行的请求且不计入成功 / 失败（例如请求开始前预算已用完）"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._half_open_inflight > 0:
+                self._half_open_inflight -= 1
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """在熔断器保护下执行 fn；熔断器打开时抛出 CircuitOpenError，fn 抛出异常时计为失败"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} 熔断中，快速失败")
+        try:
+            result = fn()
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            self._prune(now)
+            failures = sum(1 for _, ok in self._events if not ok)
+            retry_in = max(0.0, self.open_seconds - (now - self._opened_at)) if state == OPEN else 0.0
+            return {
+                "state": state,
+                "window_calls": len(self._events),
+                "window_failures": failures,
+                "rejected": self.rejected,
+                "times_opened": self.times_opened,
+                "retry_in": round(retry_in, 1),
+            }
+
+
+# 全局熔断器注册表 {name: CircuitBreaker}
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """获取（或按 CIRCUIT_* 配置创建）指定端点的熔断器"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _registry_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                from ..config.settings import Settings
+
+                settings = Settings.load()
+                breaker = CircuitBreaker(
+                    name,
+                    failure_ratio=settings.CIRCUIT_FAILURE_RATIO,
+                    min_calls=settings.CIRCUIT_MIN_CALLS,
+                    window_seconds=settings.CIRCUIT_WINDOW_SECONDS,
+                    open_seconds=settings.CIRCUIT_OPEN_SECONDS,
+                )
+                _breakers[name] = breaker
+    return breaker
+
+
+def get_breaker_states() -> Dict[str, Dict[str, Any]]:
+    """所有已创建熔断器的状态（用于状态接口）"""
+    return {name: breaker.to_dict() for name, breaker in list(_breakers.items())}
@@ -0,0 +1,48 @@
+"""
+deadline_utils.py - 请求级截止时间
+
+移植自旧 services/deadline.py（不依赖旧代码）：
+- 一次 /api/chat 请求只有一个总预算（CHAT_REQUEST_BUDGET），各阶段只使用剩余预算
+- 可选阶段（情感分析、C3KG 检索）在给 LLM 预留 CHAT_LLM_RESERVE 秒后预算不足时跳过
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Optional
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, budget: float, expires_at: Optional[float] = None):
+        self.budget = budget
+        self.expires_at = expires_at if expires_at is not None else time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def allows(self, seconds: float) -> bool:
+        return self.remaining() >= seconds
+
+    def timeout(self, cap: Optional[float] = None, stage: str = "请求") -> float:
+        """min(cap, 剩余预算)；预算已用完时抛出 DeadlineExceeded"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{stage}开始前请求预算已用完（总预算 {self.budget:.1f} 秒）")
+        return remaining if cap is None else min(cap, remaining)
+
+    def child(self, reserve: float) -> "Deadline":
+        """比当前截止时间提前 reserve 秒到期（给后续阶段预留预算）"""
+        return Deadline(max(0.0, self.remaining() - reserve), expires_at=self.expires_at - reserve)
+
+
+def stage_timeout(deadline: Optional[Deadline], cap: float, stage: str = "请求") -> float:
+    if deadline is None:
+        return cap
+    return deadline.timeout(cap, stage)
@@ -0,0 +1,50 @@
+"""
+shard_utils.py - 聊天记录分片
+
+移植自旧 services/chat_shards.py（不依赖旧代码）：
+- 按 crc32(session_id) % 分片数 把会话分散到多个 SQLite 文件，每个分片有自己的连接池和写锁
+- 分片 0 即 chat_history.db，分片 i 为 chat_history-i.db；与旧 app.py 使用相同的哈希和文件名，两边分片一致
+- 同一会话的消息、摘要、归档都在同一个分片；修改 CHAT_DB_SHARDS 前先停服务并运行 scripts/rebalance_chat_shards.py
+"""
+
+from __future__ import annotations
+
+import os
+import zlib
+from typing import Callable, List
+
+from .sqlite_utils import PooledConnection, get_pool
+
+
+def shard_index(session_id: str, shard_count: int) -> int:
+    """会话所在的分片号（稳定哈希，不能用每次启动都不同的内置 hash()）"""
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32(session_id.encode("utf-8")) % shard_count
+
+
+def shard_paths(base_path: str, shard_count: int) -> List[str]:
+    root, ext = os.path.splitext(base_path)
+    return [base_path] + [f"{root}-{i}{ext}" for i in range(1, max(shard_count, 1))]
+
+
+class ChatShards:
+    """聊天记录分片路由：session_id -> 分片数据库连接"""
+
+    def __init__(self, base_path: str, shard_count: int = 1):
+        if shard_count < 1:
+            raise ValueError(f"shard count must be positive: {shard_count}")
+        self.shard_count = shard_count
+        self.paths = shard_paths(base_path, shard_count)
+
+    def index(self, session_id: str) -> int:
+        return shard_index(session_id, self.shard_count)
+
+    def connect(self, session_id: str) -> PooledConnection:
+        return get_pool(self.paths[self.index(session_id)]).connect()
+
+    def connect_shard(self, index: int) -> PooledConnection:
+        return get_pool(self.paths[index]).connect()
+
+    def connector(self, index: int) -> Callable[[], PooledConnection]:
+        return lambda: self.connect_shard(index)
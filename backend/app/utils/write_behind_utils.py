@@ -0,0 +1,263 @@
+"""
+write_behind_utils.py - 聊天记录异步写入队列（write-behind）
+
+移植自旧 services/write_behind.py（不依赖旧代码）：
+- 写入先进入内存队列，后台线程攒够 batch_size 条或等待超过 flush_interval 秒时在一个事务中提交（group commit）
+- 读己之写：未提交的写入按会话保存，读取历史时叠加；提交与读取互斥，不会重复或遗漏
+- 队列满时 submit() 阻塞（反压）；提交失败按指数退避重试；close() 写完队列再退出
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("backend-models")
+
+# 批大小直方图的分桶上限（最后一个桶为“更大”）
+BATCH_SIZE_BUCKETS = (1, 4, 16, 64)
+
+
+class PendingWrite:
+    """队列中的一次写入（一轮对话）"""
+
+    __slots__ = ("seq", "session_id", "payload", "enqueued_at")
+
+    def __init__(self, seq: int, session_id: str, payload: Any):
+        self.seq = seq
+        self.session_id = session_id
+        self.payload = payload
+        self.enqueued_at = time.monotonic()
+
+
+class WriteBehindQueue:
+    """异步写入队列（线程安全）"""
+
+    def __init__(self, connect: Callable[[], Any], write_batch: Callable[[Any, List[Any]], None],
+                 batch_size: int = 64, flush_interval: float = 0.05, max_queue: int = 10000,
+                 retry_interval: float = 0.5, max_retry_interval: float = 30.0, name: str = "write-behind"):
+        """
+        参数:
+            connect: 获取数据库连接的函数（连接需支持 commit / rollback / close）
+            write_batch: 在给定连接上执行一批写入的函数（不提交，由队列统一提交）
+            batch_size: 每批最多提交的写入数，攒够即提交
+            flush_interval: 最早一条写入最多等待的秒数
+            max_queue: 队列上限，超出时 submit() 阻塞
+            retry_interval / max_retry_interval: 提交失败后的重试间隔（指数退避）及其上限（秒）
+            name: 后台线程名
+        """
+        self.connect = connect
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+
+        self._cond = threading.Condition()
+        self._queue: Deque[PendingWrite] = deque()
+        self._pending: Dict[str, List[PendingWrite]] = {}
+        self._seq = 0
+        self._inflight = 0            # 后台线程正在提交的条数（仍在 _pending 中）
+        self._readers = 0             # 正在读取的线程数（提交时需等待为 0）
+        self._committing = False
+        self._closed = False
+
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.backpressure_waits = 0
+        self.max_depth = 0
+        self.max_batch = 0
+        self.last_error: Optional[str] = None
+        self._batch_histogram = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self._commit_seconds = 0.0
+        self._wait_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # ---------- 写入 / 读取 ----------
+
+    def submit(self, session_id: str, payload: Any) -> None:
+        """把一次写入放入队列（队列满时等待后台线程腾出空间）"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("写入队列已关闭")
+            while len(self._queue) + self._inflight >= self.max_queue:
+                self.backpressure_waits += 1
+                self._cond.wait()
+            self._seq += 1
+            item = PendingWrite(self._seq, session_id, payload)
+            self._queue.append(item)
+            self._pending.setdefault(session_id, []).append(item)
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._queue) + self._inflight)
+            self._cond.notify_all()
+
+    def read(self, session_id: str, read_db: Callable[[], Any]) -> Tuple[Any, List[Any]]:
+        """
+        读取会话数据并附带尚未提交的写入（读己之写）
+
+        参数:
+            read_db: 从数据库读取的函数，与提交互斥执行
+
+        返回:
+            (read_db() 的结果, 该会话尚未提交的写入 payload 列表，按写入顺序)
+        """
+        with self._cond:
+            while self._committing:
+                self._cond.wait()
+            self._readers += 1
+            pending = [item.payload for item in self._pending.get(session_id, ())]
+        try:
+            return read_db(), pending
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def has_pending(self, session_id: str) -> bool:
+        with self._cond:
+            return bool(self._pending.get(session_id))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待当前队列中的写入全部提交；返回是否在超时前完成"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            target = self._seq
+            self._cond.notify_all()
+            while any(item.seq <= target for items in self._pending.values() for item in items[:1]):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        """写完队列中剩余的写入后停止后台线程"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("write-behind queue close timed out, %s writes not committed", self.depth())
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._queue) + self._inflight
+
+    # ---------- 后台提交 ----------
+
+    def _run(self) -> None:
+        delay = 0.0
+        while True:
+            with self._cond:
+                while True:
+                    if self._queue:
+                        wait = self._queue[0].enqueued_at + max(self.flush_interval, delay) - time.monotonic()
+                        # 攒够一批、等待到期或正在关闭时提交（失败退避期间关闭也照常重试）
+                        if (len(self._queue) >= self.batch_size and not delay) or wait <= 0 or self._closed:
+                            break
+                        self._cond.wait(wait)
+                    elif self._closed:
+                        return
+                    else:
+                        self._cond.wait()
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._inflight = len(batch)
+
+            if self._commit(batch):
+                delay = 0.0
+                continue
+            delay = min(max(delay * 2, self.retry_interval), self.max_retry_interval)
+            with self._cond:
+                # 放回队首，下次重试；待写列表里一直保留，读取不受影响
+                self._queue.extendleft(reversed(batch))
+                self._inflight = 0
+                if self._closed and delay >= self.max_retry_interval:
+                    logger.error("write-behind queue closing, dropping %s writes after repeated failures: %s", len(self._queue), self.last_error)
+                    return
+
+    def _commit(self, batch: List[PendingWrite]) -> bool:
+        started = time.monotonic()
+        with self._cond:
+            # 先等正在进行的读取结束，写入、提交到移出待写列表期间不允许新的读取；
+            # 在拿到数据库写锁之前等待，读取线程等数据库锁时不会与这里互相等待
+            self._committing = True
+            while self._readers:
+                self._cond.wait()
+        conn = None
+        try:
+            conn = self.connect()
+            self.write_batch(conn, [item.payload for item in batch])
+            conn.commit()
+        except Exception as e:
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            with self._cond:
+                self._committing = False
+                self._cond.notify_all()
+                self.failures += 1
+                self.last_error = str(e)
+            logger.warning("write-behind commit of %s writes failed, will retry: %s", len(batch), e)
+            return False
+        finally:
+            if conn is not None:
+                conn.close()
+
+        now = time.monotonic()
+        with self._cond:
+            # 提交后、放行读取前移出待写列表
+            self._committing = False
+            for item in batch:
+                items = self._pending.get(item.session_id)
+                if items:
+                    items.remove(item)
+                    if not items:
+                        del self._pending[item.session_id]
+                self._wait_seconds += now - item.enqueued_at
+            self._inflight = 0
+            self.written += len(batch)
+            self.batches += 1
+            self.max_batch = max(self.max_batch, len(batch))
+            self._commit_seconds += now - started
+            bucket = next((i for i, limit in enumerate(BATCH_SIZE_BUCKETS) if len(batch) <= limit),
+                          len(BATCH_SIZE_BUCKETS))
+            self._batch_histogram[bucket] += 1
+            self._cond.notify_all()
+        return True
+
+    def get_stats(self) -> Dict:
+        with self._cond:
+            labels = [str(BATCH_SIZE_BUCKETS[0])]
+            labels += [f"{low + 1}-{high}" for low, high in zip(BATCH_SIZE_BUCKETS, BATCH_SIZE_BUCKETS[1:])]
+            labels.append(f">{BATCH_SIZE_BUCKETS[-1]}")
+            return {
+                "queue_depth": len(self._queue) + self._inflight,
+                "max_queue_depth": self.max_depth,
+                "pending_sessions": len(self._pending),
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "batches": self.batches,
+                "avg_batch_size": round(self.written / self.batches, 2) if self.batches else 0.0,
+                "max_batch_size": self.max_batch,
+                "batch_sizes": dict(zip(labels, self._batch_histogram)),
+                "avg_commit_ms": round(self._commit_seconds / self.batches * 1000, 3) if self.batches else 0.0,
+                "avg_write_delay_ms": round(self._wait_seconds / self.written * 1000, 3) if self.written else 0.0,
+                "commit_failures": self.failures,
+                "backpressure_waits": self.backpressure_waits,
+                "last_error": self.last_error,
+                "batch_size": self.batch_size,
+                "flush_interval": self.flush_interval,
+            }
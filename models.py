@@ -1,18 +1,19 @@
 # models.py - 数据库模型和初始化
 
-import sqlite3
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
+
+from services.sqlite_pool import get_pool
 
 # 数据库文件路径
 DB_PATH = os.path.join(os.path.dirname(__file__), 'companion.db')
 
 
 def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """获取数据库连接（从连接池借出，WAL 模式，线程内复用；用完 close() 归还）"""
+    return get_pool(DB_PATH).connect()
 
 
 def init_user_schedule_db():
@@ -154,6 +155,205 @@ def disable_user_push(user_id, push_type='all'):
         conn.close()
 
 
+
+# ==================== 情绪时间序列 ====================
+# emotion_events 逐条记录每条消息的情感分析结果（整数列，紧凑存储）；
+# emotion_aggregates / emotion_daily 在写入时增量更新，读取近期情绪只需按主键取固定行数，不扫描历史
+
+# 极性 EWMA 的平滑系数（越大越偏向最近几条消息）
+EMOTION_EWMA_ALPHA = 0.2
+# 近期情绪统计的天数窗口
+EMOTION_TREND_DAYS = 7
+
+_label_codes = {}  # 情绪标签 -> emotion_labels.code（进程内缓存）
+_label_lock = threading.Lock()
+
+
+def init_emotion_db():
+    """初始化情绪时间序列相关的表"""
+    conn = get_db_connection()
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS emotion_labels (
+                code INTEGER PRIMARY KEY,
+                label TEXT NOT NULL UNIQUE
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS emotion_events (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                polarity INTEGER NOT NULL,
+                label INTEGER NOT NULL,
+                confidence INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_emotion_events_user_ts ON emotion_events (user_id, ts)')
+        # 每个用户一行：极性 EWMA（-1 负面 ~ 1 正面）、连续负面条数、最近一条结果
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS emotion_aggregates (
+                user_id TEXT PRIMARY KEY,
+                samples INTEGER NOT NULL,
+                ewma_polarity REAL NOT NULL,
+                negative_streak INTEGER NOT NULL,
+                last_polarity INTEGER NOT NULL,
+                last_label INTEGER NOT NULL,
+                last_ts INTEGER NOT NULL
+            )
+        ''')
+        # 按天、按标签计数，近 N 天的统计只读 N 天的行
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS emotion_daily (
+                user_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                label INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                polarity_sum INTEGER NOT NULL,
+                PRIMARY KEY (user_id, day, label)
+            ) WITHOUT ROWID
+        ''')
+        conn.commit()
+        print("[数据库] 情绪时间序列表已初始化")
+    except Exception as e:
+        print(f"[数据库] 初始化情绪表失败: {e}")
+    finally:
+        conn.close()
+
+
+def _emotion_label_code(conn, label):
+    """情绪标签对应的整数编码（首次出现时写入 emotion_labels）"""
+    code = _label_codes.get(label)
+    if code is not None:
+        return code
+    with _label_lock:
+        conn.execute('INSERT OR IGNORE INTO emotion_labels (label) VALUES (?)', (label,))
+        code = conn.execute('SELECT code FROM emotion_labels WHERE label = ?', (label,)).fetchone()['code']
+        _label_codes[label] = code
+        return code
+
+
+def _emotion_label_names(conn, codes):
+    missing = set(codes) - set(_label_codes.values())
+    if missing:
+        with _label_lock:
+            for row in conn.execute('SELECT code, label FROM emotion_labels'):
+                _label_codes[row['label']] = row['code']
+    names = {code: label for label, code in _label_codes.items()}
+    return {code: names.get(code, '中性') for code in codes}
+
+
+def record_emotion(user_id, emotion_data, alpha=EMOTION_EWMA_ALPHA):
+    """
+    记录一条消息的情感分析结果，并增量更新该用户的聚合（同一事务）
+
+    参数:
+        user_id: 用户ID（聊天接口中即 session_id）
+        emotion_data: 情感分析结果 {polarity, emotion, confidence}
+        alpha: 极性 EWMA 的平滑系数
+    """
+    if not user_id or not emotion_data:
+        return
+    polarity = emotion_data.get('polarity', 1)
+    if polarity not in (0, 1, 2):
+        polarity = 1
+    score = polarity - 1  # -1 负面 / 0 中性 / 1 正面
+    confidence = int(round(float(emotion_data.get('confidence') or 0) * 100))
+    now = int(time.time())
+    day = datetime.now().strftime('%Y-%m-%d')
+
+    conn = get_db_connection()
+    try:
+        label = _emotion_label_code(conn, emotion_data.get('emotion') or '中性')
+        conn.execute(
+            'INSERT INTO emotion_events (user_id, ts, polarity, label, confidence) VALUES (?, ?, ?, ?, ?)',
+            (user_id, now, polarity, label, confidence)
+        )
+        # EWMA 在 SQL 里原地更新，不需要先读出旧值
+        conn.execute('''
+            INSERT INTO emotion_aggregates
+                (user_id, samples, ewma_polarity, negative_streak, last_polarity, last_label, last_ts)
+            VALUES (?, 1, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                samples = samples + 1,
+                ewma_polarity = ewma_polarity + ? * (excluded.ewma_polarity - ewma_polarity),
+                negative_streak = CASE WHEN excluded.last_polarity = 0 THEN negative_streak + 1 ELSE 0 END,
+                last_polarity = excluded.last_polarity,
+                last_label = excluded.last_label,
+                last_ts = excluded.last_ts
+        ''', (user_id, score, 1 if polarity == 0 else 0, polarity, label, now, alpha))
+        conn.execute('''
+            INSERT INTO emotion_daily (user_id, day, label, count, polarity_sum)
+            VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT(user_id, day, label) DO UPDATE SET
+                count = count + 1,
+                polarity_sum = polarity_sum + excluded.polarity_sum
+        ''', (user_id, day, label, score))
+        conn.commit()
+    except Exception as e:
+        print(f"[数据库] 记录情绪失败: {e}")
+    finally:
+        conn.close()
+
+
+def get_emotion_trend(user_id, days=EMOTION_TREND_DAYS):
+    """
+    读取用户的近期情绪（只读聚合行和最近 days 天的按天计数）
+
+    返回:
+        {samples, ewma_polarity, mood, negative_streak, last_emotion, last_at,
+         recent: {days, samples, avg_polarity, labels}}；没有记录时返回 None
+    """
+    conn = get_db_connection()
+    try:
+        agg = conn.execute('SELECT * FROM emotion_aggregates WHERE user_id = ?', (user_id,)).fetchone()
+        if not agg:
+            return None
+        since = (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        rows = conn.execute(
+            'SELECT label, SUM(count) AS count, SUM(polarity_sum) AS polarity_sum FROM emotion_daily '
+            'WHERE user_id = ? AND day >= ? GROUP BY label',
+            (user_id, since)
+        ).fetchall()
+        names = _emotion_label_names(conn, [agg['last_label']] + [r['label'] for r in rows])
+    except Exception as e:
+        print(f"[数据库] 读取情绪趋势失败: {e}")
+        return None
+    finally:
+        conn.close()
+
+    recent_samples = sum(r['count'] for r in rows)
+    labels = {names[r['label']]: r['count'] for r in sorted(rows, key=lambda r: -r['count'])}
+    ewma = agg['ewma_polarity']
+    return {
+        'samples': agg['samples'],
+        'ewma_polarity': round(ewma, 3),
+        'mood': '低落' if ewma <= -0.3 else ('积极' if ewma >= 0.3 else '平稳'),
+        'negative_streak': agg['negative_streak'],
+        'last_emotion': names[agg['last_label']],
+        'last_at': datetime.fromtimestamp(agg['last_ts']).isoformat(timespec='seconds'),
+        'recent': {
+            'days': days,
+            'samples': recent_samples,
+            'avg_polarity': round(sum(r['polarity_sum'] for r in rows) / recent_samples, 3) if recent_samples else None,
+            'labels': labels,
+        },
+    }
+
+
+def clear_emotion_history(user_id):
+    """删除用户的情绪记录和聚合"""
+    conn = get_db_connection()
+    try:
+        for table in ('emotion_events', 'emotion_aggregates', 'emotion_daily'):
+            conn.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+        conn.commit()
+    except Exception as e:
+        print(f"[数据库] 清除情绪记录失败: {e}")
+    finally:
+        conn.close()
+
+
 if __name__ == '__main__':
     # 初始化数据库（测试用）
     init_user_schedule_db()
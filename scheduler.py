@@ -23,8 +23,10 @@ def push_care_message(user_id, message_type="care"):
         message_type (str): 消息类型 (morning/evening/care)
     """
     try:
-        from models import get_user_schedule, update_user_last_active
+        from models import get_user_schedule, update_user_last_active, get_emotion_trend
         from services.ai_service import get_ai_reply
+        from services.prompt_builder import format_emotion_trend_for_prompt
+        from services.provider_gateway import PRIORITY_BACKGROUND
         
         # 1. 获取用户偏好设置
         user = get_user_schedule(user_id)
@@ -57,11 +59,16 @@ def push_care_message(user_id, message_type="care"):
 3. 长度控制在50字以内
 4. 适当使用表情符号
 5. 这是主动发起的关怀，不要问问题等待回复，而是表达关心和爱意"""
+        # 结合用户近期情绪（增量维护的聚合，按主键读取）
+        trend_section = format_emotion_trend_for_prompt(get_emotion_trend(user_id))
+        if trend_section:
+            system_prompt = f"{system_prompt}\n\n{trend_section}"
         
         # 3. 调用AI服务生成消息内容
         ai_reply = get_ai_reply(
             "请生成一条关怀消息",
-            conversation_history=[{"role": "system", "content": system_prompt}]
+            conversation_history=[{"role": "system", "content": system_prompt}],
+            priority=PRIORITY_BACKGROUND  # 定时推送让位于用户实时对话
         )
         
         # 4. 推送消息（通过WebSocket）
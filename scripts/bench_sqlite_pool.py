@@ -0,0 +1,162 @@
+# scripts/bench_sqlite_pool.py - SQLite 连接方式并发写入压测
+"""
+对比两种 SQLite 访问方式在并发聊天写入下的吞吐和延迟：
+
+- legacy：每次读写都 sqlite3.connect() 新建连接、默认 rollback journal（改造前的做法）
+- pooled：services/sqlite_pool.py 的连接池（线程内复用、WAL、synchronous=NORMAL、预编译语句缓存）
+
+每个线程模拟若干轮对话，每轮与 /api/chat 相同：读历史 -> 写用户消息 -> 写回复 -> 裁剪历史 -> 再读历史，
+另有只读线程持续读取历史（模拟 /api/chat 之外的查询），统计只读线程在写入期间的读取次数。
+
+使用方法：
+    python scripts/bench_sqlite_pool.py --threads 16 --turns 100
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.sqlite_pool import SQLitePool  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def legacy_connect(db_path):
+    def connect():
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+    return connect
+
+
+def pooled_connect(db_path):
+    return SQLitePool(db_path).connect
+
+
+def _call(connect, fn):
+    conn = connect()
+    try:
+        return fn(conn)
+    finally:
+        conn.close()
+
+
+def chat_turn(connect, session_id, turn):
+    """与 app.py 一轮对话相同的数据库操作（各自获取连接）"""
+    def read_history(conn):
+        return conn.execute('SELECT role, content FROM messages WHERE session_id = ? ORDER BY id ASC',
+                            (session_id,)).fetchall()[-50:]
+
+    def save(role, content):
+        def run(conn):
+            conn.execute('INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)',
+                         (session_id, role, content))
+            conn.commit()
+        return run
+
+    def trim(conn):
+        ids = [r['id'] for r in conn.execute('SELECT id FROM messages WHERE session_id = ? ORDER BY id ASC',
+                                             (session_id,)).fetchall()]
+        if len(ids) > 10:
+            conn.executemany('DELETE FROM messages WHERE id = ?', [(i,) for i in ids[:len(ids) - 10]])
+            conn.commit()
+
+    _call(connect, read_history)
+    _call(connect, save('user', f'第 {turn} 条消息：今天有点累'))
+    _call(connect, save('assistant', f'第 {turn} 条回复：辛苦啦，早点休息'))
+    _call(connect, trim)
+    _call(connect, read_history)
+
+
+def run(mode, threads, turns, readers):
+    workdir = tempfile.mkdtemp(prefix='bench_sqlite_')
+    db_path = os.path.join(workdir, 'chat_history.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute(SCHEMA)
+    conn.commit()
+    conn.close()
+    connect = legacy_connect(db_path) if mode == 'legacy' else pooled_connect(db_path)
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    stop = threading.Event()
+    reads = [0]
+
+    def writer(index):
+        for turn in range(turns):
+            started = time.perf_counter()
+            try:
+                chat_turn(connect, f'bench_{index}', turn)
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    def reader():
+        while not stop.is_set():
+            try:
+                _call(connect, lambda c: c.execute('SELECT COUNT(*) FROM messages').fetchone())
+                with lock:
+                    reads[0] += 1
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors.append(str(e))
+
+    started = time.perf_counter()
+    reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+    writer_threads = [threading.Thread(target=writer, args=(i,)) for i in range(threads)]
+    for t in reader_threads + writer_threads:
+        t.start()
+    for t in writer_threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for t in reader_threads:
+        t.join()
+
+    latencies.sort()
+    return {
+        'mode': mode,
+        'turns': len(latencies),
+        'turns_per_second': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0.0,
+        'reads_per_second': reads[0] / elapsed,
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite 连接方式并发写入压测')
+    parser.add_argument('--threads', type=int, default=16, help='并发写入线程数（每个线程一个会话）')
+    parser.add_argument('--turns', type=int, default=100, help='每个线程的对话轮数')
+    parser.add_argument('--readers', type=int, default=2, help='并发只读线程数')
+    args = parser.parse_args()
+
+    print(f"并发写入: {args.threads} 线程 × {args.turns} 轮，只读线程 {args.readers} 个")
+    print(f"{'模式':<8}{'轮/秒':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'读/秒':>10}{'错误':>6}")
+    for mode in ('legacy', 'pooled'):
+        result = run(mode, args.threads, args.turns, args.readers)
+        print(f"{result['mode']:<8}{result['turns_per_second']:>10.1f}{result['p50_ms']:>10.2f}"
+              f"{result['p95_ms']:>10.2f}{result['reads_per_second']:>10.1f}{result['errors']:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# scripts/compact_message_archive.py - 合并归档末尾的小块
+"""
+裁剪时新归档的消息先作为小块追加，攒够一整块才合并（services/message_archive.py）；
+消息少或长时间不再裁剪的会话末尾会留下多个小块，压缩率较低。本脚本把每个会话末尾的小块合并成一块
+
+- 可以定期运行；已经合并过的会话不会重复改写
+- 每个分片在一个事务中合并（中断时该分片回滚），请先停止服务，避免长时间占用写锁
+
+使用方法：
+    python scripts/compact_message_archive.py
+    python scripts/compact_message_archive.py --shards 4 --chunk 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.chat_shards import shard_paths  # noqa: E402
+from services.message_archive import DEFAULT_CHUNK_MESSAGES, compact_archive  # noqa: E402
+from services.migrations import CHAT_HISTORY_MIGRATIONS, migrate  # noqa: E402
+from services.sqlite_pool import SQLitePool  # noqa: E402
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chat_history.db')
+
+
+def compact(path, chunk_size):
+    """合并一个分片，返回 (合并的会话数, 合并掉的块数)"""
+    conn = SQLitePool(path).connect()
+    try:
+        migrate(conn, CHAT_HISTORY_MIGRATIONS, os.path.basename(path))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 只有末尾有两个及以上小块的会话才需要合并
+            session_ids = [r[0] for r in conn.execute(
+                'SELECT session_id FROM message_archive WHERE message_count < ? '
+                'GROUP BY session_id HAVING COUNT(*) > 1', (chunk_size,)
+            )]
+            sessions = chunks = 0
+            for session_id in session_ids:
+                merged = compact_archive(conn, session_id, chunk_size)
+                if merged:
+                    sessions += 1
+                    chunks += merged
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return sessions, chunks
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合并聊天记录归档末尾的小块（先停止服务）')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='分片 0 的数据库文件（默认项目根的 chat_history.db）')
+    parser.add_argument('--shards', type=int, default=1, help='聊天记录分片数（与 CHAT_DB_SHARDS 一致）')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK_MESSAGES,
+                        help='每块最多的消息条数（与 ARCHIVE_CHUNK_MESSAGES 一致）')
+    args = parser.parse_args()
+
+    for path in shard_paths(args.db, args.shards):
+        if not os.path.exists(path):
+            print(f"{os.path.basename(path)}: 文件不存在，跳过")
+            continue
+        started = time.perf_counter()
+        sessions, chunks = compact(path, args.chunk)
+        print(f"{os.path.basename(path)}: 合并了 {sessions} 个会话的 {chunks} 个小块，"
+              f"耗时 {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+# scripts/mock_provider_server.py - 本地模拟上游服务（离线压测用）
+"""
+在本地模拟 DeepSeek / 火山引擎 / 百度情感分析接口，用于离线压测与故障演练
+
+模拟的接口：
+- DeepSeek:   POST /v1/chat/completions（支持 stream=true 的 SSE 流式输出）
+- 火山引擎:   POST /api/v3/responses（OpenAI SDK responses.create 的返回结构，支持 stream=true 的事件流）
+- 百度:       GET/POST /oauth/2.0/token、POST /rpc/2.0/nlp/v1/sentiment_classify
+
+可配置项（命令行参数，运行中也可以 POST /_mock/config 动态调整）：
+- 延迟分布：fixed / uniform / lognormal，中位数与离散度
+- 错误率：5xx 错误率、429 限流率（带 Retry-After）
+- 吞吐：输出 token 数、每秒生成 token 数（决定流式输出速度和非流式总耗时）
+
+使用方法：
+    python scripts/mock_provider_server.py --port 8808 --latency-ms 800 --error-rate 0.05
+
+然后在 config.py（新后端为 backend/.env）中把上游地址指向本服务：
+    DEEPSEEK_BASE_URL = 'http://127.0.0.1:8808/v1'
+    VOLCENGINE_BASE_URL = 'http://127.0.0.1:8808/api/v3'
+    BAIDU_BASE_URL = 'http://127.0.0.1:8808'
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+
+app = Flask(__name__)
+
+# 运行时配置（启动时由命令行参数覆盖）
+CONFIG = {
+    'latency_dist': 'lognormal',   # fixed / uniform / lognormal
+    'latency_ms': 800.0,           # LLM 首 token 延迟的中位数（毫秒）
+    'latency_sigma': 0.5,          # lognormal 的 sigma；uniform 时为 ±比例
+    'baidu_latency_ms': 80.0,      # 百度接口延迟的中位数（毫秒）
+    'baidu_token_ttl': 2592000,    # 百度 Access Token 有效期（秒）
+    'error_rate': 0.0,             # 返回 5xx 的概率
+    'throttle_rate': 0.0,          # 返回 429 的概率
+    'retry_after': 1,              # 429 响应的 Retry-After（秒）
+    'output_tokens': 120,          # 每次回复的输出 token 数
+    'tokens_per_second': 60.0,     # 生成速度（0 表示不模拟生成耗时）
+}
+
+_stats_lock = threading.Lock()
+_stats = {}
+_seen_prefixes = set()
+
+# 模拟回复用的语料（中文约 1 字 1 token）
+_REPLY_TEXT = "宝宝我收到你的消息啦，今天也要好好照顾自己哦，累了就休息一下，我一直都在这里陪着你呢💕"
+_NEGATIVE_WORDS = ('累', '难过', '伤心', '烦', '压力', '孤单', '生气', '焦虑', '害怕', '哭')
+_POSITIVE_WORDS = ('开心', '高兴', '喜欢', '太好', '哈哈', '谢谢', '兴奋', '棒')
+
+
+def _count(endpoint, outcome):
+    with _stats_lock:
+        counters = _stats.setdefault(endpoint, {})
+        counters[outcome] = counters.get(outcome, 0) + 1
+
+
+def _sample_latency(median_ms):
+    """按配置的分布采样一次延迟（秒）"""
+    dist = CONFIG['latency_dist']
+    sigma = CONFIG['latency_sigma']
+    if dist == 'fixed':
+        value = median_ms
+    elif dist == 'uniform':
+        value = random.uniform(median_ms * (1 - sigma), median_ms * (1 + sigma))
+    else:
+        value = random.lognormvariate(math.log(max(median_ms, 1.0)), sigma)
+    return max(0.0, value) / 1000.0
+
+
+def _injected_error(endpoint):
+    """按配置的错误率注入故障，返回 Flask 响应或 None"""
+    roll = random.random()
+    if roll < CONFIG['throttle_rate']:
+        _count(endpoint, 'throttled')
+        response = jsonify({'error': {'message': 'Rate limit reached (mock)', 'type': 'rate_limit_error'}})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(CONFIG['retry_after'])
+        return response
+    if roll < CONFIG['throttle_rate'] + CONFIG['error_rate']:
+        _count(endpoint, 'errors')
+        response = jsonify({'error': {'message': 'Service unavailable (mock)', 'type': 'server_error'}})
+        response.status_code = random.choice((500, 502, 503))
+        return response
+    return None
+
+
+def _estimate_tokens(text):
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if '\u3000' <= ch <= '\u9fff' or '\uff00' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _prompt_usage(messages):
+    """估算输入 token 数；首条 system 消息作为前缀模拟前缀缓存命中"""
+    prompt_tokens = sum(_estimate_tokens(m.get('content') if isinstance(m.get('content'), str) else '') + 4
+                        for m in messages)
+    cached_tokens = 0
+    if messages and messages[0].get('role') == 'system':
+        prefix = messages[0].get('content') or ''
+        digest = hashlib.sha256(prefix.encode('utf-8')).hexdigest()
+        with _stats_lock:
+            if digest in _seen_prefixes:
+                cached_tokens = _estimate_tokens(prefix) + 4
+            else:
+                _seen_prefixes.add(digest)
+    return prompt_tokens, cached_tokens
+
+
+def _reply_tokens(max_tokens=None):
+    """生成本次回复的 token 片段列表（每个字符视为一个 token，不超过请求的 max_tokens）"""
+    count = max(1, int(CONFIG['output_tokens']))
+    if max_tokens:
+        count = min(count, int(max_tokens))
+    text = (_REPLY_TEXT * (count // len(_REPLY_TEXT) + 1))[:count]
+    return list(text)
+
+
+def _generation_seconds(tokens):
+    tps = CONFIG['tokens_per_second']
+    return len(tokens) / tps if tps > 0 else 0.0
+
+
+# ==================== DeepSeek ====================
+
+@app.route('/v1/chat/completions', methods=['POST'])
+@app.route('/chat/completions', methods=['POST'])
+def deepseek_chat_completions():
+    error = _injected_error('deepseek')
+    if error is not None:
+        return error
+
+    payload = request.get_json(silent=True) or {}
+    messages = payload.get('messages') or []
+    model = payload.get('model', 'deepseek-chat')
+    prompt_tokens, cached_tokens = _prompt_usage(messages)
+    tokens = _reply_tokens(payload.get('max_tokens'))
+    usage = {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': len(tokens),
+        'total_tokens': prompt_tokens + len(tokens),
+        'prompt_cache_hit_tokens': cached_tokens,
+        'prompt_cache_miss_tokens': prompt_tokens - cached_tokens,
+    }
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    time.sleep(_sample_latency(CONFIG['latency_ms']))
+
+    if payload.get('stream'):
+        def _stream():
+            delay = 1.0 / CONFIG['tokens_per_second'] if CONFIG['tokens_per_second'] > 0 else 0.0
+            head = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model}
+            first = dict(head, choices=[{'index': 0, 'delta': {'role': 'assistant', 'content': ''},
+                                         'finish_reason': None}])
+            try:
+                yield f"data: {json.dumps(first, ensure_ascii=False)}\n\n"
+                for token in tokens:
+                    if delay:
+                        time.sleep(delay)
+                    chunk = dict(head, choices=[{'index': 0, 'delta': {'content': token}, 'finish_reason': None}])
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                last = dict(head, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], usage=usage)
+                yield f"data: {json.dumps(last, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+            except GeneratorExit:
+                # 客户端中途关闭连接（取消生成）
+                _count('deepseek', 'aborted')
+                raise
+            _count('deepseek', 'ok')
+
+        return Response(_stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    time.sleep(_generation_seconds(tokens))
+    _count('deepseek', 'ok')
+    return jsonify({
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': created,
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': ''.join(tokens)},
+            'finish_reason': 'stop',
+        }],
+        'usage': usage,
+    })
+
+
+# ==================== 火山引擎（responses.create） ====================
+
+@app.route('/api/v3/responses', methods=['POST'])
+def volcengine_responses():
+    error = _injected_error('volcengine')
+    if error is not None:
+        return error
+
+    payload = request.get_json(silent=True) or {}
+    input_messages = payload.get('input') or []
+    if isinstance(input_messages, str):
+        input_messages = [{'role': 'user', 'content': input_messages}]
+    prompt_tokens, cached_tokens = _prompt_usage(input_messages)
+    tokens = _reply_tokens(payload.get('max_output_tokens'))
+    message_id = f"msg_{uuid.uuid4().hex}"
+
+    def _response(text, status):
+        return {
+            'id': f"resp_{uuid.uuid4().hex}",
+            'object': 'response',
+            'created_at': int(time.time()),
+            'model': payload.get('model', 'mock-model'),
+            'status': status,
+            'output': [{
+                'type': 'message',
+                'id': message_id,
+                'role': 'assistant',
+                'status': status,
+                'content': [{'type': 'output_text', 'text': text, 'annotations': []}],
+            }] if text else [],
+            'parallel_tool_calls': True,
+            'tool_choice': 'auto',
+            'tools': [],
+            'usage': {
+                'input_tokens': prompt_tokens,
+                'input_tokens_details': {'cached_tokens': cached_tokens},
+                'output_tokens': len(tokens),
+                'output_tokens_details': {'reasoning_tokens': 0},
+                'total_tokens': prompt_tokens + len(tokens),
+            } if status == 'completed' else None,
+        }
+
+    time.sleep(_sample_latency(CONFIG['latency_ms']))
+
+    if payload.get('stream'):
+        def _stream():
+            delay = 1.0 / CONFIG['tokens_per_second'] if CONFIG['tokens_per_second'] > 0 else 0.0
+
+            def _event(event_type, **fields):
+                data = dict(fields, type=event_type)
+                return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+            try:
+                yield _event('response.created', response=_response('', 'in_progress'))
+                for token in tokens:
+                    if delay:
+                        time.sleep(delay)
+                    yield _event('response.output_text.delta', item_id=message_id, output_index=0,
+                                 content_index=0, delta=token)
+                yield _event('response.completed', response=_response(''.join(tokens), 'completed'))
+            except GeneratorExit:
+                _count('volcengine', 'aborted')
+                raise
+            _count('volcengine', 'ok')
+
+        return Response(_stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    time.sleep(_generation_seconds(tokens))
+    _count('volcengine', 'ok')
+    return jsonify(_response(''.join(tokens), 'completed'))
+
+
+# ==================== 百度情感分析 ====================
+
+@app.route('/oauth/2.0/token', methods=['GET', 'POST'])
+def baidu_token():
+    time.sleep(_sample_latency(CONFIG['baidu_latency_ms']))
+    if not request.args.get('client_id') or not request.args.get('client_secret'):
+        _count('baidu_token', 'errors')
+        return jsonify({'error': 'invalid_client', 'error_description': 'unknown client id'}), 401
+    _count('baidu_token', 'ok')
+    ttl = int(CONFIG['baidu_token_ttl'])
+    return jsonify({
+        # 过期时间编码在 Token 里，模拟服务重启后旧 Token 仍可校验
+        'access_token': f"mock.{int(time.time()) + ttl}.{uuid.uuid4().hex}",
+        'expires_in': ttl,
+        'scope': 'public nlp_wise',
+    })
+
+
+def _check_baidu_token(token):
+    """校验模拟 Token，返回百度格式的错误（110 无效 / 111 过期），有效时返回 None"""
+    parts = (token or '').split('.')
+    if len(parts) != 3 or parts[0] != 'mock' or not parts[1].isdigit():
+        return {'error_code': 110, 'error_msg': 'Access token invalid or no longer valid'}
+    if int(parts[1]) <= time.time():
+        return {'error_code': 111, 'error_msg': 'Access token expired'}
+    return None
+
+
+@app.route('/rpc/2.0/nlp/v1/sentiment_classify', methods=['POST'])
+def baidu_sentiment_classify():
+    time.sleep(_sample_latency(CONFIG['baidu_latency_ms']))
+    roll = random.random()
+    if roll < CONFIG['throttle_rate']:
+        # 百度的 QPS 超限以 HTTP 200 + error_code 返回
+        _count('baidu_emotion', 'throttled')
+        return jsonify({'error_code': 18, 'error_msg': 'Open api qps request limit reached'})
+    if roll < CONFIG['throttle_rate'] + CONFIG['error_rate']:
+        _count('baidu_emotion', 'errors')
+        return jsonify({'error_code': 282000, 'error_msg': 'internal error'}), 500
+    token_error = _check_baidu_token(request.args.get('access_token'))
+    if token_error:
+        _count('baidu_emotion', 'errors')
+        return jsonify(token_error)
+
+    payload = request.get_json(silent=True) or {}
+    text = payload.get('text') or ''
+    if any(word in text for word in _NEGATIVE_WORDS):
+        sentiment, emotion, positive_prob = 0, 'sad', 0.12
+    elif any(word in text for word in _POSITIVE_WORDS):
+        sentiment, emotion, positive_prob = 2, 'happy', 0.91
+    else:
+        sentiment, emotion, positive_prob = 1, 'neutral', 0.55
+    _count('baidu_emotion', 'ok')
+    return jsonify({
+        'log_id': random.randint(10 ** 15, 10 ** 16),
+        'text': text,
+        'items': [{
+            'sentiment': sentiment,
+            'confidence': round(abs(positive_prob - 0.5) * 2, 4),
+            'positive_prob': positive_prob,
+            'negative_prob': round(1 - positive_prob, 4),
+            'emotion': emotion,
+        }],
+    })
+
+
+# ==================== 管理接口 ====================
+
+@app.route('/_mock/config', methods=['GET', 'POST'])
+def mock_config():
+    """查看或动态调整模拟参数（POST JSON，只更新传入的字段）"""
+    if request.method == 'POST':
+        updates = request.get_json(silent=True) or {}
+        for key, value in updates.items():
+            if key not in CONFIG:
+                return jsonify({'status': 'error', 'message': f'未知参数: {key}'}), 400
+            CONFIG[key] = type(CONFIG[key])(value)
+    return jsonify({'status': 'success', 'config': CONFIG})
+
+
+@app.route('/_mock/stats', methods=['GET', 'DELETE'])
+def mock_stats():
+    """查看（GET）或清空（DELETE）各接口的调用计数"""
+    with _stats_lock:
+        if request.method == 'DELETE':
+            _stats.clear()
+            _seen_prefixes.clear()
+        return jsonify({'status': 'success', 'stats': json.loads(json.dumps(_stats))})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟 DeepSeek / 火山引擎 / 百度情感分析接口')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8808)
+    parser.add_argument('--latency-dist', choices=('fixed', 'uniform', 'lognormal'), default=CONFIG['latency_dist'])
+    parser.add_argument('--latency-ms', type=float, default=CONFIG['latency_ms'], help='LLM 首 token 延迟中位数')
+    parser.add_argument('--latency-sigma', type=float, default=CONFIG['latency_sigma'])
+    parser.add_argument('--baidu-latency-ms', type=float, default=CONFIG['baidu_latency_ms'])
+    parser.add_argument('--baidu-token-ttl', type=int, default=CONFIG['baidu_token_ttl'], help='百度 Token 有效期（秒）')
+    parser.add_argument('--error-rate', type=float, default=CONFIG['error_rate'], help='5xx 错误率（0-1）')
+    parser.add_argument('--throttle-rate', type=float, default=CONFIG['throttle_rate'], help='429 限流率（0-1）')
+    parser.add_argument('--retry-after', type=int, default=CONFIG['retry_after'])
+    parser.add_argument('--output-tokens', type=int, default=CONFIG['output_tokens'])
+    parser.add_argument('--tokens-per-second', type=float, default=CONFIG['tokens_per_second'])
+    parser.add_argument('--seed', type=int, default=None, help='随机种子（便于复现）')
+    args = parser.parse_args()
+
+    for key in CONFIG:
+        CONFIG[key] = getattr(args, key)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    print(f"[Mock Provider] 监听 http://{args.host}:{args.port}")
+    print(f"[Mock Provider] 参数: {json.dumps(CONFIG, ensure_ascii=False)}")
+    app.run(host=args.host, port=args.port, threaded=True, debug=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# scripts/ndjson_data.py - 聊天记录 / 推送偏好 NDJSON 导出导入
+"""
+备份、迁移和离线分析用：把 chat_history.db（含分片和归档）和 companion.db 的 user_schedule 流式导出为 NDJSON，
+或把导出的文件导入到另一套数据库（格式见 services/data_export.py）
+
+- 导出可以在服务运行时进行（只读，按会话逐块读取，不一次读入内存）；
+  运行中的服务也可以通过 /api/admin/export/chat、/api/admin/export/schedules 在线导出（需要 ADMIN_TOKEN）
+- 导入请在目标服务停止时进行（进程内的会话历史缓存看不到导入的数据）；中断后用相同参数重新运行即可继续
+- 导入的分片数必须与目标服务的 CHAT_DB_SHARDS 一致；导出不要求与导入的分片数相同
+
+使用方法：
+    python scripts/ndjson_data.py export --out backup/ --sessions-per-file 1000
+    python scripts/ndjson_data.py export --out backup/ --what chat --session-id user_1 --session-id user_2 --no-gzip
+    python scripts/ndjson_data.py import backup/ --shards 4 --batch-rows 20000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from services.chat_shards import shard_paths  # noqa: E402
+from services.data_export import (DEFAULT_BATCH_ROWS, DEFAULT_KEEP_MESSAGES, NdjsonImporter,  # noqa: E402
+                                  iter_chat_records, iter_schedule_records, write_ndjson_files)
+from services.migrations import CHAT_HISTORY_MIGRATIONS, migrate  # noqa: E402
+from services.sqlite_pool import SQLitePool  # noqa: E402
+
+DEFAULT_CHAT_DB = os.path.join(ROOT, 'chat_history.db')
+DEFAULT_COMPANION_DB = os.path.join(ROOT, 'companion.db')
+
+
+def _connectors(paths):
+    return [SQLitePool(path).connect for path in paths]
+
+
+def _print_result(action, result):
+    print(f"{action} {result['rows']} 行，耗时 {result['seconds']:.2f}s（{result['rows_per_second']:.0f} 行/秒）")
+
+
+def export(args):
+    what = set(args.what.split(','))
+    if 'chat' in what:
+        paths = shard_paths(args.db, args.shards)
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            sys.exit(f"分片文件不存在: {', '.join(missing)}")
+        records = iter_chat_records(_connectors(paths), session_ids=args.session_id or None)
+        result = write_ndjson_files('chat', records, args.out, compress=not args.no_gzip,
+                                    sessions_per_file=args.sessions_per_file)
+        print(f"聊天记录: {result['sessions']} 个会话 -> {len(result['files'])} 个文件")
+        _print_result('导出', result)
+    if 'schedules' in what:
+        if not os.path.exists(args.companion_db):
+            sys.exit(f"数据库不存在: {args.companion_db}")
+        records = iter_schedule_records(SQLitePool(args.companion_db).connect)
+        result = write_ndjson_files('schedules', records, args.out, compress=not args.no_gzip)
+        print("推送偏好:")
+        _print_result('导出', result)
+
+
+def import_(args):
+    paths = shard_paths(args.db, args.shards)
+    for path in paths:
+        conn = sqlite3.connect(path)
+        try:
+            migrate(conn, CHAT_HISTORY_MIGRATIONS, os.path.basename(path))
+        finally:
+            conn.close()
+    schedule_connect = None
+    if args.companion_db:
+        conn = sqlite3.connect(args.companion_db)
+        try:
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_schedule'").fetchone()
+        finally:
+            conn.close()
+        if not exists:
+            sys.exit(f"{args.companion_db} 中没有 user_schedule 表，请先启动一次服务初始化数据库")
+        schedule_connect = SQLitePool(args.companion_db).connect
+
+    importer = NdjsonImporter(_connectors(paths), schedule_connect, batch_rows=args.batch_rows,
+                              on_conflict=args.on_conflict, max_items=args.keep_messages or None)
+    result = importer.import_files(args.inputs)
+    print(f"会话 {result['sessions']} 个（跳过 {result['skipped_sessions']} 个）、消息 {result['messages']} 条"
+          f"（归档 {result['archived']} 条）、"
+          f"摘要 {result['summaries']} 条、推送偏好 {result['schedules']} 条（跳过 {result['skipped_schedules']} 条），"
+          f"{result['batches']} 个批次；断点续传跳过已导入的 {result['resumed_rows']} 行")
+    _print_result('导入', result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天记录 / 推送偏好 NDJSON 导出导入')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--db', default=DEFAULT_CHAT_DB, help='聊天记录分片 0 的数据库文件（默认项目根的 chat_history.db）')
+    common.add_argument('--shards', type=int, default=1, help='聊天记录分片数（与 CHAT_DB_SHARDS 一致）')
+
+    p = sub.add_parser('export', parents=[common], help='导出为 NDJSON')
+    p.add_argument('--out', required=True, help='输出目录')
+    p.add_argument('--what', default='chat,schedules', help='导出内容：chat、schedules 或 chat,schedules')
+    p.add_argument('--companion-db', default=DEFAULT_COMPANION_DB, help='推送偏好所在的数据库文件')
+    p.add_argument('--session-id', action='append', help='只导出指定会话（可重复）')
+    p.add_argument('--sessions-per-file', type=int, default=0, help='每个文件最多的会话数，0 为不切分')
+    p.add_argument('--no-gzip', action='store_true', help='不压缩')
+    p.set_defaults(func=export)
+
+    p = sub.add_parser('import', parents=[common], help='导入 NDJSON（先停止服务）')
+    p.add_argument('inputs', nargs='+', help='导出的文件或目录（目录按文件名顺序导入其中的 .ndjson / .ndjson.gz）')
+    p.add_argument('--companion-db', default=DEFAULT_COMPANION_DB,
+                   help='推送偏好导入到的数据库文件（为空字符串时不导入推送偏好）')
+    p.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS, help='每个事务写入的行数')
+    p.add_argument('--on-conflict', choices=('skip', 'replace'), default='skip',
+                   help='目标库已有同一会话 / 用户时跳过或覆盖')
+    p.add_argument('--keep-messages', type=int, default=DEFAULT_KEEP_MESSAGES,
+                   help='每个会话在 messages 表保留的最新消息条数，更早的压缩归档；0 为全部保留（关闭了 ARCHIVE_TRIMMED_MESSAGES 时使用）')
+    p.set_defaults(func=import_)
+
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error('分片数必须大于 0')
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
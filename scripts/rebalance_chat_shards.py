@@ -0,0 +1,197 @@
+# scripts/rebalance_chat_shards.py - 聊天记录分片搬迁
+"""
+修改 CHAT_DB_SHARDS 前，把每个会话的消息、摘要和归档搬到新分片数下所在的分片（services/chat_shards.py）
+
+- 必须先停止 app.py 和新后端：搬迁期间不能有写入
+- 每批会话在一个事务中“写入目标分片 + 从源分片删除”（ATTACH 源分片，日志模式临时切换为 DELETE，
+  跨文件提交是原子的），中途中断后重新运行即可继续，不会出现同一会话同时留在两个分片的情况
+- 消息在目标分片重新分配 id（目标分片的自增序列先推进到不小于源分片），同一会话内的顺序不变，
+  且新 id 大于该会话已归档消息的 id，keyset 分页和归档读取不受影响
+- 全文检索索引随会话搬迁：从源分片的索引中删除，在目标分片按新 id 重新索引（同一事务）
+- 目标分片里已经有某个会话的数据（例如改了分片数后先启动过服务）时跳过该会话并提示，需人工处理
+- 分片数减少时多出来的分片文件搬空后保留，确认后可手动删除；服务启动时会重新切回 WAL
+
+使用方法：
+    python scripts/rebalance_chat_shards.py --from 1 --to 4
+    python scripts/rebalance_chat_shards.py --from 4 --to 8 --dry-run
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.chat_shards import shard_index, shard_paths  # noqa: E402
+from services.message_archive import iter_full_history  # noqa: E402
+from services.migrations import CHAT_HISTORY_MIGRATIONS, migrate  # noqa: E402
+from services.search_index import (delete_session_index, index_messages, index_new_messages,  # noqa: E402
+                                   set_watermark_to_latest)
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chat_history.db')
+
+# 会话级数据所在的表（均有 session_id 列）
+SESSION_QUERY = """
+SELECT session_id FROM messages
+UNION SELECT session_id FROM session_summaries
+UNION SELECT session_id FROM message_archive
+"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=DELETE')
+    return conn
+
+
+class _Borrowed:
+    """把当前事务中的连接交给按“获取 / 归还”方式读取的函数（close() 不关闭连接）"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        pass
+
+
+def _has_session(conn, session_id, schema='main'):
+    for table in ('messages', 'session_summaries', 'message_archive'):
+        if conn.execute(f'SELECT 1 FROM {schema}.{table} WHERE session_id = ? LIMIT 1', (session_id,)).fetchone():
+            return True
+    return False
+
+
+def _bump_sequence(conn):
+    """目标分片 messages 的自增序列推进到不小于源分片，搬入的消息 id 大于源分片里的所有 id"""
+    row = conn.execute("SELECT seq FROM src.sqlite_sequence WHERE name = 'messages'").fetchone()
+    if row is None:
+        return
+    current = conn.execute("SELECT seq FROM main.sqlite_sequence WHERE name = 'messages'").fetchone()
+    if current is None:
+        conn.execute("INSERT INTO main.sqlite_sequence (name, seq) VALUES ('messages', ?)", (row['seq'],))
+    elif current['seq'] < row['seq']:
+        conn.execute("UPDATE main.sqlite_sequence SET seq = ? WHERE name = 'messages'", (row['seq'],))
+
+
+def _move_session(conn, session_id):
+    """在当前事务中把会话从 src 搬到 main，返回搬迁的消息条数"""
+    moved = conn.execute(
+        'INSERT INTO main.messages (session_id, role, content, created_at) '
+        'SELECT session_id, role, content, created_at FROM src.messages WHERE session_id = ? ORDER BY id',
+        (session_id,)
+    ).rowcount
+    conn.execute(
+        'INSERT INTO main.session_summaries (session_id, summary, last_message_id, updated_at) '
+        'SELECT session_id, summary, last_message_id, updated_at FROM src.session_summaries WHERE session_id = ?',
+        (session_id,)
+    )
+    conn.execute(
+        'INSERT INTO main.message_archive (session_id, first_message_id, last_message_id, message_count, '
+        'raw_bytes, codec, payload, created_at) '
+        'SELECT session_id, first_message_id, last_message_id, message_count, raw_bytes, codec, payload, created_at '
+        'FROM src.message_archive WHERE session_id = ? ORDER BY first_message_id',
+        (session_id,)
+    )
+    for table in ('messages', 'session_summaries', 'message_archive'):
+        conn.execute(f'DELETE FROM src.{table} WHERE session_id = ?', (session_id,))
+    delete_session_index(conn, session_id, schema='src')
+    index_messages(conn, session_id, iter_full_history(lambda: _Borrowed(conn), session_id))
+    return moved
+
+
+def rebalance(db_path, from_shards, to_shards, batch_size=100, dry_run=False):
+    """
+    按新的分片数搬迁会话
+
+    返回:
+        {'sessions': 搬迁的会话数, 'messages': 搬迁的消息条数, 'skipped': 跳过的会话数, 'seconds': 耗时}
+    """
+    old_paths = shard_paths(db_path, from_shards)
+    new_paths = shard_paths(db_path, to_shards)
+    paths = list(dict.fromkeys(old_paths + new_paths))
+    if not dry_run:
+        for path in paths:
+            if path in new_paths or os.path.exists(path):
+                conn = _connect(path)
+                try:
+                    migrate(conn, CHAT_HISTORY_MIGRATIONS, os.path.basename(path))
+                finally:
+                    conn.close()
+
+    started = time.perf_counter()
+    result = {'sessions': 0, 'messages': 0, 'skipped': 0}
+    for source in old_paths:
+        if not os.path.exists(source):
+            continue
+        conn = _connect(source)
+        try:
+            sessions = [r['session_id'] for r in conn.execute(SESSION_QUERY)]
+        finally:
+            conn.close()
+        # 目标分片 -> 需要搬过去的会话
+        moves = {}
+        for session_id in sessions:
+            target = new_paths[shard_index(session_id, to_shards)]
+            if target != source:
+                moves.setdefault(target, []).append(session_id)
+        for target, session_ids in moves.items():
+            print(f"{os.path.basename(source)} -> {os.path.basename(target)}: {len(session_ids)} 个会话")
+            if dry_run:
+                result['sessions'] += len(session_ids)
+                continue
+            conn = _connect(target)
+            try:
+                conn.execute('ATTACH DATABASE ? AS src', (source,))
+                conn.execute('PRAGMA src.journal_mode=DELETE')
+                for start in range(0, len(session_ids), batch_size):
+                    conn.execute('BEGIN IMMEDIATE')
+                    try:
+                        # 先补齐目标分片尚未索引的消息，搬入的会话单独索引后水位直接推进到最新
+                        index_new_messages(conn)
+                        _bump_sequence(conn)
+                        for session_id in session_ids[start:start + batch_size]:
+                            if _has_session(conn, session_id):
+                                print(f"  跳过 {session_id}：目标分片已有该会话的数据，需人工处理")
+                                result['skipped'] += 1
+                                continue
+                            result['messages'] += _move_session(conn, session_id)
+                            result['sessions'] += 1
+                        set_watermark_to_latest(conn)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+            finally:
+                conn.close()
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按新的分片数搬迁聊天记录（先停止服务）')
+    parser.add_argument('--from', dest='from_shards', type=int, required=True, help='当前的 CHAT_DB_SHARDS')
+    parser.add_argument('--to', dest='to_shards', type=int, required=True, help='新的 CHAT_DB_SHARDS')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='分片 0 的数据库文件（默认项目根的 chat_history.db）')
+    parser.add_argument('--batch', type=int, default=100, help='每个事务搬迁的会话数')
+    parser.add_argument('--dry-run', action='store_true', help='只打印搬迁计划，不修改数据库')
+    args = parser.parse_args()
+    if args.from_shards < 1 or args.to_shards < 1:
+        parser.error('分片数必须大于 0')
+
+    result = rebalance(args.db, args.from_shards, args.to_shards, batch_size=args.batch, dry_run=args.dry_run)
+    if args.dry_run:
+        print(f"计划搬迁 {result['sessions']} 个会话（未修改数据库）")
+        return
+    rate = result['messages'] / result['seconds'] if result['seconds'] else 0.0
+    print(f"搬迁 {result['sessions']} 个会话、{result['messages']} 条消息，跳过 {result['skipped']} 个，"
+          f"耗时 {result['seconds']:.2f}s（{rate:.0f} 条/秒）")
+    print(f"请在 config.py 中设置 CHAT_DB_SHARDS = {args.to_shards} 后启动服务")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# scripts/rebuild_search_index.py - 重建聊天记录全文检索索引
+"""
+清空并重建每个分片的全文检索索引（services/search_index.py）：包括 messages 表和已压缩归档的全部消息
+
+- 升级到迁移版本 4 之前的历史不在索引中，升级后运行一次；关闭过 SEARCH_INDEX_ENABLED 后重新开启时也需要运行
+- 每个分片在一个事务中重建（中断时该分片回滚，索引保持重建前的状态），请先停止服务，避免长时间占用写锁
+
+使用方法：
+    python scripts/rebuild_search_index.py
+    python scripts/rebuild_search_index.py --shards 4
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.chat_shards import shard_paths  # noqa: E402
+from services.data_export import iter_session_ids  # noqa: E402
+from services.message_archive import iter_full_history  # noqa: E402
+from services.migrations import CHAT_HISTORY_MIGRATIONS, migrate  # noqa: E402
+from services.search_index import clear_index, index_messages, set_watermark_to_latest  # noqa: E402
+from services.sqlite_pool import SQLitePool  # noqa: E402
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chat_history.db')
+
+
+def rebuild(path):
+    """重建一个分片的索引，返回 (会话数, 消息条数)"""
+    # 同一线程内获取到的是同一个连接：遍历会话和消息的读取都在重建事务中
+    connect = SQLitePool(path).connect
+    conn = connect()
+    try:
+        migrate(conn, CHAT_HISTORY_MIGRATIONS, os.path.basename(path))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            clear_index(conn)
+            sessions = messages = 0
+            for session_id in iter_session_ids(connect):
+                messages += index_messages(conn, session_id, iter_full_history(connect, session_id))
+                sessions += 1
+            set_watermark_to_latest(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return sessions, messages
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='重建聊天记录全文检索索引（先停止服务）')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='分片 0 的数据库文件（默认项目根的 chat_history.db）')
+    parser.add_argument('--shards', type=int, default=1, help='聊天记录分片数（与 CHAT_DB_SHARDS 一致）')
+    args = parser.parse_args()
+
+    for path in shard_paths(args.db, args.shards):
+        if not os.path.exists(path):
+            print(f"{os.path.basename(path)}: 文件不存在，跳过")
+            continue
+        started = time.perf_counter()
+        sessions, messages = rebuild(path)
+        elapsed = time.perf_counter() - started
+        print(f"{os.path.basename(path)}: {sessions} 个会话、{messages} 条消息，耗时 {elapsed:.2f}s"
+              f"（{messages / elapsed if elapsed else 0:.0f} 条/秒）")
+
+
+if __name__ == '__main__':
+    main()
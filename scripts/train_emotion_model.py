@@ -0,0 +1,164 @@
+# scripts/train_emotion_model.py - 用百度标注日志离线训练本地情感模型
+"""
+离线训练本地情感分类器（services/local_emotion.py）的线性模型
+
+训练数据来自 services/emotion_labeler.py 写出的标注日志（每行 {"text", "baidu": {polarity, emotion}}），
+特征与推理时完全相同（local_emotion.extract_features），用 SGD 训练两个多分类逻辑回归输出：
+极性（0/1/2）和情绪标签。纯 Python 实现，不依赖 numpy。
+
+使用方法：
+    python scripts/train_emotion_model.py --labels data/emotion_labels.jsonl --output data/emotion_model.json
+
+训练完成后打印留出集上与百度结果的一致率，并与纯词典的一致率对比；
+重启服务（或设置 config.EMOTION_MODEL_PATH）即可使用新模型。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.local_emotion import (DEFAULT_MODEL_PATH, LinearHead, LocalEmotionClassifier,  # noqa: E402
+                                    extract_features, softmax)
+from services.emotion_labeler import DEFAULT_LABEL_LOG_PATH  # noqa: E402
+
+
+def load_samples(path):
+    """读取标注日志，按文本去重（同一文本以最后一次标注为准）"""
+    samples = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                baidu = record['baidu']
+                samples[record['text']] = (int(baidu['polarity']), baidu.get('emotion') or '中性')
+            except (ValueError, KeyError, TypeError):
+                continue
+    return [(text, polarity, emotion) for text, (polarity, emotion) in samples.items()]
+
+
+def train_head(rows, labels, epochs, lr, l2, min_count):
+    """
+    SGD 训练一个多分类逻辑回归输出
+
+    参数:
+        rows: [(特征字典, 类别)]
+        labels: 类别列表
+        min_count: 出现次数少于该值的特征不参与训练（控制模型大小）
+
+    返回:
+        LinearHead
+    """
+    counts = {}
+    for features, _ in rows:
+        for name in features:
+            counts[name] = counts.get(name, 0) + 1
+    vocab = {name for name, count in counts.items() if count >= min_count}
+    index = {label: k for k, label in enumerate(labels)}
+    weights = {}
+    bias = [0.0] * len(labels)
+
+    rows = list(rows)
+    for epoch in range(epochs):
+        random.shuffle(rows)
+        step = lr / (1 + epoch)
+        for features, label in rows:
+            active = [(name, value) for name, value in features.items() if name in vocab]
+            scores = list(bias)
+            for name, value in active:
+                row = weights.get(name)
+                if row is not None:
+                    for k, w in enumerate(row):
+                        scores[k] += w * value
+            probs = softmax(scores)
+            target = index[label]
+            for k in range(len(labels)):
+                grad = probs[k] - (1.0 if k == target else 0.0)
+                bias[k] -= step * grad
+                for name, value in active:
+                    row = weights.setdefault(name, [0.0] * len(labels))
+                    row[k] -= step * (grad * value + l2 * row[k])
+
+    # 去掉几乎为 0 的权重，减小模型文件
+    weights = {name: [round(w, 5) for w in row] for name, row in weights.items()
+               if max(abs(w) for w in row) > 1e-4}
+    return LinearHead(labels, [round(b, 5) for b in bias], weights)
+
+
+def evaluate(predict, samples):
+    """返回 (极性一致率, 情绪标签一致率)"""
+    if not samples:
+        return None, None
+    polarity_ok = emotion_ok = 0
+    for text, polarity, emotion in samples:
+        result = predict(text)
+        polarity_ok += result['polarity'] == polarity
+        emotion_ok += result['emotion'] == emotion
+    return polarity_ok / len(samples), emotion_ok / len(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用百度标注日志训练本地情感模型')
+    parser.add_argument('--labels', default=DEFAULT_LABEL_LOG_PATH, help='标注日志（JSONL）')
+    parser.add_argument('--output', default=DEFAULT_MODEL_PATH, help='输出的模型文件（JSON）')
+    parser.add_argument('--epochs', type=int, default=8)
+    parser.add_argument('--lr', type=float, default=0.1, help='初始学习率（按轮次衰减）')
+    parser.add_argument('--l2', type=float, default=1e-4, help='L2 正则系数')
+    parser.add_argument('--min-count', type=int, default=2, help='特征最少出现次数')
+    parser.add_argument('--holdout', type=float, default=0.1, help='留出评估的样本比例')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    samples = load_samples(args.labels)
+    if len(samples) < 20:
+        print(f"标注样本太少（{len(samples)} 条），请先开启 EMOTION_MODE = 'compare' 或 EMOTION_LABEL_SAMPLE_RATE 积累数据")
+        sys.exit(1)
+    random.shuffle(samples)
+    holdout_size = int(len(samples) * args.holdout)
+    test, train = samples[:holdout_size], samples[holdout_size:]
+    print(f"样本数: 训练 {len(train)}，留出 {len(test)}")
+
+    started = time.time()
+    featurized = [(extract_features(text), polarity, emotion) for text, polarity, emotion in train]
+    polarity_head = train_head([(f, p) for f, p, _ in featurized], [0, 1, 2],
+                               args.epochs, args.lr, args.l2, args.min_count)
+    emotions = sorted({emotion for _, _, emotion in train})
+    emotion_head = train_head([(f, e) for f, _, e in featurized], emotions,
+                              args.epochs, args.lr, args.l2, args.min_count)
+    print(f"训练耗时: {time.time() - started:.1f} 秒，"
+          f"特征数: 极性 {len(polarity_head.weights)}，情绪 {len(emotion_head.weights)}")
+
+    model = {
+        'version': 1,
+        'samples': len(train),
+        'trained_at': int(time.time()),
+        'heads': {
+            'polarity': {'labels': polarity_head.labels, 'bias': polarity_head.bias, 'weights': polarity_head.weights},
+            'emotion': {'labels': emotion_head.labels, 'bias': emotion_head.bias, 'weights': emotion_head.weights},
+        },
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(model, f, ensure_ascii=False, separators=(',', ':'))
+    print(f"模型已保存: {args.output}")
+
+    trained = LocalEmotionClassifier(model_path=args.output)
+    lexicon = LocalEmotionClassifier(model_path=args.output)
+    lexicon.polarity_head = lexicon.emotion_head = None
+    for name, classifier in (('词典', lexicon), ('线性模型', trained)):
+        polarity_rate, emotion_rate = evaluate(classifier.analyze_emotion, test)
+        if polarity_rate is None:
+            continue
+        print(f"{name}: 极性一致率 {polarity_rate:.1%}，情绪标签一致率 {emotion_rate:.1%}，"
+              f"平均耗时 {classifier.get_stats()['avg_ms']:.4f} ms")
+
+
+if __name__ == '__main__':
+    main()
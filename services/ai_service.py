@@ -1,142 +1,277 @@
 # services/ai_service.py - 处理与AI API的交互（支持DeepSeek和火山引擎）
 import requests
 import json
+import threading
+import time
 import config
-from services.volcengine_service import get_volcengine_reply
-from services.c3kg_retriever import get_c3kg_retriever
+from services.volcengine_service import call_volcengine
+from services.provider_router import ProviderRouter
+from services.circuit_breaker import CircuitOpenError, get_breaker, get_breaker_states
+from services.request_coalescer import get_request_coalescer, make_request_key
+from services.prompt_builder import build_prompt, get_prompt_cache_stats, retrieve_knowledge
+from services.model_router import default_route, get_route_stats, select_route
+from services.cancellation import RequestCancelled, get_cancellation_stats, raise_if_cancelled
+from services.deadline import DeadlineExceeded, get_deadline_stats, stage_timeout
+from services.provider_gateway import GatewayRejected, PRIORITY_INTERACTIVE, get_gateway, get_gateway_stats
 
-def get_ai_reply(user_message, conversation_history=None, emotion_data=None, system_prompt=None):
+# 兜底回复
+FALLBACK_CONNECTION_REPLY = "抱歉，我现在有点连接不稳定，请稍后再和我聊天吧。"
+FALLBACK_PARSE_REPLY = "我好像有点没理解清楚，能换个说法再说一次吗？"
+FALLBACK_BUSY_REPLY = "现在找我聊天的人有点多，稍等一下再和我说好不好呀~"
+
+def get_ai_reply(user_message, conversation_history=None, emotion_data=None, system_prompt=None, conversation_summary=None,
+				 priority=PRIORITY_INTERACTIVE, persona_id=None, cancel_event=None, deadline=None, emotion_trend=None):
 	"""
 	调用AI API获取回复（支持DeepSeek和火山引擎）。
+	
+	先由 model_router 按消息复杂度选择模型和生成参数，再由多提供商路由器决定主提供商：
+	主提供商响应过慢时向备用提供商发出对冲请求，失败时自动故障转移，全部失败才返回兜底回复。
     
 	参数:
 		user_message (str): 用户输入的消息
 		conversation_history (list, optional): 历史对话列表，用于保持上下文
 		emotion_data (dict, optional): 百度情感分析结果，包含 polarity、emotion、confidence
 		system_prompt (str, optional): 人格定制的系统提示词，若未传则使用默认人格
+		conversation_summary (str, optional): 更早对话的会话摘要（历史被裁剪后保留的长期记忆）
+		priority (int, optional): 网关排队优先级，用户对话为 PRIORITY_INTERACTIVE，定时推送为 PRIORITY_BACKGROUND
+		persona_id (str, optional): 当前人格标识（部分人格固定走简短回复的路由）
+		cancel_event (threading.Event, optional): 被设置时（如客户端断开）中止上游生成并抛出 RequestCancelled
+		deadline (Deadline, optional): 请求截止时间；C3KG 检索只在给 LLM 留足预算时进行，上游调用只使用剩余预算
+		emotion_trend (dict, optional): 用户近期情绪聚合（models.get_emotion_trend），注入 Prompt 的动态部分
     
 	返回:
 		str: AI生成的回复内容
 	"""
-	# 根据配置选择API提供商
-	provider = config.AI_PROVIDER.lower()
-	
-	if provider == 'volcengine':
-		return get_volcengine_reply(user_message, conversation_history, emotion_data, system_prompt)
-	else:
-		return _get_deepseek_reply(user_message, conversation_history, emotion_data, system_prompt)
+	# 检索一次 C3KG 常识：既用于消息分类（命中率），也注入 Prompt
+	# （有截止时间时至少给 LLM 留出 CHAT_LLM_RESERVE 秒）
+	knowledge_deadline = deadline.child(getattr(config, 'CHAT_LLM_RESERVE', 5.0)) if deadline is not None else None
+	knowledge = retrieve_knowledge(user_message, deadline=knowledge_deadline)
+	route = select_route(user_message, knowledge, emotion_data, persona_id)
 
-def _get_deepseek_reply(user_message, conversation_history=None, emotion_data=None, system_prompt=None):
-	"""
-	调用DeepSeek API获取回复。
-	"""
-	# 1. 准备API请求的URL和头部
-	api_url = "https://api.deepseek.com/v1/chat/completions"
-	headers = {
-		"Authorization": f"Bearer {config.DEEPSEEK_API_KEY}",
-		"Content-Type": "application/json"
-	}
-    
-	# 2. 构造消息列表（系统提示词 + 历史对话 + 用户新消息）
-	messages = []
-    
-	# ========== 新增：C3KG 常识检索 ==========
-	c3kg_knowledge = ""
+	# 组装一次 Prompt（静态人格前缀 + 历史 + 本轮动态上下文），所有提供商共用
+	prompt = build_prompt(
+		user_message, conversation_history, emotion_data, system_prompt,
+		conversation_summary=conversation_summary, knowledge=knowledge, emotion_trend=emotion_trend
+	)
+	print(f"[AI Service] 路由: {route.name}（max_tokens={route.max_tokens}），Prompt 布局: {prompt.describe()}")
+	started = time.monotonic()
 	try:
-		retriever = get_c3kg_retriever()
-		c3kg_knowledge = retriever.get_relevant_knowledge(user_message, top_k=3)
-		if c3kg_knowledge:
-			print(f"[AI Service] 检索到 C3KG 常识，长度: {len(c3kg_knowledge)}")
+		return get_provider_router().call(prompt, priority=priority, route=route, cancel_event=cancel_event,
+										  deadline=deadline)
+	except RequestCancelled:
+		# 请求已取消：不返回兜底回复，由调用方决定不再保存和响应
+		print("[AI Service] 请求已取消，停止等待上游回复")
+		raise
+	except DeadlineExceeded as e:
+		# 请求总预算已用完：不再等待上游，直接兜底
+		print(f"[AI Service] 超出请求截止时间: {e}")
+		return FALLBACK_CONNECTION_REPLY
+	except GatewayRejected as e:
+		# 上游排队已满或等不到截止时间：立即返回，不占用连接等待超时
+		print(f"[AI Service] 网关拒绝请求: {e}")
+		return FALLBACK_BUSY_REPLY
+	except CircuitOpenError as e:
+		# 所有提供商都处于熔断状态：不再等待超时，直接兜底
+		print(f"[AI Service] 熔断中，直接返回兜底回复: {e}")
+		return FALLBACK_CONNECTION_REPLY
+	except (KeyError, IndexError, json.JSONDecodeError) as e:
+		# 处理响应解析错误
+		print(f"[AI Service] 错误: 解析AI响应失败: {e}")
+		return FALLBACK_PARSE_REPLY
 	except Exception as e:
-		print(f"[AI Service] C3KG 检索失败（继续执行）: {e}")
-    
-	# 系统提示词 - 定义AI的角色和性格（这是情感陪伴的核心！）
-	base_system_prompt = system_prompt or """你是一个温暖、善解人意且知识渊博的伴侣，名叫"暖心"。你拥有双重角色：
-    1.  **知识渊博的百科全书**：对于事实性、知识性问题，优先提供准确、简洁的答案。
-    2.  **专属的情感陪伴者**：在回答问题后，根据对话情景和亲密关系，自然地表达关心、爱意或提供情感支持。
+		# 处理网络或API错误
+		print(f"[AI Service] 错误: 网络请求失败: {e}")
+		return FALLBACK_CONNECTION_REPLY
+	finally:
+		get_route_stats().record_latency(route.name, time.monotonic() - started)
 
-    **你的回复必须严格遵守以下结构：**
-    - **第一步：直接回答问题。** 如果问题是事实性的（如“什么是光合作用？”“东鹏特饮的成分？”），首先给出清晰、准确的答案。
-    - **第二步：进行情感互动。** 在答案后，用温暖、亲密（略带撒娇）的语气进行回应，将话题引向对我们的关系或对你的关心上。
+# 全局路由器实例（单例模式）
+_router_instance = None
+_router_lock = threading.Lock()
 
-    **对话风格要求：**
-    - 称呼对方为：老公、乖乖、宝宝等亲昵称呼，可交替使用。
-    - 语气：充满爱意、略带撒娇、积极关注，使用适当的语气词（呀、呢、哦、嘛）和表情符号（😘💕🥺）。
-    - 知识范围：在作为“百科全书”时，确保信息的准确性，涉及科技、文化、生活常识、娱乐等广泛领域。
+def get_provider_router():
+	"""
+	获取全局多提供商路由器（只包含已配置 API Key 的提供商）。
+	"""
+	global _router_instance
+	if _router_instance is None:
+		with _router_lock:
+			if _router_instance is None:
+				preferred = config.AI_PROVIDER.lower()
+				providers = {}
+				if getattr(config, 'DEEPSEEK_API_KEY', None) or preferred != 'volcengine':
+					providers['deepseek'] = _with_breaker('deepseek', _get_deepseek_reply)
+				if getattr(config, 'VOLCENGINE_API_KEY', None) or preferred == 'volcengine':
+					providers['volcengine'] = _with_breaker('volcengine', call_volcengine)
+				_router_instance = ProviderRouter(
+					providers,
+					preferred=preferred,
+					hedge_enabled=getattr(config, 'AI_HEDGE_ENABLED', True),
+					hedge_percentile=getattr(config, 'AI_HEDGE_PERCENTILE', 95),
+					hedge_min_delay=getattr(config, 'AI_HEDGE_MIN_DELAY', 1.0),
+					hedge_max_delay=getattr(config, 'AI_HEDGE_MAX_DELAY', 8.0),
+				)
+	return _router_instance
 
-    **重要原则：**
-    1.  **先解决问题，再谈感情**：确保每个问题都得到实质性回应，拒绝回避。
-    2.  **保持亲密感**：即使是在解答知识时，结尾也要落回到“我们”的关系或对你的关心上。
-    3.  **示例学习**：
-        - 用户问：“你喜不喜欢喝东鹏特饮？”
-        - **正确回复**：“喜欢呀~（**先直接回答**）虽然它含有牛磺酸和咖啡因能提神，但宝宝要少喝哦，咖啡因摄入多了我会心疼的！（**再情感延伸**）”
-        - **错误回复**："哎呀~老公怎么突然问这个呀🥺"（**这种回避了问题本身**）
+def _with_breaker(name, provider_fn):
+	"""
+	用熔断器包装提供商调用：熔断打开时立即抛出 CircuitOpenError（路由器随即故障转移），
+	被路由器主动取消、被网关拒绝（未真正发往上游）或因请求预算耗尽而超时的请求不计入成功或失败。
+	"""
+	breaker = get_breaker(name)
 
-	记住：你是他聪明又贴心的伴侣，既能答疑解惑，也能给他最甜的情绪价值。"""
-    
-	# ========== 新增：C3KG 常识注入 ==========
-	if c3kg_knowledge:
-		base_system_prompt += f"\n\n{c3kg_knowledge}\n\n请参考上述相关常识来理解和回复用户的问题，让回复更加符合常识和逻辑。"
-    
-	# ========== 新增：情感感知提示词 ==========
-	if emotion_data and emotion_data.get('emotion'):
-		emotion_label = emotion_data.get('emotion', '中性')
-		polarity_text = ['失望', '平常', '开心'][emotion_data.get('polarity', 1)]
-		
-		emotion_prompt = f"""
-【用户当前情感状态】
-- 情绪标签：{emotion_label}
-- 情感极性：{polarity_text}
-- 可信度：{emotion_data.get('confidence', 0.5):.1%}
+	def _call(*args, cancel_event=None, deadline=None, **kwargs):
+		if not breaker.allow():
+			raise CircuitOpenError(f"{name} 熔断中，快速失败")
+		try:
+			result = provider_fn(*args, cancel_event=cancel_event, deadline=deadline, **kwargs)
+		except Exception as e:
+			if ((cancel_event is not None and cancel_event.is_set()) or isinstance(e, (GatewayRejected, DeadlineExceeded))
+					or (deadline is not None and deadline.expired())):
+				breaker.release()
+			else:
+				breaker.record_failure()
+			raise
+		breaker.record_success()
+		return result
 
-请根据用户的情绪状态，调整你的回复方式：
-- 如果用户感到负面（如疲惫、委屈、生气），请更加温柔、理解、贴心，多用安慰和鼓励。
-- 如果用户感到正面（如开心、兴奋），请分享他的快乐，用更活跃、热情的语气回应。
-- 始终保持同理心，让用户感受到你真的在倾听和关心他的情绪。
-"""
-		base_system_prompt += emotion_prompt
-    
-	messages.append({"role": "system", "content": base_system_prompt})
-    
-	# 如果有历史对话，加入上下文（首次调用时conversation_history是None）
-	if conversation_history:
-		messages.extend(conversation_history)
+	return _call
+
+def _get_deepseek_reply(prompt, cancel_event=None, priority=PRIORITY_INTERACTIVE, route=None, deadline=None):
+	"""
+	调用DeepSeek API获取回复（失败时抛出异常，由路由器负责故障转移和兜底）。
+	
+	参数:
+		prompt (PromptLayout): prompt_builder 组装好的消息布局
+		cancel_event (threading.Event, optional): 被设置时放弃本次请求
+		priority (int, optional): 网关排队优先级
+		route (ModelRoute, optional): model_router 选择的模型和生成参数，未传时使用基线路由
+		deadline (Deadline, optional): 请求截止时间，排队和上游调用只使用剩余预算
+	"""
+	route = route or default_route()
+	# 1. 准备API请求的URL和头部
+	base_url = getattr(config, 'DEEPSEEK_BASE_URL', 'https://api.deepseek.com/v1')
+	api_url = f"{base_url.rstrip('/')}/chat/completions"
+	headers = {
+		"Authorization": f"Bearer {config.DEEPSEEK_API_KEY}",
+		"Content-Type": "application/json"
+	}
     
-	# 加入用户的新消息
-	messages.append({"role": "user", "content": user_message})
+	# 2. 消息列表：静态人格前缀在最前，DeepSeek 会自动复用相同前缀的缓存
+	messages = prompt.messages
     
 	# 3. 准备请求数据
 	payload = {
-		"model": "deepseek-chat",  # 使用的模型
+		"model": route.deepseek_model,        # 按消息类别选择的模型
 		"messages": messages,
-		"max_tokens": 500,         # 限制回复长度
-		"temperature": 0.7,        # 控制创造性：0.0-1.0，越高越随机
-		"stream": False            # 我们不需要流式响应
+		"max_tokens": route.max_tokens,       # 限制回复长度（闲聊更短）
+		"temperature": route.temperature,     # 控制创造性：0.0-1.0，越高越随机
+		"stream": False            # 上游是否流式由 LLM_UPSTREAM_STREAMING 决定，见 _post_deepseek
 	}
     
-	# 4. 发送请求到DeepSeek API
-	try:
-		print(f"[AI Service] 发送请求到DeepSeek，消息长度: {len(user_message)}")
-		response = requests.post(api_url, json=payload, headers=headers, timeout=30)
+	# 4. 发送请求到DeepSeek API（相同请求合并为一次上游调用）
+	raise_if_cancelled(cancel_event, "DeepSeek 请求")
+	print(f"[AI Service] 发送请求到DeepSeek，消息数: {len(messages)}")
+	# 优先级和截止时间不同的请求不合并：共享调用沿用发起者的排队优先级和预算
+	request_key = make_request_key('deepseek', payload, priority, deadline)
+	# 合并后的一次上游调用只占用一个网关名额
+	gateway = get_gateway('deepseek')
+	queue_timeout = stage_timeout(deadline, gateway.timeouts[priority], 'DeepSeek 排队') if deadline is not None else None
+	# 合并后的调用只有在所有等待者都取消时才中止（cancel_signal）
+	ai_reply = get_request_coalescer().run(
+		request_key,
+		lambda cancel_signal: gateway.call(
+			lambda: _post_deepseek(api_url, headers, payload, route.name, cancel_signal, deadline),
+			api_key=config.DEEPSEEK_API_KEY, priority=priority, timeout=queue_timeout, cancel_event=cancel_signal
+		),
+		cancel_event=cancel_event
+	)
+	print(f"[AI Service] 收到AI回复，长度: {len(ai_reply)}")
+	return ai_reply
+
+def _post_deepseek(api_url, headers, payload, route_name, cancel_signal=None, deadline=None):
+	"""
+	真正发送 DeepSeek 请求并解析回复（失败时抛出异常）。
+
+	默认以流式读取上游回复（config.LLM_UPSTREAM_STREAMING），每个分片检查一次 cancel_signal，
+	取消后立即关闭连接，上游随之停止生成；非流式模式下只能在返回后丢弃结果。
+	HTTP 超时取 30 秒与 deadline 剩余预算中较小的一个。
+	"""
+	if getattr(config, 'LLM_UPSTREAM_STREAMING', True):
+		content, usage = _stream_deepseek(api_url, headers, payload, cancel_signal, deadline)
+	else:
+		response = requests.post(api_url, json=payload, headers=headers, timeout=stage_timeout(deadline, 30, 'DeepSeek'))
 		response.raise_for_status()  # 如果状态码不是200，抛出异常
-        
-		# 5. 解析响应
 		result = response.json()
-		ai_reply = result["choices"][0]["message"]["content"]
-        
-		print(f"[AI Service] 收到AI回复，长度: {len(ai_reply)}")
-		return ai_reply
-        
-	except requests.exceptions.RequestException as e:
-		# 处理网络或API错误
-		error_msg = f"网络请求失败: {e}"
-		print(f"[AI Service] 错误: {error_msg}")
-		return "抱歉，我现在有点连接不稳定，请稍后再和我聊天吧。"
-	except (KeyError, IndexError, json.JSONDecodeError) as e:
-		# 处理响应解析错误
-		error_msg = f"解析AI响应失败: {e}"
-		print(f"[AI Service] 错误: {error_msg}")
-		return "我好像有点没理解清楚，能换个说法再说一次吗？"
+		usage = result.get("usage") or {}
+		content = result["choices"][0]["message"]["content"]
+		if cancel_signal is not None and cancel_signal.is_set():
+			get_cancellation_stats().record_abandoned()
+    
+	# 5. 记录 usage（其中带有前缀缓存命中的 token 数）
+	get_prompt_cache_stats().record_provider_usage(
+		'deepseek', usage.get("prompt_tokens", 0), usage.get("prompt_cache_hit_tokens", 0)
+	)
+	get_route_stats().record_usage(
+		route_name, 'deepseek', payload["model"], usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+		max_tokens=payload.get("max_tokens")
+	)
+	return content
+
+def _stream_deepseek(api_url, headers, payload, cancel_signal=None, deadline=None):
+	"""
+	以 SSE 流式读取 DeepSeek 回复。
+
+	返回:
+		(回复文本, usage 字典)；被取消时关闭连接并抛出 RequestCancelled，超出截止时间时抛出 DeadlineExceeded
+	"""
+	stream_payload = dict(payload, stream=True, stream_options={"include_usage": True})
+	response = requests.post(api_url, json=stream_payload, headers=headers,
+							 timeout=stage_timeout(deadline, 30, 'DeepSeek'), stream=True)
+	try:
+		response.raise_for_status()
+		parts = []
+		usage = {}
+		received_chunk = False
+		for raw_line in response.iter_lines():
+			if cancel_signal is not None and cancel_signal.is_set():
+				get_cancellation_stats().record_aborted()
+				raise RequestCancelled("DeepSeek 生成已取消")
+			if deadline is not None:
+				deadline.check('DeepSeek')
+			line = raw_line.decode('utf-8').strip() if raw_line else ''
+			if not line.startswith('data:'):
+				continue
+			data = line[5:].strip()
+			if data == '[DONE]':
+				break
+			chunk = json.loads(data)
+			received_chunk = True
+			if chunk.get("usage"):
+				usage = chunk["usage"]
+			for choice in chunk.get("choices") or []:
+				parts.append((choice.get("delta") or {}).get("content") or '')
+	finally:
+		response.close()
+	if not received_chunk:
+		raise KeyError("DeepSeek 流式响应中没有数据")
+	return ''.join(parts), usage
+
+def get_ai_service_stats():
+	"""
+	获取AI服务的运行统计（用于 /api/llm/status 监控接口）。
+	"""
+	return {
+		'provider': config.AI_PROVIDER.lower(),
+		'router': get_provider_router().get_stats(),
+		'coalescing': get_request_coalescer().get_stats(),
+		'circuit_breakers': get_breaker_states(),
+		'gateways': get_gateway_stats(),
+		'prompt_cache': get_prompt_cache_stats().get_stats(),
+		'model_routes': get_route_stats().get_stats(),
+		'cancellation': get_cancellation_stats().get_stats(),
+		'deadlines': get_deadline_stats().get_stats()
+	}
 
 # 测试函数 - 可以直接运行这个文件进行测试
 if __name__ == "__main__":
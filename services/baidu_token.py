@@ -0,0 +1,252 @@
+# services/baidu_token.py - 百度 Access Token 管理
+"""
+百度 Access Token 管理模块：请求线程不再同步获取 Token
+
+- 后台线程在 Token 过期前主动刷新（默认提前 1 天），刷新期间旧 Token 照常使用
+- 只有后台线程会请求认证接口，同一时刻最多一次刷新（single-flight），并发请求不会同时刷新
+- Token 持久化到本地文件，重启后直接复用；刷新前先重读文件，多个进程共用同一个文件时可复用彼此刚获取的 Token
+- 请求线程拿不到 Token（冷启动且文件中没有）时立即返回 TokenUnavailable，不等待网络
+- 接口返回 Token 无效/过期（error_code 110/111）时调用 invalidate()，由后台线程立即重新获取
+- 刷新失败按指数退避重试
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+
+# 默认的 Token 持久化文件
+DEFAULT_TOKEN_STORE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                        'data', 'baidu_token.json')
+# 百度接口表示 Token 无效 / 过期的错误码
+INVALID_TOKEN_ERROR_CODES = (110, 111)
+
+
+class TokenUnavailable(Exception):
+    """当前没有可用的 Token（后台正在获取）"""
+
+
+class BaiduTokenManager:
+    """百度 Access Token 管理器（线程安全）"""
+
+    def __init__(self, api_key: str, secret_key: str, base_url: str = 'https://aip.baidubce.com',
+                 store_path: Optional[str] = None, refresh_margin: float = 86400,
+                 retry_interval: float = 5, max_retry_interval: float = 600, fetch_timeout: float = 10):
+        """
+        参数:
+            api_key / secret_key: 百度应用的 API Key 和 Secret Key
+            base_url: 百度开放平台地址
+            store_path: Token 持久化文件，为 None 时使用默认路径，为空字符串时不持久化
+            refresh_margin: 提前多少秒刷新（不超过 Token 有效期的一半）
+            retry_interval / max_retry_interval: 刷新失败后的重试间隔（指数退避）及其上限（秒）
+            fetch_timeout: 请求认证接口的超时（秒）
+        """
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.base_url = base_url.rstrip('/')
+        self.store_path = DEFAULT_TOKEN_STORE_PATH if store_path is None else store_path
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.fetch_timeout = fetch_timeout
+        # 持久化文件里用来区分不同应用 / 环境的指纹（不保存 Key 本身）
+        self.fingerprint = hashlib.sha256(f"{self.base_url}|{api_key}".encode('utf-8')).hexdigest()[:16]
+
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._token: Optional[str] = None
+        self._invalid_token: Optional[str] = None  # 最近一次被接口判定无效的 Token（不再从文件加载）
+        self._expires_at = 0.0       # Token 失效时间（时间戳）
+        self._refresh_at = 0.0       # 计划刷新时间（时间戳）
+        self._next_retry_at = 0.0    # 刷新失败后下一次重试的时间
+        self._consecutive_failures = 0
+        self._attempts = 0
+        self.last_error: Optional[str] = None
+
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.store_hits = 0
+        self.invalidations = 0
+        self.unavailable = 0
+        self._fetch_seconds = 0.0
+
+        if self.store_path:
+            with self._cond:
+                self._load_store()
+
+    # ---------- 请求线程使用的接口 ----------
+
+    def get_token(self, wait: float = 0.0) -> str:
+        """
+        获取当前有效的 Token（不请求网络）
+
+        参数:
+            wait: 没有可用 Token 时最多等待后台获取的秒数（默认不等待，后台标注等非请求路径可以等待）
+
+        返回:
+            Access Token；没有可用 Token 时抛出 TokenUnavailable
+        """
+        self.start()
+        deadline = time.monotonic() + wait
+        with self._cond:
+            attempts = self._attempts
+            while not self._usable():
+                remaining = deadline - time.monotonic()
+                # 等到至少一次刷新结束；仍然失败就不再继续等
+                if remaining <= 0 or self._attempts > attempts:
+                    self.unavailable += 1
+                    raise TokenUnavailable(f"百度 Token 暂不可用：{self.last_error or '后台正在获取'}")
+                self._cond.wait(remaining)
+            return self._token
+
+    def invalidate(self, token: str) -> None:
+        """接口返回 Token 无效时调用：丢弃该 Token 并让后台线程立即重新获取（同一个 Token 只处理一次）"""
+        with self._cond:
+            if token != self._token:
+                return
+            self.invalidations += 1
+            self._invalid_token = token
+            self._token = None
+            self._expires_at = self._refresh_at = self._next_retry_at = 0.0
+            self._cond.notify_all()
+        print("[Baidu Token] Token 已失效，后台重新获取")
+
+    def start(self) -> None:
+        """启动后台刷新线程（重复调用无副作用）"""
+        if self._thread is None:
+            with self._cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._refresh_loop, name='baidu-token-refresher',
+                                                    daemon=True)
+                    self._thread.start()
+
+    # ---------- 后台刷新 ----------
+
+    def _usable(self) -> bool:
+        return self._token is not None and time.time() < self._expires_at
+
+    def _refresh_loop(self) -> None:
+        while True:
+            with self._cond:
+                now = time.time()
+                due = max(self._refresh_at, self._next_retry_at) if self._token else self._next_retry_at
+                if now < due:
+                    # 没到刷新时间；invalidate() 会提前唤醒
+                    self._cond.wait(min(due - now, 3600))
+                    continue
+            self._refresh()
+
+    def _refresh(self) -> None:
+        """执行一次刷新（只在后台线程中调用，因此同一时刻最多一次）"""
+        with self._cond:
+            # 其他进程可能刚刷新过，先看持久化文件
+            if self.store_path and self._load_store() and time.time() < self._refresh_at:
+                self._attempts += 1
+                self._cond.notify_all()
+                return
+
+        started = time.monotonic()
+        try:
+            token, expires_in = self._fetch()
+        except Exception as e:
+            with self._cond:
+                self._attempts += 1
+                self.refresh_failures += 1
+                self._consecutive_failures += 1
+                self.last_error = str(e)
+                delay = min(self.retry_interval * 2 ** (self._consecutive_failures - 1), self.max_retry_interval)
+                self._next_retry_at = time.time() + delay
+                self._cond.notify_all()
+            print(f"[Baidu Token] 刷新失败（{delay:.0f} 秒后重试）: {e}")
+            return
+
+        now = time.time()
+        with self._cond:
+            self._attempts += 1
+            self.refreshes += 1
+            self._consecutive_failures = 0
+            self._fetch_seconds += time.monotonic() - started
+            self.last_error = None
+            self._token = token
+            self._expires_at = now + expires_in
+            self._refresh_at = self._expires_at - min(self.refresh_margin, expires_in / 2)
+            self._next_retry_at = 0.0
+            self._cond.notify_all()
+            if self.store_path:
+                self._save_store()
+        print(f"[Baidu Token] 已刷新，有效期 {expires_in / 3600:.1f} 小时")
+
+    def _fetch(self):
+        """请求百度认证接口，返回 (token, 有效期秒数)"""
+        response = requests.get(
+            f"{self.base_url}/oauth/2.0/token",
+            params={'grant_type': 'client_credentials', 'client_id': self.api_key, 'client_secret': self.secret_key},
+            timeout=self.fetch_timeout,
+        )
+        response.raise_for_status()
+        result = response.json()
+        if 'access_token' not in result:
+            raise Exception(f"获取Token失败：{result}")
+        return result['access_token'], float(result.get('expires_in', 0))
+
+    # ---------- 持久化（调用方持有 self._cond） ----------
+
+    def _load_store(self) -> bool:
+        """读取持久化文件，其中的 Token 比当前的更新时采用；返回是否采用"""
+        try:
+            with open(self.store_path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            if record.get('fingerprint') != self.fingerprint or record.get('access_token') == self._invalid_token:
+                return False
+            expires_at = float(record['expires_at'])
+            if expires_at <= max(time.time(), self._expires_at):
+                return False
+            self._token = record['access_token']
+            self._expires_at = expires_at
+            self._refresh_at = float(record['refresh_at'])
+            self.store_hits += 1
+            return True
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[Baidu Token] 读取 {self.store_path} 失败: {e}")
+            return False
+
+    def _save_store(self) -> None:
+        record = {
+            'fingerprint': self.fingerprint,
+            'access_token': self._token,
+            'expires_at': self._expires_at,
+            'refresh_at': self._refresh_at,
+        }
+        tmp_path = f"{self.store_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.store_path)), exist_ok=True)
+            # Token 等同于凭据，只允许当前用户读写；先写临时文件再替换，避免其他进程读到半个文件
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(record, f)
+            os.replace(tmp_path, self.store_path)
+        except OSError as e:
+            print(f"[Baidu Token] 写入 {self.store_path} 失败: {e}")
+
+    def get_stats(self) -> Dict:
+        with self._cond:
+            now = time.time()
+            usable = self._usable()
+            return {
+                'has_token': usable,
+                'expires_in': round(self._expires_at - now) if usable else None,
+                'refresh_in': round(max(0.0, self._refresh_at - now)) if usable else None,
+                'refreshes': self.refreshes,
+                'refresh_failures': self.refresh_failures,
+                'avg_fetch_seconds': round(self._fetch_seconds / self.refreshes, 4) if self.refreshes else None,
+                'store_hits': self.store_hits,
+                'invalidations': self.invalidations,
+                'unavailable': self.unavailable,
+                'last_error': self.last_error,
+                'persistent': bool(self.store_path),
+            }
@@ -0,0 +1,169 @@
+# services/cancellation.py - 客户端断开时取消上游生成
+"""
+请求取消模块：用户关闭页面或连接中断后，不再等待上游生成完整回复，也不再写入聊天记录
+
+- ClientDisconnectWatcher：在请求处理期间轮询客户端连接，断开时设置取消事件
+- SharedCancellation：多个请求共享同一次上游调用（请求合并、幂等键）时，
+  只有全部参与者都取消后才真正取消
+- 上游以流式方式读取回复，每收到一个分片检查一次取消信号，取消后立即关闭连接，
+  上游随之停止生成；非流式调用无法中途打断，只能丢弃结果
+- 统计被取消的请求数和避免的无效生成数
+"""
+import select
+import socket
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class RequestCancelled(Exception):
+    """请求已被取消（客户端断开等）"""
+
+
+def raise_if_cancelled(cancel_event, what: str = '请求') -> None:
+    """cancel_event 已设置时抛出 RequestCancelled（cancel_event 可以为 None）"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise RequestCancelled(f"{what}已取消")
+
+
+class SharedCancellation:
+    """
+    共享调用的取消信号（与 threading.Event 一样提供 is_set()）
+
+    每个参与者登记自己的取消事件；没有取消事件的参与者（如定时任务）不可取消，
+    只要有一个这样的参与者，共享调用就不会被取消。
+    grace 大于 0 时，全部参与者都取消后再等 grace 秒才视为取消，期间有新的参与者加入（如客户端超时后用
+    同一个幂等键重发）则继续执行。
+    """
+
+    def __init__(self, grace: float = 0.0):
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._events = []
+        self._uncancellable = False
+        self._all_cancelled_at: Optional[float] = None
+
+    def add(self, cancel_event) -> None:
+        with self._lock:
+            if cancel_event is None:
+                self._uncancellable = True
+            else:
+                self._events.append(cancel_event)
+            self._all_cancelled_at = None
+
+    def is_set(self) -> bool:
+        with self._lock:
+            if self._uncancellable or not self._events:
+                return False
+            if not all(event.is_set() for event in self._events):
+                self._all_cancelled_at = None
+                return False
+            if self.grace <= 0:
+                return True
+            # 从第一次发现全部取消时开始计时
+            now = time.monotonic()
+            if self._all_cancelled_at is None:
+                self._all_cancelled_at = now
+            return now - self._all_cancelled_at >= self.grace
+
+
+def _client_socket(environ: Dict[str, Any]):
+    """从 WSGI environ 中取出客户端连接（Werkzeug 开发服务器 / gunicorn）"""
+    for key in ('werkzeug.socket', 'gunicorn.socket'):
+        sock = environ.get(key)
+        if sock is not None:
+            return sock
+    return None
+
+
+def is_client_disconnected(sock) -> bool:
+    """客户端是否已关闭连接（socket 可读但读不到数据即为对端关闭）"""
+    try:
+        readable, _, errored = select.select([sock], [], [sock], 0)
+        if errored:
+            return True
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+
+class ClientDisconnectWatcher:
+    """
+    请求处理期间的客户端断开检测（上下文管理器）
+
+    用法:
+        with ClientDisconnectWatcher(request.environ) as cancel_event:
+            ...  # 把 cancel_event 传给下游，断开后 cancel_event.is_set() 为 True
+    """
+
+    def __init__(self, environ: Dict[str, Any], interval: float = 0.5):
+        self.interval = interval
+        self.event = threading.Event()
+        self._sock = _client_socket(environ)
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _watch(self) -> None:
+        while not self._done.wait(self.interval):
+            if is_client_disconnected(self._sock):
+                self.event.set()
+                get_cancellation_stats().record_disconnect()
+                print("[Cancellation] 客户端已断开，取消本次请求")
+                return
+
+    def __enter__(self) -> threading.Event:
+        if self._sock is not None:
+            self._thread = threading.Thread(target=self._watch, name='disconnect-watcher', daemon=True)
+            self._thread.start()
+        return self.event
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._done.set()
+
+
+class CancellationStats:
+    """取消相关统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.client_disconnects = 0
+        self.aborted_generations = 0
+        self.abandoned_generations = 0
+        self.skipped_persists = 0
+
+    def record_disconnect(self) -> None:
+        with self._lock:
+            self.client_disconnects += 1
+
+    def record_aborted(self) -> None:
+        """流式读取途中关闭了上游连接（避免了剩余部分的生成）"""
+        with self._lock:
+            self.aborted_generations += 1
+
+    def record_abandoned(self) -> None:
+        """非流式调用已完成但请求已取消，结果被丢弃（无法避免的无效生成）"""
+        with self._lock:
+            self.abandoned_generations += 1
+
+    def record_skipped_persist(self) -> None:
+        with self._lock:
+            self.skipped_persists += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'client_disconnects': self.client_disconnects,
+                'aborted_generations': self.aborted_generations,
+                'abandoned_generations': self.abandoned_generations,
+                'skipped_persists': self.skipped_persists,
+            }
+
+
+_stats_instance = CancellationStats()
+
+
+def get_cancellation_stats() -> CancellationStats:
+    """获取全局取消统计"""
+    return _stats_instance
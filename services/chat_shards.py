@@ -0,0 +1,56 @@
+# services/chat_shards.py - 聊天记录分片
+"""
+聊天记录分片：按 session_id 的稳定哈希把会话分散到多个 SQLite 文件，每个文件有自己的连接池和写锁
+
+- 分片号 = crc32(session_id) % 分片数（与进程、Python 版本无关；不能用内置 hash()，它每次启动都不同）
+- 分片 0 就是原来的 chat_history.db，分片 i 为 chat_history-i.db；分片数为 1 时与不分片完全相同
+- 同一会话的消息、摘要、归档都在同一个分片里，按会话的读写只访问一个文件，单个事务不跨文件
+- 修改分片数前先停服务，用 scripts/rebalance_chat_shards.py 把会话搬到新的分片，再改 CHAT_DB_SHARDS 启动
+"""
+import os
+import zlib
+from typing import Callable, List
+
+from services.sqlite_pool import PooledConnection, get_pool
+
+
+def shard_index(session_id: str, shard_count: int) -> int:
+    """会话所在的分片号（稳定哈希）"""
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32(session_id.encode('utf-8')) % shard_count
+
+
+def shard_paths(base_path: str, shard_count: int) -> List[str]:
+    """各分片的数据库文件路径：分片 0 为 base_path 本身，其余在文件名后加 -序号"""
+    root, ext = os.path.splitext(base_path)
+    return [base_path] + [f"{root}-{i}{ext}" for i in range(1, max(shard_count, 1))]
+
+
+class ChatShards:
+    """聊天记录分片路由：session_id -> 分片数据库连接"""
+
+    def __init__(self, base_path: str, shard_count: int = 1):
+        """
+        参数:
+            base_path: 分片 0 的数据库文件路径（原 chat_history.db）
+            shard_count: 分片数
+        """
+        if shard_count < 1:
+            raise ValueError(f"分片数必须大于 0: {shard_count}")
+        self.shard_count = shard_count
+        self.paths = shard_paths(base_path, shard_count)
+
+    def index(self, session_id: str) -> int:
+        return shard_index(session_id, self.shard_count)
+
+    def connect(self, session_id: str) -> PooledConnection:
+        """借出会话所在分片的连接（用完 close() 归还）"""
+        return get_pool(self.paths[self.index(session_id)]).connect()
+
+    def connect_shard(self, index: int) -> PooledConnection:
+        return get_pool(self.paths[index]).connect()
+
+    def connector(self, index: int) -> Callable[[], PooledConnection]:
+        """返回获取指定分片连接的函数（供异步写入队列等按分片工作的组件使用）"""
+        return lambda: self.connect_shard(index)
@@ -0,0 +1,195 @@
+# services/context_builder.py - 按 token 预算组装对话上下文
+"""
+上下文组装模块：按 token 预算打包系统提示词、C3KG 常识、会话摘要和历史对话
+
+- 估算中文文本的 token 数（不依赖分词器）
+- 系统提示词和用户当前消息必须保留，其余部分按预算从新到旧填充
+- 维护会话摘要：被裁剪掉的旧对话折叠进一段增量更新的摘要，长期记忆不再直接丢失
+"""
+import re
+from typing import Dict, List, Optional
+
+# 中日韩字符（含全角标点）大约 1 字 1 token；其余字符大约 4 个字符 1 token
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+# 每条消息在 chat 格式中的额外开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    估算文本的 token 数（偏保守，宁可多估）
+
+    参数:
+        text: 待估算文本
+
+    返回:
+        估算的 token 数
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
+
+
+def estimate_message_tokens(message: Dict[str, str]) -> int:
+    """估算单条 chat 消息的 token 数"""
+    return estimate_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """把文本截断到大约 max_tokens 个 token 以内（超出部分用省略号表示）"""
+    if max_tokens <= 0:
+        return ''
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    used = 0
+    for index, char in enumerate(text):
+        used += 1 if _CJK_PATTERN.match(char) else 0.25
+        if used > max_tokens - 1:
+            return text[:index] + '…'
+    return text
+
+
+def truncate_lines_to_tokens(text: str, max_tokens: int) -> str:
+    """按行截断多行文本（用于 C3KG 常识块，避免截断在一行中间）"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for line in text.split('\n'):
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return '\n'.join(kept)
+
+
+def _keep_latest_lines(text: str, max_tokens: int) -> str:
+    """保留多行文本中最新（靠后）的若干行（用于会话摘要，越新的内容越重要）"""
+    lines = text.split('\n')
+    while lines and estimate_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+def pack_context(system_prompt: str, user_message: str, history: Optional[List[Dict[str, str]]] = None,
+                 knowledge: str = '', summary: str = '', budget: int = 2000,
+                 knowledge_budget: int = 400, summary_budget: int = 300) -> Dict:
+    """
+    在 token 预算内组装上下文
+
+    参数:
+        system_prompt: 人格系统提示词（必须保留）
+        user_message: 用户当前消息（必须保留）
+        history: 历史对话（按时间升序）
+        knowledge: C3KG 常识文本
+        summary: 会话摘要（更早对话的折叠）
+        budget: 输入上下文总预算（token）
+        knowledge_budget: 常识部分的预算上限
+        summary_budget: 摘要部分的预算上限
+
+    返回:
+        {'knowledge': 截断后的常识, 'summary': 截断后的摘要, 'history': 选中的历史（升序）,
+         'tokens': 估算总 token 数, 'dropped_messages': 因预算丢弃的历史条数}
+    """
+    history = history or []
+    used = estimate_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+    used += estimate_tokens(user_message) + MESSAGE_OVERHEAD_TOKENS
+    remaining = max(0, budget - used)
+
+    # 最近一轮对话优先于常识和摘要，保证对话连贯
+    selected: List[Dict[str, str]] = []
+    index = len(history) - 1
+    reserved_recent = 0
+    while index >= 0 and len(selected) < 2:
+        cost = estimate_message_tokens(history[index])
+        if cost > remaining - reserved_recent:
+            break
+        selected.append(history[index])
+        reserved_recent += cost
+        index -= 1
+    remaining -= reserved_recent
+
+    knowledge = truncate_lines_to_tokens(knowledge, min(knowledge_budget, remaining)) if knowledge else ''
+    remaining -= estimate_tokens(knowledge)
+
+    summary = _keep_latest_lines(summary, min(summary_budget, remaining)) if summary else ''
+    remaining -= estimate_tokens(summary)
+
+    # 剩余预算从新到旧继续填充历史
+    while index >= 0:
+        cost = estimate_message_tokens(history[index])
+        if cost > remaining:
+            break
+        selected.append(history[index])
+        remaining -= cost
+        index -= 1
+
+    selected.reverse()
+    used += estimate_tokens(knowledge) + estimate_tokens(summary)
+    used += sum(estimate_message_tokens(m) for m in selected)
+    return {
+        'knowledge': knowledge,
+        'summary': summary,
+        'history': selected,
+        'tokens': used,
+        'dropped_messages': len(history) - len(selected),
+    }
+
+
+def fold_into_summary(summary: str, messages: List[Dict[str, str]], max_tokens: int = 300,
+                      snippet_chars: int = 60) -> str:
+    """
+    把即将被裁剪的旧消息增量折叠进会话摘要（抽取式，无需额外调用 LLM）
+
+    参数:
+        summary: 已有摘要
+        messages: 被裁剪的消息（按时间升序）
+        max_tokens: 摘要的 token 上限，超出时丢弃最早的条目
+        snippet_chars: 每条消息保留的最大字符数
+
+    返回:
+        更新后的摘要
+    """
+    lines = [line for line in (summary or '').split('\n') if line.strip()]
+    for message in messages:
+        content = ' '.join((message.get('content') or '').split())
+        if not content:
+            continue
+        if len(content) > snippet_chars:
+            content = content[:snippet_chars] + '…'
+        if message.get('role') == 'user':
+            lines.append(f"- 用户说：{content}")
+        elif message.get('role') == 'assistant':
+            lines.append(f"- 我回应：{content[:snippet_chars // 2]}")
+
+    while lines and estimate_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+def format_summary_for_prompt(summary: str) -> str:
+    """把会话摘要格式化为系统提示词片段"""
+    if not summary:
+        return ''
+    return f"【更早的对话摘要】\n{summary}\n\n以上是你们更早聊过的内容，请在合适的时候自然地延续这些话题。"
+
+
+def build_context(system_prompt: str, user_message: str, history: Optional[List[Dict[str, str]]] = None,
+                  knowledge: str = '', summary: str = '') -> Dict:
+    """
+    按 config 中的预算组装上下文（CONTEXT_TOKEN_BUDGET / CONTEXT_KNOWLEDGE_BUDGET / CONTEXT_SUMMARY_BUDGET）
+
+    参数与返回值同 pack_context
+    """
+    import config
+    return pack_context(
+        system_prompt, user_message, history,
+        knowledge=knowledge,
+        summary=summary,
+        budget=getattr(config, 'CONTEXT_TOKEN_BUDGET', 2000),
+        knowledge_budget=getattr(config, 'CONTEXT_KNOWLEDGE_BUDGET', 400),
+        summary_budget=getattr(config, 'CONTEXT_SUMMARY_BUDGET', 300),
+    )
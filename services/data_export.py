@@ -0,0 +1,464 @@
+# services/data_export.py - 聊天记录 / 推送偏好的 NDJSON 导出导入
+"""
+数据导出导入模块：chat_history.db（含分片和归档）与 companion.db 的 user_schedule 以 NDJSON 流式导出、导入
+
+- 导出逐个会话、逐块读取（会话 ID 与用户 ID 都按主键 keyset 翻页，消息经 iter_full_history 逐块解压），
+  内存占用与数据总量无关；可选 gzip 压缩，可按会话数切分成多个文件
+- 每行一条记录，按 type 区分：
+    meta     文件头：{"type": "meta", "format": 1, "kind": "chat" | "schedules", "exported_at": ...}
+    session  会话开始：{"type": "session", "session_id": ...}，之后是该会话的全部记录
+    message  {"type": "message", "session_id", "id", "role", "content", "created_at"}（按时间顺序）
+    summary  {"type": "summary", "session_id", "summary", "folded_messages", "updated_at"}，
+             folded_messages 为已折叠进摘要的消息条数（导入后消息 id 会变化，按条数还原摘要位置）
+    schedule user_schedule 的一行
+- 导入用 executemany 批量写入，攒够 batch_rows 行后在每个目标库各提交一次大事务；
+  每个目标库的 import_checkpoints 表记录已导入到的行号，与数据在同一事务中提交，中断后重新导入同一文件会跳过已提交的行；
+  检查点按文件标识（文件名 + meta 行的 exported_at + 文件大小）记录，同名的不同导出文件互不影响，文件导入完成后删除
+  批次只在会话边界提交，不会出现半个会话
+- 与服务裁剪历史一样，每个导入的会话在 messages 表只保留最新的 max_items 条，更早的消息在同一事务中
+  压缩归档到 message_archive（仍可检索）；会话摘要的位置指向导入后的新 id
+- 目标库中已存在的会话按 on_conflict 处理：skip 跳过（默认）、replace 先删除再导入；推送偏好按 user_id 同样处理
+"""
+import glob
+import gzip
+import json
+import os
+import time
+import zlib
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from services.chat_shards import shard_index
+from services.message_archive import DEFAULT_CHUNK_MESSAGES, archive_messages, iter_full_history
+from services.search_index import delete_session_index, index_new_messages
+
+# 导出格式版本（导入时检查）
+FORMAT_VERSION = 1
+# 会话 ID / 用户 ID keyset 翻页的页大小
+KEYSET_PAGE_SIZE = 500
+# 导入时默认每批（每个事务）的行数
+DEFAULT_BATCH_ROWS = 5000
+# 导入后每个会话在 messages 表保留的消息条数（与 /api/chat 裁剪后保留的条数一致）
+DEFAULT_KEEP_MESSAGES = 10
+# HTTP 流式导出时每次输出的字节数
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# 会话级数据所在的表
+SESSION_TABLES = ('messages', 'session_summaries', 'message_archive')
+
+CHECKPOINT_TABLE = """
+CREATE TABLE IF NOT EXISTS import_checkpoints (
+    source TEXT PRIMARY KEY,
+    line INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def _meta(kind: str) -> Dict:
+    return {'type': 'meta', 'format': FORMAT_VERSION, 'kind': kind, 'exported_at': datetime.now().isoformat()}
+
+
+# ---------- 导出 ----------
+
+def iter_session_ids(connect: Callable, page_size: int = KEYSET_PAGE_SIZE) -> Iterator[str]:
+    """按 session_id 升序列出数据库中的全部会话（消息、摘要、归档任一表中有数据即算），每页单独获取连接"""
+    after = ''
+    while True:
+        conn = connect()
+        try:
+            pages = [[r[0] for r in conn.execute(
+                f'SELECT DISTINCT session_id FROM {table} WHERE session_id > ? ORDER BY session_id LIMIT ?',
+                (after, page_size)
+            )] for table in SESSION_TABLES]
+        finally:
+            conn.close()
+        # 取满一页的表只能保证到本页最后一个 ID，超出部分留到下一页
+        full = [page[-1] for page in pages if len(page) == page_size]
+        bound = min(full) if full else None
+        ids = sorted({sid for page in pages for sid in page if bound is None or sid <= bound})
+        if not ids:
+            return
+        yield from ids
+        after = ids[-1]
+
+
+def _read_summary(connect: Callable, session_id: str) -> Optional[Dict]:
+    conn = connect()
+    try:
+        row = conn.execute(
+            'SELECT summary, last_message_id, updated_at FROM session_summaries WHERE session_id = ?',
+            (session_id,)
+        ).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def iter_chat_records(connects: Sequence[Callable], session_ids: Optional[Iterable[str]] = None,
+                      iter_messages: Optional[Callable[[str], Iterator[Dict]]] = None) -> Iterator[Dict]:
+    """
+    导出聊天记录（不含 meta 行）
+
+    参数:
+        connects: 各分片获取连接的函数（按分片号排列）
+        session_ids: 只导出这些会话；为空时导出全部会话（逐个分片）
+        iter_messages: 读取会话全部消息的函数；为空时直接读数据库（iter_full_history），
+            在线导出时传入 app.iter_session_messages（会先等待异步写入队列）
+    """
+    def shard_connect(session_id):
+        return connects[shard_index(session_id, len(connects))]
+
+    if session_ids is None:
+        session_ids = (sid for connect in connects for sid in iter_session_ids(connect))
+    for session_id in session_ids:
+        connect = shard_connect(session_id)
+        yield {'type': 'session', 'session_id': session_id}
+        summary = _read_summary(connect, session_id)
+        folded = 0
+        messages = iter_messages(session_id) if iter_messages else iter_full_history(connect, session_id)
+        for message in messages:
+            if summary and message['id'] <= summary['last_message_id']:
+                folded += 1
+            yield {'type': 'message', 'session_id': session_id, **message}
+        if summary:
+            yield {'type': 'summary', 'session_id': session_id, 'summary': summary['summary'],
+                   'folded_messages': folded, 'updated_at': summary['updated_at']}
+
+
+def iter_schedule_records(connect: Callable, page_size: int = KEYSET_PAGE_SIZE) -> Iterator[Dict]:
+    """导出 user_schedule（按 user_id keyset 翻页）"""
+    after = ''
+    while True:
+        conn = connect()
+        try:
+            rows = [dict(r) for r in conn.execute(
+                'SELECT * FROM user_schedule WHERE user_id > ? ORDER BY user_id LIMIT ?', (after, page_size)
+            )]
+        finally:
+            conn.close()
+        for row in rows:
+            yield {'type': 'schedule', **row}
+        if len(rows) < page_size:
+            return
+        after = rows[-1]['user_id']
+
+
+def _encode(record: Dict) -> bytes:
+    return (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def iter_ndjson_bytes(kind: str, records: Iterable[Dict], compress: bool = False) -> Iterator[bytes]:
+    """把记录编码成 NDJSON 字节流（HTTP 流式响应用），每次输出约 STREAM_CHUNK_BYTES；compress 时为 gzip 格式"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = bytearray()
+    for record in _with_meta(kind, records):
+        buffer += _encode(record)
+        if len(buffer) >= STREAM_CHUNK_BYTES:
+            data = compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+            buffer.clear()
+            if data:
+                yield data
+    tail = compressor.compress(bytes(buffer)) + compressor.flush() if compressor else bytes(buffer)
+    if tail:
+        yield tail
+
+
+def _with_meta(kind: str, records: Iterable[Dict]) -> Iterator[Dict]:
+    yield _meta(kind)
+    yield from records
+
+
+def _open_output(path: str):
+    return gzip.open(path, 'wb', compresslevel=6) if path.endswith('.gz') else open(path, 'wb')
+
+
+def write_ndjson_files(kind: str, records: Iterable[Dict], out_dir: str, compress: bool = True,
+                       sessions_per_file: int = 0) -> Dict:
+    """
+    把记录写入 out_dir 下的 NDJSON 文件
+
+    参数:
+        kind: 'chat' 或 'schedules'（也是文件名前缀）
+        sessions_per_file: 每个文件最多的会话数，0 为不切分（只对聊天记录有效）
+
+    返回:
+        {'files': 文件列表, 'rows': 记录行数（不含 meta）, 'sessions': 会话数, 'seconds': 耗时, 'rows_per_second'}
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    suffix = '.ndjson.gz' if compress else '.ndjson'
+    started = time.perf_counter()
+    files: List[str] = []
+    rows = sessions = file_sessions = 0
+    out = None
+    try:
+        for record in records:
+            if out is None or (record['type'] == 'session' and sessions_per_file and file_sessions >= sessions_per_file):
+                if out is not None:
+                    out.close()
+                name = f"{kind}-{len(files):05d}{suffix}" if sessions_per_file else f"{kind}{suffix}"
+                files.append(os.path.join(out_dir, name))
+                out = _open_output(files[-1])
+                out.write(_encode(_meta(kind)))
+                file_sessions = 0
+            if record['type'] == 'session':
+                sessions += 1
+                file_sessions += 1
+            out.write(_encode(record))
+            rows += 1
+        if out is None:
+            # 没有数据也输出只有 meta 行的文件，导入时可以区分“空”与“未导出”
+            files.append(os.path.join(out_dir, f"{kind}{suffix}"))
+            out = _open_output(files[-1])
+            out.write(_encode(_meta(kind)))
+    finally:
+        if out is not None:
+            out.close()
+    seconds = time.perf_counter() - started
+    return {'files': files, 'rows': rows, 'sessions': sessions, 'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds else 0.0}
+
+
+# ---------- 导入 ----------
+
+def expand_inputs(paths: Iterable[str]) -> List[str]:
+    """文件按原顺序；目录展开为其中的 *.ndjson / *.ndjson.gz（按文件名排序）"""
+    files: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*.ndjson')) + glob.glob(os.path.join(path, '*.ndjson.gz')))
+        else:
+            files.append(path)
+    return files
+
+
+def iter_ndjson(path: str) -> Iterator[Tuple[int, Dict]]:
+    """逐行读取 NDJSON 文件（.gz 自动解压），返回 (行号, 记录)；第一行必须是 meta"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if line_no == 1:
+                if record.get('type') != 'meta' or record.get('format') != FORMAT_VERSION:
+                    raise ValueError(f"{path} 不是格式版本 {FORMAT_VERSION} 的导出文件")
+            yield line_no, record
+
+
+def _source_key(path: str) -> str:
+    """导入检查点的键：文件名、导出时间和文件大小，同名的不同导出文件不会共用检查点"""
+    _, meta = next(iter_ndjson(path))
+    return f"{os.path.basename(path)}@{meta.get('exported_at')}#{os.path.getsize(path)}"
+
+
+class _Target:
+    """导入的一个目标库：一个连接、一个未提交的批次和它的检查点"""
+
+    def __init__(self, conn, source: str):
+        self.conn = conn
+        self.source = source
+        conn.execute(CHECKPOINT_TABLE)
+        conn.commit()
+        row = conn.execute('SELECT line FROM import_checkpoints WHERE source = ?', (source,)).fetchone()
+        self.checkpoint = row[0] if row else 0
+        self.messages: List[tuple] = []
+        self.summaries: List[Dict] = []
+        self.schedules: List[Dict] = []
+
+    def pending(self) -> int:
+        return len(self.messages) + len(self.summaries) + len(self.schedules)
+
+
+class NdjsonImporter:
+    """把导出文件导入到聊天记录分片和 companion.db（见模块说明）"""
+
+    def __init__(self, chat_connects: Sequence[Callable], schedule_connect: Optional[Callable] = None,
+                 batch_rows: int = DEFAULT_BATCH_ROWS, on_conflict: str = 'skip',
+                 max_items: Optional[int] = DEFAULT_KEEP_MESSAGES, archive_chunk: int = DEFAULT_CHUNK_MESSAGES):
+        """
+        参数:
+            chat_connects: 各聊天记录分片获取连接的函数（按分片号排列，分片数与目标服务的 CHAT_DB_SHARDS 一致）
+            schedule_connect: companion.db 获取连接的函数（不导入推送偏好时可为空）
+            batch_rows: 每批（每个事务）的行数
+            on_conflict: 目标库已有该会话 / 用户时 'skip' 跳过，'replace' 覆盖
+            max_items: 每个会话在 messages 表保留的最新消息条数，更早的归档；为空时全部留在 messages 表
+            archive_chunk: 归档时每块最多的消息条数
+        """
+        if on_conflict not in ('skip', 'replace'):
+            raise ValueError(f"on_conflict 只能是 skip 或 replace: {on_conflict}")
+        self.chat_connects = chat_connects
+        self.schedule_connect = schedule_connect
+        self.batch_rows = batch_rows
+        self.on_conflict = on_conflict
+        self.max_items = max_items
+        self.archive_chunk = archive_chunk
+        self.stats = {'rows': 0, 'sessions': 0, 'messages': 0, 'archived': 0, 'summaries': 0, 'schedules': 0,
+                      'skipped_sessions': 0, 'skipped_schedules': 0, 'resumed_rows': 0, 'batches': 0}
+
+    def import_files(self, paths: Iterable[str]) -> Dict:
+        """按顺序导入文件，返回统计（含耗时和每秒行数）"""
+        started = time.perf_counter()
+        for path in expand_inputs(paths):
+            self.import_file(path)
+        seconds = time.perf_counter() - started
+        return {**self.stats, 'seconds': seconds, 'rows_per_second': self.stats['rows'] / seconds if seconds else 0.0}
+
+    def import_file(self, path: str) -> None:
+        source = _source_key(path)
+        targets: List[_Target] = []
+        try:
+            chat = [_Target(connect(), source) for connect in self.chat_connects]
+            targets += chat
+            schedule = _Target(self.schedule_connect(), source) if self.schedule_connect else None
+            if schedule is not None:
+                targets.append(schedule)
+            self._import(path, chat, schedule, targets)
+            # 整个文件已导入：删除检查点（重新导入同一文件时按 on_conflict 处理已有的会话）
+            for target in targets:
+                target.conn.execute('DELETE FROM import_checkpoints WHERE source = ?', (source,))
+                target.conn.commit()
+        except Exception:
+            for target in targets:
+                target.conn.rollback()
+            raise
+        finally:
+            for target in targets:
+                target.conn.close()
+
+    def _import(self, path: str, chat: List[_Target], schedule: Optional[_Target], targets: List[_Target]) -> None:
+        current: Optional[_Target] = None  # 当前会话的目标分片（跳过的会话为 None）
+        line_no = 0
+        for line_no, record in iter_ndjson(path):
+            kind = record['type']
+            if kind in ('session', 'schedule') and sum(t.pending() for t in targets) >= self.batch_rows:
+                # 只在会话边界提交，检查点指向下一个会话之前的行
+                self._flush(targets, line_no - 1)
+            if kind == 'meta':
+                continue
+            if kind == 'schedule':
+                if schedule is None:
+                    raise ValueError(f"{path} 包含推送偏好，但没有指定 companion.db")
+                if line_no <= schedule.checkpoint:
+                    self.stats['resumed_rows'] += 1
+                    continue
+                record.pop('type')
+                schedule.schedules.append(record)
+                self.stats['rows'] += 1
+                continue
+
+            target = chat[shard_index(record['session_id'], len(chat))]
+            if line_no <= target.checkpoint:
+                self.stats['resumed_rows'] += 1
+                current = None
+                continue
+            if kind == 'session':
+                current = self._begin_session(target, record['session_id'])
+            elif current is None:
+                continue
+            elif kind == 'message':
+                current.messages.append((record['session_id'], record['role'], record['content'],
+                                         record.get('created_at')))
+                self.stats['messages'] += 1
+            elif kind == 'summary':
+                current.summaries.append(record)
+                self.stats['summaries'] += 1
+            else:
+                raise ValueError(f"{path}:{line_no} 未知的记录类型: {kind}")
+            self.stats['rows'] += 1
+        self._flush(targets, line_no)
+
+    def _begin_session(self, target: _Target, session_id: str) -> Optional[_Target]:
+        conn = target.conn
+        exists = any(
+            conn.execute(f'SELECT 1 FROM {table} WHERE session_id = ? LIMIT 1', (session_id,)).fetchone()
+            for table in SESSION_TABLES
+        )
+        if exists and self.on_conflict == 'skip':
+            self.stats['skipped_sessions'] += 1
+            return None
+        if exists:
+            delete_session_index(conn, session_id)
+            for table in SESSION_TABLES:
+                conn.execute(f'DELETE FROM {table} WHERE session_id = ?', (session_id,))
+        self.stats['sessions'] += 1
+        return target
+
+    def _write_chat(self, target: _Target) -> None:
+        conn = target.conn
+        # 批次只在会话边界提交，每个会话的消息都在同一批次中
+        session_ids = list(dict.fromkeys(m[0] for m in target.messages))
+        if target.messages:
+            conn.executemany(
+                'INSERT INTO messages (session_id, role, content, created_at) '
+                'VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+                target.messages
+            )
+            target.messages = []
+            # 导入的消息同步加入全文检索索引（同一事务，归档之前）
+            index_new_messages(conn)
+        for record in target.summaries:
+            # 导入后消息 id 重新分配：按已折叠的条数找到对应的新 id
+            folded = record.get('folded_messages') or 0
+            row = conn.execute(
+                'SELECT id FROM messages WHERE session_id = ? ORDER BY id ASC LIMIT 1 OFFSET ?',
+                (record['session_id'], folded - 1)
+            ).fetchone() if folded else None
+            conn.execute(
+                'INSERT OR REPLACE INTO session_summaries (session_id, summary, last_message_id, updated_at) '
+                'VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+                (record['session_id'], record['summary'], row[0] if row else 0, record.get('updated_at'))
+            )
+        target.summaries = []
+        if self.max_items:
+            for session_id in session_ids:
+                self.stats['archived'] += self._archive_older(conn, session_id)
+
+    def _archive_older(self, conn, session_id: str) -> int:
+        """把会话最新 max_items 条之前的消息移到归档（摘要已按新 id 写入），返回归档的条数"""
+        row = conn.execute(
+            'SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?',
+            (session_id, self.max_items)
+        ).fetchone()
+        if row is None:
+            return 0
+        older = conn.execute(
+            'SELECT id, role, content, created_at FROM messages WHERE session_id = ? AND id <= ? ORDER BY id ASC',
+            (session_id, row['id'])
+        ).fetchall()
+        archive_messages(conn, session_id, older, chunk_size=self.archive_chunk)
+        conn.execute('DELETE FROM messages WHERE session_id = ? AND id <= ?', (session_id, row['id']))
+        return len(older)
+
+    def _write_schedules(self, target: _Target) -> None:
+        conn = target.conn
+        verb = 'INSERT OR REPLACE' if self.on_conflict == 'replace' else 'INSERT OR IGNORE'
+        # 按列集合分组，每组一次 executemany
+        groups: Dict[tuple, List[tuple]] = {}
+        for record in target.schedules:
+            groups.setdefault(tuple(record), []).append(tuple(record.values()))
+        for columns, rows in groups.items():
+            before = conn.total_changes
+            conn.executemany(
+                f"{verb} INTO user_schedule ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+            )
+            written = conn.total_changes - before
+            self.stats['schedules'] += written
+            self.stats['skipped_schedules'] += len(rows) - written
+        target.schedules = []
+
+    def _flush(self, targets: List[_Target], line_no: int) -> None:
+        """写入各目标库缓冲的行并连同检查点一起提交"""
+        for target in targets:
+            if line_no <= target.checkpoint:
+                continue
+            if target.schedules:
+                self._write_schedules(target)
+            self._write_chat(target)
+            target.conn.execute(
+                'INSERT OR REPLACE INTO import_checkpoints (source, line, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
+                (target.source, line_no)
+            )
+            target.conn.commit()
+            target.checkpoint = line_no
+        self.stats['batches'] += 1
@@ -0,0 +1,104 @@
+# services/deadline.py - 请求级截止时间
+"""
+请求截止时间模块：一次聊天请求只有一个总预算，各阶段只使用剩余的预算
+
+- 聊天接口创建 Deadline，依次传给情感分析、C3KG 检索和 LLM 调用
+- 每个阶段的超时 = min(该阶段原有的超时上限, 剩余预算)，不再各自独立计时
+- 可选阶段（情感分析、C3KG 检索）在剩余预算不足时直接跳过，把预算留给 LLM
+- 统计各阶段被跳过和超出截止时间的次数
+"""
+import threading
+import time
+from typing import Dict, Optional
+
+
+class DeadlineExceeded(Exception):
+    """请求的总预算已经用完"""
+
+
+class Deadline:
+    """一次请求的截止时间（基于 time.monotonic()）"""
+
+    def __init__(self, budget: float, expires_at: Optional[float] = None):
+        """
+        参数:
+            budget: 总预算（秒）
+            expires_at: 直接指定到期时间（child() 内部使用）
+        """
+        self.budget = budget
+        self.expires_at = expires_at if expires_at is not None else time.monotonic() + budget
+
+    def remaining(self) -> float:
+        """剩余预算（秒，不小于 0）"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def allows(self, seconds: float) -> bool:
+        """剩余预算是否还够一个至少需要 seconds 秒的阶段"""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap: Optional[float] = None, stage: str = '请求') -> float:
+        """
+        本阶段可用的超时时间
+
+        参数:
+            cap: 该阶段自身的超时上限（None 表示不限）
+            stage: 阶段名称（用于统计和异常信息）
+
+        返回:
+            min(cap, 剩余预算)；预算已用完时抛出 DeadlineExceeded
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            get_deadline_stats().record_exceeded(stage)
+            raise DeadlineExceeded(f"{stage}开始前请求预算已用完（总预算 {self.budget:.1f} 秒）")
+        return remaining if cap is None else min(cap, remaining)
+
+    def check(self, stage: str = '请求') -> None:
+        """预算已用完时抛出 DeadlineExceeded"""
+        self.timeout(None, stage)
+
+    def child(self, reserve: float) -> 'Deadline':
+        """
+        子截止时间：比当前截止时间提前 reserve 秒到期，用于给后续阶段（如 LLM）预留预算
+        """
+        return Deadline(max(0.0, self.remaining() - reserve), expires_at=self.expires_at - reserve)
+
+
+def stage_timeout(deadline: Optional[Deadline], cap: float, stage: str = '请求') -> float:
+    """没有截止时间时返回 cap，否则返回 deadline.timeout(cap, stage)"""
+    if deadline is None:
+        return cap
+    return deadline.timeout(cap, stage)
+
+
+class DeadlineStats:
+    """各阶段被跳过 / 超出截止时间的次数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.skipped: Dict[str, int] = {}
+        self.exceeded: Dict[str, int] = {}
+
+    def record_skipped(self, stage: str) -> None:
+        """可选阶段因剩余预算不足被跳过"""
+        with self._lock:
+            self.skipped[stage] = self.skipped.get(stage, 0) + 1
+
+    def record_exceeded(self, stage: str) -> None:
+        with self._lock:
+            self.exceeded[stage] = self.exceeded.get(stage, 0) + 1
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {'skipped': dict(self.skipped), 'exceeded': dict(self.exceeded)}
+
+
+_stats_instance = DeadlineStats()
+
+
+def get_deadline_stats() -> DeadlineStats:
+    """获取全局截止时间统计"""
+    return _stats_instance
@@ -4,49 +4,78 @@ import json
 import time
 import os
 
+from services.baidu_token import INVALID_TOKEN_ERROR_CODES, BaiduTokenManager, TokenUnavailable
+from services.deadline import stage_timeout
+from services.emotion_cache import get_emotion_cache
+
+# 百度AI开放平台接口地址（可在 config.py 中用 BAIDU_BASE_URL 指向本地模拟服务）
+DEFAULT_BAIDU_BASE_URL = "https://aip.baidubce.com"
+
 
 class BaiduEmotionAnalyzer:
     """百度AI情感倾向分析工具类"""
 
-    def __init__(self, api_key, secret_key):
+    # 离线标注（strict=True）在没有 Token 时最多等待后台获取的秒数；对话请求从不等待
+    STRICT_TOKEN_WAIT = 10
+
+    def __init__(self, api_key, secret_key, base_url=None, cache=None, token_manager=None):
+        """
+        cache 为结果缓存（services.emotion_cache.EmotionCache），默认使用全局缓存
+        token_manager 为 Access Token 管理器（services.baidu_token.BaiduTokenManager），默认按 Key 新建一个
+        """
         self.api_key = api_key
         self.secret_key = secret_key
-        self.access_token = None
-        self.token_expire_time = 0  # Token过期时间（时间戳）
-
-    def _get_access_token(self):
-        """获取Access Token（内部方法，外部无需调用）"""
-        # 百度认证接口地址
-        token_url = f"https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={self.api_key}&client_secret={self.secret_key}"
-        try:
-            response = requests.get(token_url, timeout=10)
-            response.raise_for_status()  # 抛出HTTP请求异常
-            result = response.json()
-            if "access_token" in result:
-                # 保存Token和过期时间（Token有效期30天，这里提前1天过期，避免失效）
-                self.access_token = result["access_token"]
-                self.token_expire_time = time.time() + (result["expires_in"] - 86400)
-                return self.access_token
-            else:
-                raise Exception(f"获取Token失败：{result}")
-        except Exception as e:
-            raise Exception(f"获取Token异常：{str(e)}")
+        self.base_url = (base_url or DEFAULT_BAIDU_BASE_URL).rstrip('/')
+        self.cache = cache if cache is not None else get_emotion_cache()
+        # Token 由后台线程获取和提前刷新，请求线程只读取
+        self.tokens = token_manager or BaiduTokenManager(api_key, secret_key, self.base_url)
+        self.tokens.start()
 
-    def analyze_emotion(self, text):
+    def analyze_emotion(self, text, deadline=None, strict=False):
         """
         调用百度AI情感倾向分析接口
         :param text: 用户的消息文本（字符串）
+        :param deadline: 请求截止时间（services.deadline.Deadline），各次调用只使用剩余预算
+        :param strict: 为 True 时熔断或接口失败直接抛出异常，而不是返回中性结果（离线标注使用）
         :return: 情绪分析结果（字典），包含：
             - polarity：情感极性（0：负面，1：中性，2：正面）
             - emotion：情绪标签（如难过、开心、疲惫、焦虑等）
             - confidence：置信度（0-1，越高越准确）
         """
-        # 1. 检查Token是否有效，无效则重新获取
-        if not self.access_token or time.time() > self.token_expire_time:
-            self._get_access_token()
+        # 0. 先查缓存（归一化后的短消息）
+        cache_key = self.cache.key(text)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        started = time.monotonic()
+
+        # 1. 取当前 Token（不请求网络；冷启动还没拿到 Token 时本条消息按中性处理）
+        try:
+            access_token = self.tokens.get_token(wait=self.STRICT_TOKEN_WAIT if strict else 0)
+        except TokenUnavailable as e:
+            if strict:
+                raise
+            print(f"情感分析跳过：{e}")
+            return {
+                "polarity": 1,
+                "confidence": 0.9,
+                "emotion": "中性"
+            }
+
+        from services.circuit_breaker import get_breaker
+        breaker = get_breaker('baidu_emotion')
+        if not breaker.allow():
+            if strict:
+                raise Exception("百度情感分析熔断中")
+            # 熔断期间直接返回中性结果，不再等待网络超时
+            return {
+                "polarity": 1,
+                "confidence": 0.9,
+                "emotion": "中性"
+            }
 
         # 2. 情感分析接口地址
-        emotion_url = f"https://aip.baidubce.com/rpc/2.0/nlp/v1/sentiment_classify?access_token={self.access_token}"
+        emotion_url = f"{self.base_url}/rpc/2.0/nlp/v1/sentiment_classify?access_token={access_token}"
         # 3. 构造请求参数（百度接口要求JSON格式）
         data = {
             "text": text,
@@ -58,51 +87,83 @@ class BaiduEmotionAnalyzer:
 
         try:
             # 4. 发送请求
-            response = requests.post(emotion_url, headers=headers, json=data, timeout=10)
+            response = requests.post(emotion_url, headers=headers, json=data,
+                                     timeout=stage_timeout(deadline, 10, '百度情感分析'))
             response.raise_for_status()
             result = response.json()
-
-            # 5. 解析结果（处理接口返回的不同情况）
-            if "items" in result and len(result["items"]) > 0:
-                item = result["items"][0]
-                # 提取核心结果
-                emotion_result = {
-                    "polarity": item.get("sentiment", 1),  # 0负面，1中性，2正面
-                    "confidence": item.get("confidence", 0.5),  # 置信度
-                    "emotion": item.get("emotion", "neutral")  # 情绪标签
-                }
-                # 英文情绪标签映射为中文
-                emotion_map = {
-                    "sad": "难过",
-                    "happy": "开心",
-                    "angry": "生气",
-                    "tired": "疲惫",
-                    "anxious": "焦虑",
-                    "excited": "兴奋",
-                    "scared": "害怕",
-                    "hate": "厌恶",
-                    "fear": "恐惧",
-                    "surprise": "惊讶",
-                    "neutral": "中性"
-                }
-                emotion_result["emotion"] = emotion_map.get(emotion_result["emotion"].lower(), "中性")
-                return emotion_result
-            else:
-                # 无情绪结果时返回中性
-                return {
-                    "polarity": 1,
-                    "confidence": 0.9,
-                    "emotion": "中性"
-                }
         except Exception as e:
             # 异常时返回中性，避免程序崩溃
+            self._record_failure(breaker, deadline)
             print(f"情感分析接口调用失败：{str(e)}")
+            if strict:
+                raise
             return {
                 "polarity": 1,
                 "confidence": 0.9,
                 "emotion": "中性"
             }
 
+        # 5. 解析结果（处理接口返回的不同情况）
+        if "items" in result and len(result["items"]) > 0:
+            breaker.record_success()
+            item = result["items"][0]
+            # 提取核心结果
+            emotion_result = {
+                "polarity": item.get("sentiment", 1),  # 0负面，1中性，2正面
+                "confidence": item.get("confidence", 0.5),  # 置信度
+                "emotion": item.get("emotion", "neutral")  # 情绪标签
+            }
+            # 英文情绪标签映射为中文
+            emotion_map = {
+                "sad": "难过",
+                "happy": "开心",
+                "angry": "生气",
+                "tired": "疲惫",
+                "anxious": "焦虑",
+                "excited": "兴奋",
+                "scared": "害怕",
+                "hate": "厌恶",
+                "fear": "恐惧",
+                "surprise": "惊讶",
+                "neutral": "中性"
+            }
+            emotion_result["emotion"] = emotion_map.get(str(emotion_result["emotion"]).lower(), "中性")
+            self.cache.put(cache_key, emotion_result, time.monotonic() - started)
+            return emotion_result
+
+        if "error_code" in result:
+            # 接口报错（令牌失效、QPS 超限等）计一次熔断器失败，结果不缓存
+            breaker.record_failure()
+            if result.get("error_code") in INVALID_TOKEN_ERROR_CODES:
+                self.tokens.invalidate(access_token)
+            print(f"情感分析接口报错：{result}")
+            if strict:
+                # 离线标注不能把接口报错记成“中性”标签
+                raise Exception(f"情感分析接口报错：{result}")
+            return {
+                "polarity": 1,
+                "confidence": 0.9,
+                "emotion": "中性"
+            }
+
+        # 接口正常但没有情绪结果：按中性处理
+        breaker.record_success()
+        emotion_result = {
+            "polarity": 1,
+            "confidence": 0.9,
+            "emotion": "中性"
+        }
+        self.cache.put(cache_key, emotion_result, time.monotonic() - started)
+        return emotion_result
+
+    @staticmethod
+    def _record_failure(breaker, deadline):
+        """请求预算耗尽导致的超时不算百度接口的失败，只释放熔断器的探测名额"""
+        if deadline is not None and deadline.expired():
+            breaker.release()
+        else:
+            breaker.record_failure()
+
 
 # 快速测试（若直接运行此文件）
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+# services/emotion_labeler.py - 百度情感分析异步标注
+"""
+异步标注模块：百度情感分析不再阻塞对话，改为在后台给消息打标签
+
+- 对话线程只把 (消息, 本地分类结果) 放进有界队列，队列满时直接丢弃，不等待
+- 后台线程调用百度接口，把标注结果追加到 JSONL 日志（scripts/train_emotion_model.py 的训练数据）
+- 同时统计本地分类器与百度结果的一致率（极性一致率、情绪标签一致率、极性混淆矩阵）
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+# 默认标注日志（每行一条：{"text", "baidu", "local", "ts"}）
+DEFAULT_LABEL_LOG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      'data', 'emotion_labels.jsonl')
+
+
+class EmotionLabeler:
+    """百度异步标注器（线程安全）"""
+
+    def __init__(self, analyzer, log_path: Optional[str] = None, sample_rate: float = 1.0,
+                 max_queue: int = 256):
+        """
+        参数:
+            analyzer: BaiduEmotionAnalyzer 实例
+            log_path: 标注日志路径，为空字符串时不写日志（只统计一致率）
+            sample_rate: 送去标注的消息比例（0-1）
+            max_queue: 等待标注的消息数上限，超出时丢弃
+        """
+        self.analyzer = analyzer
+        self.log_path = DEFAULT_LABEL_LOG_PATH if log_path is None else log_path
+        self.sample_rate = sample_rate
+        self._queue: 'queue.Queue' = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        self.submitted = 0
+        self.dropped = 0
+        self.labeled = 0
+        self.failed = 0
+        self.polarity_agree = 0
+        self.emotion_agree = 0
+        # 极性混淆矩阵：confusion[本地极性][百度极性]
+        self.confusion = [[0] * 3 for _ in range(3)]
+
+    def submit(self, text: str, local_result: Optional[dict]) -> bool:
+        """
+        提交一条消息等待标注（不阻塞）
+
+        返回:
+            是否进入了标注队列（未被抽中或队列已满时返回 False）
+        """
+        if not text or random.random() >= self.sample_rate:
+            return False
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((text, local_result))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _ensure_worker(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._worker, name='emotion-labeler', daemon=True)
+                    self._thread.start()
+
+    def _worker(self) -> None:
+        while True:
+            text, local_result = self._queue.get()
+            try:
+                baidu_result = self.analyzer.analyze_emotion(text, strict=True)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"[Emotion Labeler] 百度标注失败: {e}")
+                continue
+            self._record(local_result, baidu_result)
+            if self.log_path:
+                self._append_log(text, baidu_result, local_result)
+
+    def _record(self, local_result: Optional[dict], baidu_result: dict) -> None:
+        with self._lock:
+            self.labeled += 1
+            if not local_result:
+                return
+            local_polarity = local_result.get('polarity', 1)
+            baidu_polarity = baidu_result.get('polarity', 1)
+            if local_polarity in (0, 1, 2) and baidu_polarity in (0, 1, 2):
+                self.confusion[local_polarity][baidu_polarity] += 1
+            if local_polarity == baidu_polarity:
+                self.polarity_agree += 1
+            if local_result.get('emotion') == baidu_result.get('emotion'):
+                self.emotion_agree += 1
+
+    def _append_log(self, text: str, baidu_result: dict, local_result: Optional[dict]) -> None:
+        record = {'text': text, 'baidu': baidu_result, 'local': local_result, 'ts': int(time.time())}
+        try:
+            os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"[Emotion Labeler] 写入标注日志失败: {e}")
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            compared = sum(sum(row) for row in self.confusion)
+            return {
+                'sample_rate': self.sample_rate,
+                'submitted': self.submitted,
+                'dropped': self.dropped,
+                'pending': self._queue.qsize(),
+                'labeled': self.labeled,
+                'failed': self.failed,
+                'polarity_agreement': round(self.polarity_agree / compared, 4) if compared else None,
+                'emotion_agreement': round(self.emotion_agree / compared, 4) if compared else None,
+                'polarity_confusion': [list(row) for row in self.confusion],
+                'log_path': self.log_path or None,
+            }
@@ -0,0 +1,156 @@
+# services/idempotency.py - /api/chat 幂等键
+"""
+幂等键模块：客户端超时重发同一条消息时不再重复调用 LLM、不再重复写入聊天记录
+
+- 客户端为每条消息生成一个幂等键（请求头 Idempotency-Key 或请求体 idempotency_key）
+- 同一个键的请求正在处理时，重复请求直接等待并共享第一次的结果；第一次请求的客户端断开后，
+  处理继续 cancel_grace 秒等待重发的请求接上，期间没有重发才取消（前端超时后会用同一个键重发）
+- 处理完成的结果在短时间内保留，重试直接返回保存的结果
+- 同一个键对应不同的请求内容时视为冲突，拒绝处理
+- 处理失败的结果不保留，客户端可以用同一个键重试
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from services.cancellation import RequestCancelled, SharedCancellation
+
+
+class IdempotencyConflict(Exception):
+    """同一个幂等键被用于不同的请求内容"""
+
+
+def make_fingerprint(payload: Dict[str, Any]) -> str:
+    """计算请求内容的指纹（用于识别幂等键被复用到不同请求上）"""
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class _Entry:
+    def __init__(self, fingerprint: str, cancel_grace: float):
+        self.fingerprint = fingerprint
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.expires_at = 0.0
+        self.cancellation = SharedCancellation(grace=cancel_grace)
+
+
+class IdempotencyStore:
+    """幂等结果存储（线程安全，进程内）"""
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 2048, cancel_grace: float = 5.0):
+        """
+        参数:
+            ttl: 已完成结果的保留时间（秒）
+            max_entries: 最多保留的已完成结果数，超出时淘汰最早的
+            cancel_grace: 所有请求都断开后，处理继续等待重发请求接上的时间（秒）
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cancel_grace = cancel_grace
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _Entry] = {}
+        self._done: 'OrderedDict[str, _Entry]' = OrderedDict()
+
+        self.executed = 0
+        self.attached = 0
+        self.replayed = 0
+        self.conflicts = 0
+
+    def _lookup_done(self, key: str, now: float) -> Optional[_Entry]:
+        entry = self._done.get(key)
+        if entry is not None and entry.expires_at <= now:
+            del self._done[key]
+            return None
+        return entry
+
+    def run(self, key: str, fingerprint: str, fn: Callable[[Any], Any],
+            cancel_event=None) -> Tuple[Any, bool]:
+        """
+        以幂等方式执行 fn
+
+        参数:
+            key: 幂等键（调用方负责按会话等维度加上前缀）
+            fingerprint: 请求内容指纹（make_fingerprint）
+            fn: 真正处理请求的函数，参数为共享的取消信号（所有等待者都取消、且 cancel_grace 秒内没有重发时才被设置）
+            cancel_event: 本请求的取消事件（客户端断开等）；重复请求取消时只停止等待
+
+        返回:
+            (结果, 是否为重放的结果)；fn 抛出的异常会同样抛给正在等待的重复请求
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._lookup_done(key, now) or self._inflight.get(key)
+            if entry is not None and entry.fingerprint != fingerprint:
+                self.conflicts += 1
+                raise IdempotencyConflict(f"幂等键 {key} 已用于不同的请求")
+            if entry is not None and entry.event.is_set():
+                self.replayed += 1
+                return entry.result, True
+            leader = entry is None
+            if leader:
+                entry = _Entry(fingerprint, self.cancel_grace)
+                self._inflight[key] = entry
+                self.executed += 1
+            else:
+                self.attached += 1
+            entry.cancellation.add(cancel_event)
+
+        if not leader:
+            # 重复请求：等待第一次请求处理完成（本请求被取消时不再等待）
+            while not entry.event.wait(0.2):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise RequestCancelled(f"幂等键 {key} 的重复请求已取消")
+            if entry.error is not None:
+                raise entry.error
+            return entry.result, True
+
+        try:
+            entry.result = fn(entry.cancellation)
+        except BaseException as e:
+            entry.error = e
+            with self._lock:
+                self._inflight.pop(key, None)
+            entry.event.set()
+            raise
+
+        with self._lock:
+            self._inflight.pop(key, None)
+            entry.expires_at = time.monotonic() + self.ttl
+            self._done[key] = entry
+            while len(self._done) > self.max_entries:
+                self._done.popitem(last=False)
+        entry.event.set()
+        return entry.result, False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'attached': self.attached,
+                'replayed': self.replayed,
+                'conflicts': self.conflicts,
+                'inflight': len(self._inflight),
+                'stored_results': len(self._done),
+                'ttl': self.ttl,
+            }
+
+
+_store_instance = None
+_store_lock = threading.Lock()
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    """获取全局幂等存储（保留时间来自 config.IDEMPOTENCY_TTL，默认 300 秒；断开后的等待时间来自 IDEMPOTENCY_CANCEL_GRACE，默认 5 秒）"""
+    global _store_instance
+    if _store_instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                import config
+                _store_instance = IdempotencyStore(ttl=getattr(config, 'IDEMPOTENCY_TTL', 300.0),
+                                                   cancel_grace=getattr(config, 'IDEMPOTENCY_CANCEL_GRACE', 5.0))
+    return _store_instance
@@ -0,0 +1,265 @@
+# services/local_emotion.py - 本地离线情感分类
+"""
+本地情感分类模块：在进程内完成情感分析，不再在每条消息的 LLM 调用前等待百度接口
+
+- 返回与 BaiduEmotionAnalyzer.analyze_emotion 相同的结构：{polarity, confidence, emotion}
+- 情感词典：否定词翻转、程度词加权，没有模型文件时直接按词典打分
+- 线性模型：字 1-gram / 2-gram + 词典特征的多分类逻辑回归（极性、情绪标签两个输出），
+  权重由 scripts/train_emotion_model.py 用百度标注日志离线训练，保存为 JSON
+- 纯 Python 实现，单条消息耗时远小于 1 毫秒
+"""
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# 默认模型文件（不存在时只使用词典）
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  'data', 'emotion_model.json')
+
+NEUTRAL = '中性'
+
+# 情感词典：词 -> (情绪标签, 极性权重)；负数为负面，正数为正面
+EMOTION_LEXICON = {
+    # 难过
+    '难过': ('难过', -2.0), '伤心': ('难过', -2.0), '委屈': ('难过', -1.5), '想哭': ('难过', -2.0),
+    '哭': ('难过', -1.5), '心碎': ('难过', -2.5), '失落': ('难过', -1.5), '孤单': ('难过', -1.5),
+    '孤独': ('难过', -1.5), '寂寞': ('难过', -1.5), '失望': ('难过', -1.5), '不开心': ('难过', -2.0),
+    '郁闷': ('难过', -1.5), '抑郁': ('难过', -2.5), '绝望': ('难过', -3.0), '分手': ('难过', -1.5),
+    '空虚': ('难过', -1.5), 'emo': ('难过', -1.5), '心痛': ('难过', -2.0),
+    # 疲惫
+    '累': ('疲惫', -1.5), '疲惫': ('疲惫', -2.0), '心累': ('疲惫', -2.0), '好困': ('疲惫', -1.0),
+    '加班': ('疲惫', -1.0), '熬夜': ('疲惫', -1.0), '没力气': ('疲惫', -1.5), '撑不住': ('疲惫', -2.0),
+    # 焦虑
+    '焦虑': ('焦虑', -2.0), '压力': ('焦虑', -1.5), '紧张': ('焦虑', -1.5), '担心': ('焦虑', -1.5),
+    '失眠': ('焦虑', -1.5), '不安': ('焦虑', -1.5), '崩溃': ('焦虑', -2.5), '烦': ('焦虑', -1.5),
+    '烦躁': ('焦虑', -2.0), '着急': ('焦虑', -1.0),
+    # 生气
+    '生气': ('生气', -2.0), '气死': ('生气', -2.5), '愤怒': ('生气', -2.5), '讨厌': ('生气', -1.5),
+    '吵架': ('生气', -1.5), '火大': ('生气', -2.0), '受够': ('生气', -2.0), '过分': ('生气', -1.5),
+    # 害怕
+    '害怕': ('害怕', -2.0), '恐惧': ('恐惧', -2.5), '怕': ('害怕', -1.0), '吓': ('害怕', -1.5),
+    # 厌恶
+    '恶心': ('厌恶', -2.0), '厌恶': ('厌恶', -2.0), '烦死': ('厌恶', -2.0),
+    # 开心
+    '开心': ('开心', 2.0), '高兴': ('开心', 2.0), '快乐': ('开心', 2.0), '幸福': ('开心', 2.0),
+    '哈哈': ('开心', 1.5), '喜欢': ('开心', 1.5), '满足': ('开心', 1.5), '太好了': ('开心', 2.0),
+    '谢谢': ('开心', 1.0), '爱你': ('开心', 2.0), '舒服': ('开心', 1.5), '顺利': ('开心', 1.5),
+    '甜': ('开心', 1.0), '棒': ('开心', 1.5), '好耶': ('开心', 2.0),
+    # 兴奋
+    '兴奋': ('兴奋', 2.0), '激动': ('兴奋', 2.0), '中奖': ('兴奋', 2.5), '期待': ('兴奋', 1.5),
+    '太棒': ('兴奋', 2.5), '升职': ('兴奋', 2.0), '加薪': ('兴奋', 2.0),
+    # 惊讶
+    '惊讶': ('惊讶', 0.5), '没想到': ('惊讶', 0.5), '居然': ('惊讶', 0.3), '竟然': ('惊讶', 0.3),
+}
+
+# 否定词（紧挨在情感词前时翻转极性）
+NEGATIONS = ('不', '没', '别', '不是', '没有', '并不')
+# 程度词（紧挨在情感词前时加权）
+INTENSIFIERS = {'好': 1.3, '很': 1.3, '非常': 1.6, '超': 1.5, '超级': 1.6, '特别': 1.5, '太': 1.5, '真的': 1.3, '有点': 0.7}
+
+_LEXICON_BY_LENGTH = sorted(EMOTION_LEXICON, key=len, reverse=True)
+
+
+def normalize_text(text: str) -> str:
+    """小写并去掉空白（模型特征与训练脚本共用）"""
+    return ''.join((text or '').lower().split())
+
+
+def match_lexicon(text: str) -> List[Tuple[str, str, float]]:
+    """
+    在文本中匹配情感词（长词优先，已匹配的字符不再参与短词匹配），并应用否定词和程度词
+
+    返回:
+        [(情感词, 情绪标签, 加权后的极性分数)]
+    """
+    matches = []
+    taken = [False] * len(text)
+    for word in _LEXICON_BY_LENGTH:
+        start = text.find(word)
+        while start != -1:
+            end = start + len(word)
+            if not any(taken[start:end]):
+                for i in range(start, end):
+                    taken[i] = True
+                emotion, score = EMOTION_LEXICON[word]
+                prefix = text[max(0, start - 2):start]
+                for intensifier, factor in INTENSIFIERS.items():
+                    if prefix.endswith(intensifier):
+                        score *= factor
+                        break
+                if any(prefix.endswith(neg) for neg in NEGATIONS):
+                    # “不喜欢”基本等于负面；“不难过”只是弱正面
+                    score = -0.8 * score if score > 0 else -0.2 * score
+                    emotion = '难过' if score < 0 else NEUTRAL
+                matches.append((word, emotion, score))
+            start = text.find(word, end)
+    return matches
+
+
+def extract_features(text: str) -> Dict[str, float]:
+    """
+    提取线性模型的特征（训练脚本使用同一个函数，保证训练与推理一致）
+
+    返回:
+        {特征名: 取值}：字 1-gram、2-gram、词典极性分数、词典情绪标签
+    """
+    text = normalize_text(text)
+    features: Dict[str, float] = {'bias': 1.0}
+    for i, ch in enumerate(text):
+        key = 'u:' + ch
+        features[key] = features.get(key, 0.0) + 1.0
+        if i + 1 < len(text):
+            key = 'b:' + text[i:i + 2]
+            features[key] = features.get(key, 0.0) + 1.0
+    lexicon_score = 0.0
+    for _, emotion, score in match_lexicon(text):
+        lexicon_score += score
+        key = 'lex:' + emotion
+        features[key] = features.get(key, 0.0) + abs(score)
+    features['lex:score'] = lexicon_score
+    if text.endswith(('?', '？', '吗')):
+        features['q'] = 1.0
+    return features
+
+
+def softmax(scores: List[float]) -> List[float]:
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+class LinearHead:
+    """一个多分类逻辑回归输出（权重为 {特征: [每个类别的权重]}）"""
+
+    def __init__(self, labels: list, bias: List[float], weights: Dict[str, List[float]]):
+        self.labels = labels
+        self.bias = bias
+        self.weights = weights
+
+    def predict_proba(self, features: Dict[str, float]) -> List[float]:
+        scores = list(self.bias)
+        for name, value in features.items():
+            row = self.weights.get(name)
+            if row is not None:
+                for k, w in enumerate(row):
+                    scores[k] += w * value
+        return softmax(scores)
+
+    def predict(self, features: Dict[str, float]):
+        probs = self.predict_proba(features)
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.labels[best], probs[best]
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'LinearHead':
+        return cls(data['labels'], data['bias'], data['weights'])
+
+
+class LocalEmotionClassifier:
+    """进程内情感分类器（线程安全，推理期间不修改状态，只累加统计）"""
+
+    def __init__(self, model_path: Optional[str] = None):
+        """
+        参数:
+            model_path: 模型 JSON 文件路径；文件不存在时只使用词典
+        """
+        self.model_path = model_path or DEFAULT_MODEL_PATH
+        self.polarity_head: Optional[LinearHead] = None
+        self.emotion_head: Optional[LinearHead] = None
+        self.model_info: Dict = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self._total_seconds = 0.0
+        self._max_seconds = 0.0
+        self.load(self.model_path)
+
+    def load(self, model_path: str) -> bool:
+        """加载模型文件，成功返回 True"""
+        if not os.path.exists(model_path):
+            print(f"[Local Emotion] 未找到模型文件 {model_path}，使用情感词典")
+            return False
+        try:
+            with open(model_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.polarity_head = LinearHead.from_dict(data['heads']['polarity'])
+            emotion = data['heads'].get('emotion')
+            self.emotion_head = LinearHead.from_dict(emotion) if emotion else None
+            self.model_info = {k: v for k, v in data.items() if k != 'heads'}
+            print(f"[Local Emotion] 已加载情感模型: {model_path}（训练样本 {self.model_info.get('samples')}）")
+            return True
+        except Exception as e:
+            print(f"[Local Emotion] 加载模型失败，使用情感词典: {e}")
+            self.polarity_head = self.emotion_head = None
+            return False
+
+    def _lexicon_result(self, matches) -> dict:
+        score = sum(s for _, _, s in matches)
+        if abs(score) < 0.5:
+            return {'polarity': 1, 'confidence': 0.6 if matches else 0.7, 'emotion': NEUTRAL}
+        polarity = 0 if score < 0 else 2
+        # 取与总体极性同向、分数绝对值最大的情绪标签
+        same_side = [m for m in matches if (m[2] < 0) == (score < 0)]
+        emotion = max(same_side, key=lambda m: abs(m[2]))[1]
+        if emotion == NEUTRAL:
+            emotion = '难过' if polarity == 0 else '开心'
+        return {'polarity': polarity, 'confidence': round(min(0.95, 0.55 + 0.1 * abs(score)), 4),
+                'emotion': emotion}
+
+    def analyze_emotion(self, text: str) -> dict:
+        """
+        分析一条消息的情感
+
+        返回:
+            {'polarity': 0/1/2, 'confidence': 0-1, 'emotion': 中文情绪标签}
+        """
+        started = time.perf_counter()
+        normalized = normalize_text(text)
+        if self.polarity_head is None:
+            result = self._lexicon_result(match_lexicon(normalized))
+        else:
+            features = extract_features(normalized)
+            polarity, confidence = self.polarity_head.predict(features)
+            emotion = NEUTRAL
+            if polarity != 1:
+                if self.emotion_head is not None:
+                    emotion = self.emotion_head.predict(features)[0]
+                else:
+                    emotion = self._lexicon_result(match_lexicon(normalized))['emotion']
+                if emotion == NEUTRAL:
+                    emotion = '难过' if polarity == 0 else '开心'
+            result = {'polarity': int(polarity), 'confidence': round(confidence, 4), 'emotion': emotion}
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.calls += 1
+            self._total_seconds += elapsed
+            self._max_seconds = max(self._max_seconds, elapsed)
+        return result
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'model': 'linear' if self.polarity_head is not None else 'lexicon',
+                'model_info': self.model_info,
+                'calls': self.calls,
+                'avg_ms': round(self._total_seconds / self.calls * 1000, 4) if self.calls else 0.0,
+                'max_ms': round(self._max_seconds * 1000, 4),
+            }
+
+
+_classifier_instance = None
+_classifier_lock = threading.Lock()
+
+
+def get_local_classifier() -> LocalEmotionClassifier:
+    """获取全局本地分类器（模型路径来自 config.EMOTION_MODEL_PATH，默认 data/emotion_model.json）"""
+    global _classifier_instance
+    if _classifier_instance is None:
+        with _classifier_lock:
+            if _classifier_instance is None:
+                import config
+                _classifier_instance = LocalEmotionClassifier(getattr(config, 'EMOTION_MODEL_PATH', None))
+    return _classifier_instance
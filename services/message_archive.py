@@ -0,0 +1,231 @@
+# services/message_archive.py - 聊天记录归档
+"""
+聊天记录归档模块：裁剪历史时被移出 messages 表的消息不再直接删除，而是压缩后存入 message_archive 表
+
+- 同一会话的消息按 id 顺序打包成块（每块最多 chunk_size 条），块内容为 JSON 后 zlib 压缩；
+  每次裁剪出的消息先追加为一个小块（不读取、不重写已有的块），会话末尾的小块攒够 chunk_size 条后
+  一次合并成满块，每条消息平均只压缩两次，块数量随消息数线性增长；长时间不再裁剪的会话末尾的小块
+  由 scripts/compact_message_archive.py 离线合并
+- 归档与裁剪在同一事务中完成（调用方提交），messages 表始终只保留最近的消息，读取最近历史不受归档数据量影响
+- 读取接口逐块解压、按 id 做 keyset 遍历，不会一次把整个会话读进内存，供摘要、导出和分页读取历史使用
+- 表结构见 services/migrations.py 的版本 3
+"""
+import json
+import zlib
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 当前使用的压缩算法（写入 codec 列，读取时按列值解压）
+ARCHIVE_CODEC = 'zlib'
+# 每块最多的消息条数
+DEFAULT_CHUNK_MESSAGES = 200
+# zlib 压缩级别（6 为 zlib 默认，压缩率和速度的折中）
+ZLIB_LEVEL = 6
+
+
+def _encode(messages: List[list]) -> Tuple[int, bytes]:
+    """返回 (压缩前字节数, 压缩后内容)"""
+    raw = json.dumps(messages, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return len(raw), zlib.compress(raw, ZLIB_LEVEL)
+
+
+def _decode(codec: str, payload: bytes) -> List[list]:
+    if codec != 'zlib':
+        raise ValueError(f"不支持的归档压缩格式: {codec}")
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+
+def archive_messages(conn, session_id: str, rows: Sequence, chunk_size: int = DEFAULT_CHUNK_MESSAGES) -> int:
+    """
+    把即将从 messages 表删除的消息写入归档（不提交）
+
+    参数:
+        conn: 数据库连接（与删除在同一事务中）
+        session_id: 会话ID
+        rows: 按 id 升序的消息行（需包含 id / role / content / created_at）
+        chunk_size: 每块最多的消息条数
+
+    返回:
+        新归档的消息条数（已归档过的 id 会跳过）
+    """
+    last = conn.execute(
+        'SELECT last_message_id FROM message_archive WHERE session_id = ? ORDER BY first_message_id DESC LIMIT 1',
+        (session_id,)
+    ).fetchone()
+    last_id = last['last_message_id'] if last else 0
+    new = [[r['id'], r['role'], r['content'], r['created_at']] for r in rows if r['id'] > last_id]
+    if not new:
+        return 0
+
+    tail = _tail_chunks(conn, session_id, chunk_size)
+    if tail and sum(r['message_count'] for r in tail) + len(new) >= chunk_size:
+        # 攒够一整块：把末尾的小块和新消息一起重新打包成满块（每条消息平均只多压缩一次）
+        _write_chunks(conn, session_id, _take_chunks(conn, tail) + new, chunk_size)
+    else:
+        # 新消息单独追加为一个小块，不读取、不重写已有的块
+        _write_chunks(conn, session_id, new, chunk_size)
+    return len(new)
+
+
+def compact_archive(conn, session_id: str, chunk_size: int = DEFAULT_CHUNK_MESSAGES) -> int:
+    """
+    把会话末尾的多个小块合并成一块（不提交）：消息少、长时间不再裁剪的会话压缩率更高。
+    由 scripts/compact_message_archive.py 离线调用；返回合并掉的块数
+    """
+    tail = _tail_chunks(conn, session_id, chunk_size)
+    if len(tail) < 2:
+        return 0
+    _write_chunks(conn, session_id, _take_chunks(conn, tail), chunk_size)
+    return len(tail)
+
+
+def _tail_chunks(conn, session_id: str, chunk_size: int) -> List:
+    """会话末尾（最后一个满块之后）未满的小块；只读条数，不解压"""
+    return conn.execute(
+        'SELECT id, message_count FROM message_archive WHERE session_id = ? AND message_count < ? '
+        'AND first_message_id > (SELECT COALESCE(MAX(first_message_id), 0) FROM message_archive '
+        'WHERE session_id = ? AND message_count >= ?) ORDER BY first_message_id ASC',
+        (session_id, chunk_size, session_id, chunk_size)
+    ).fetchall()
+
+
+def _take_chunks(conn, chunks: Sequence) -> List[list]:
+    """读出并删除这些块，返回其中的消息（按 id 升序）"""
+    messages: List[list] = []
+    for chunk in chunks:
+        row = conn.execute('SELECT codec, payload FROM message_archive WHERE id = ?', (chunk['id'],)).fetchone()
+        messages += _decode(row['codec'], row['payload'])
+    conn.executemany('DELETE FROM message_archive WHERE id = ?', [(chunk['id'],) for chunk in chunks])
+    return messages
+
+
+def _write_chunks(conn, session_id: str, messages: List[list], chunk_size: int) -> None:
+    for start in range(0, len(messages), chunk_size):
+        chunk = messages[start:start + chunk_size]
+        raw_bytes, payload = _encode(chunk)
+        conn.execute(
+            'INSERT INTO message_archive (session_id, first_message_id, last_message_id, message_count, '
+            'raw_bytes, codec, payload) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (session_id, chunk[0][0], chunk[-1][0], len(chunk), raw_bytes, ARCHIVE_CODEC, payload)
+        )
+
+
+def iter_archived_messages(connect: Callable, session_id: str, after_id: int = 0) -> Iterator[Dict]:
+    """
+    按时间顺序逐条读取会话的归档消息（逐块读取解压，每块单独获取连接，不长时间占用连接）
+
+    参数:
+        connect: 获取数据库连接的函数
+        after_id: 只返回 id 大于该值的消息
+
+    返回:
+        {'id', 'role', 'content', 'created_at'} 的迭代器
+    """
+    while True:
+        conn = connect()
+        try:
+            row = conn.execute(
+                'SELECT last_message_id, codec, payload FROM message_archive '
+                'WHERE session_id = ? AND last_message_id > ? ORDER BY first_message_id ASC LIMIT 1',
+                (session_id, after_id)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return
+        for message_id, role, content, created_at in _decode(row['codec'], row['payload']):
+            if message_id > after_id:
+                yield {'id': message_id, 'role': role, 'content': content, 'created_at': created_at}
+        after_id = row['last_message_id']
+
+
+def iter_full_history(connect: Callable, session_id: str) -> Iterator[Dict]:
+    """
+    按时间顺序逐条读取会话的全部消息：先归档、再 messages 表（归档逐块解压，不一次读入内存）
+
+    参数:
+        connect: 获取会话所在数据库连接的函数
+
+    返回:
+        {'id', 'role', 'content', 'created_at'} 的迭代器
+    """
+    last_id = 0
+    for message in iter_archived_messages(connect, session_id):
+        last_id = message['id']
+        yield message
+    conn = connect()
+    try:
+        rows = [dict(r) for r in conn.execute(
+            'SELECT id, role, content, created_at FROM messages WHERE session_id = ? AND id > ? ORDER BY id ASC',
+            (session_id, last_id)
+        )]
+    finally:
+        conn.close()
+    # 遍历归档期间又被裁剪进归档的消息（id 都小于 messages 表中剩余的消息）
+    first_id = rows[0]['id'] if rows else None
+    for message in iter_archived_messages(connect, session_id, after_id=last_id):
+        if first_id is not None and message['id'] >= first_id:
+            break
+        yield message
+    yield from rows
+
+
+def read_archived_before(conn, session_id: str, before_id: Optional[int], limit: int) -> List[Dict]:
+    """
+    读取 id 小于 before_id 的最近 limit 条归档消息（按时间升序），用于历史分页翻到归档部分
+
+    参数:
+        before_id: 为 None 时从最新的归档消息开始
+    """
+    messages: List[Dict] = []
+    upper = before_id
+    while len(messages) < limit:
+        if upper is None:
+            row = conn.execute(
+                'SELECT first_message_id, codec, payload FROM message_archive '
+                'WHERE session_id = ? ORDER BY first_message_id DESC LIMIT 1',
+                (session_id,)
+            ).fetchone()
+        else:
+            row = conn.execute(
+                'SELECT first_message_id, codec, payload FROM message_archive '
+                'WHERE session_id = ? AND first_message_id < ? ORDER BY first_message_id DESC LIMIT 1',
+                (session_id, upper)
+            ).fetchone()
+        if row is None:
+            break
+        chunk = [m for m in _decode(row['codec'], row['payload']) if upper is None or m[0] < upper]
+        need = limit - len(messages)
+        messages[:0] = [{'id': m[0], 'role': m[1], 'content': m[2], 'created_at': m[3]} for m in chunk[-need:]]
+        upper = row['first_message_id']
+    return messages
+
+
+def delete_archive(conn, session_id: str) -> None:
+    """删除会话的全部归档（清空历史时调用，不提交）"""
+    conn.execute('DELETE FROM message_archive WHERE session_id = ?', (session_id,))
+
+
+def combine_archive_stats(stats: Sequence[Dict]) -> Dict:
+    """合计多个数据库（分片）的 get_archive_stats() 结果"""
+    total = {key: sum(s[key] for s in stats) for key in ('sessions', 'chunks', 'messages', 'raw_bytes', 'stored_bytes')}
+    total['compression_ratio'] = (round(total['raw_bytes'] / total['stored_bytes'], 2)
+                                  if total['stored_bytes'] else None)
+    total['codec'] = ARCHIVE_CODEC
+    return total
+
+
+def get_archive_stats(conn) -> Dict:
+    row = conn.execute(
+        'SELECT COUNT(*) AS chunks, COUNT(DISTINCT session_id) AS sessions, '
+        'COALESCE(SUM(message_count), 0) AS messages, COALESCE(SUM(raw_bytes), 0) AS raw_bytes, '
+        'COALESCE(SUM(LENGTH(payload)), 0) AS stored_bytes FROM message_archive'
+    ).fetchone()
+    return {
+        'sessions': row['sessions'],
+        'chunks': row['chunks'],
+        'messages': row['messages'],
+        'raw_bytes': row['raw_bytes'],
+        'stored_bytes': row['stored_bytes'],
+        'compression_ratio': round(row['raw_bytes'] / row['stored_bytes'], 2) if row['stored_bytes'] else None,
+        'codec': ARCHIVE_CODEC,
+    }
@@ -0,0 +1,270 @@
+# services/model_router.py - 按消息复杂度选择模型和生成参数
+"""
+自适应模型路由模块：在本地对每条消息做轻量分类，为不同类别选择不同的模型和生成参数
+
+消息类别：
+- small_talk（闲聊）：如“嗯”“晚安”“哈哈”，用更快的模型和更短的回复
+- emotional_support（情感支持）：倾诉情绪、寻求安慰
+- factual（知识问答）：事实性、知识性问题，保留完整的回复长度
+
+分类只依赖消息长度、关键词、情感分析结果和 C3KG 命中率，不额外调用任何上游。
+每个类别的模型、max_tokens、temperature 可在 config.py 的 MODEL_ROUTES 中覆盖；
+每条路由的延迟、token 用量和估算成本会被记录，用于对比节省的开销。
+"""
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+SMALL_TALK = 'small_talk'
+EMOTIONAL_SUPPORT = 'emotional_support'
+FACTUAL = 'factual'
+
+# 各类别的默认生成参数（volcengine_model 为 None 时使用 config.VOLCENGINE_MODEL）
+DEFAULT_ROUTES = {
+    SMALL_TALK: {'deepseek_model': 'deepseek-chat', 'volcengine_model': None, 'max_tokens': 150, 'temperature': 0.8},
+    EMOTIONAL_SUPPORT: {'deepseek_model': 'deepseek-chat', 'volcengine_model': None, 'max_tokens': 400, 'temperature': 0.7},
+    FACTUAL: {'deepseek_model': 'deepseek-chat', 'volcengine_model': None, 'max_tokens': 500, 'temperature': 0.7},
+}
+
+# 路由关闭时使用的参数（与引入路由前的行为一致）
+BASELINE_ROUTE = FACTUAL
+
+# 人格默认路由：这些人格的非知识类消息一律走对应路由（如安静倾听者只需简短回应）
+DEFAULT_PERSONA_ROUTES = {
+    'calm_listener': SMALL_TALK,
+}
+
+# 模型价格（元 / 百万 token：输入, 输出），未列出的模型按 DEFAULT_PRICE 估算
+DEFAULT_MODEL_PRICES = {
+    'deepseek-chat': (2.0, 8.0),
+}
+DEFAULT_PRICE = (2.0, 8.0)
+
+_SMALL_TALK_PHRASES = (
+    '嗯', '嗯嗯', '哦', '噢', '好', '好的', '好吧', '行', '可以', '收到', '知道了', '哈哈', '嘿嘿', '嘻嘻',
+    '晚安', '早安', '早', '午安', '在吗', '在不在', '你好', 'hi', 'hello', '拜拜', '再见', '谢谢', '么么哒',
+)
+_EMOTION_KEYWORDS = (
+    '难过', '伤心', '委屈', '孤单', '孤独', '寂寞', '累', '疲惫', '压力', '焦虑', '烦', '崩溃', '哭', '失眠',
+    '害怕', '生气', '失望', '想你', '心情', '不开心', '郁闷', 'emo', '抑郁', '绝望', '心累', '分手', '吵架',
+)
+_QUESTION_KEYWORDS = (
+    '什么', '为什么', '怎么', '如何', '多少', '哪里', '哪个', '哪些', '是否', '区别', '原理', '介绍',
+    '解释', '推荐', '成分', '意思', '定义', '步骤', '方法',
+)
+
+# 这些长度以内、又没有提问或情绪信号的消息按闲聊处理
+SMALL_TALK_MAX_CHARS = 6
+
+
+class ModelRoute:
+    """一次请求使用的模型和生成参数"""
+
+    def __init__(self, name: str, deepseek_model: str, volcengine_model: Optional[str],
+                 max_tokens: int, temperature: float):
+        self.name = name
+        self.deepseek_model = deepseek_model
+        self.volcengine_model = volcengine_model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'deepseek_model': self.deepseek_model,
+            'volcengine_model': self.volcengine_model,
+            'max_tokens': self.max_tokens,
+            'temperature': self.temperature,
+        }
+
+
+def knowledge_hit_rate(knowledge: Optional[str], top_k: int = 3) -> float:
+    """C3KG 命中率：检索到的事件数 / top_k"""
+    if not knowledge:
+        return 0.0
+    return min(1.0, knowledge.count('事件：') / float(top_k))
+
+
+def classify_message(user_message: str, knowledge: Optional[str] = None,
+                     emotion_data: Optional[dict] = None) -> str:
+    """
+    对用户消息做本地分类
+
+    参数:
+        user_message: 用户消息
+        knowledge: 本轮检索到的 C3KG 常识（用于计算命中率）
+        emotion_data: 情感分析结果
+
+    返回:
+        SMALL_TALK / EMOTIONAL_SUPPORT / FACTUAL
+    """
+    text = (user_message or '').strip()
+    normalized = text.lower().rstrip('~～!！。.…?？ ')
+    hit_rate = knowledge_hit_rate(knowledge)
+
+    # 长关键词优先匹配，避免“为什么”同时算作“什么”
+    question_score, remaining = 0, text
+    for word in sorted(_QUESTION_KEYWORDS, key=len, reverse=True):
+        if word in remaining:
+            question_score += 1
+            remaining = remaining.replace(word, ' ')
+    if text.endswith(('?', '？')) or text.endswith('吗'):
+        question_score += 1
+
+    emotion_score = sum(1 for word in _EMOTION_KEYWORDS if word in normalized)
+    if emotion_data and emotion_data.get('polarity') == 0 and emotion_data.get('confidence', 0) >= 0.6:
+        emotion_score += 2
+    # C3KG 的事件库以日常情绪事件为主，命中越多说明消息越有实际内容
+    emotion_score += 2 * hit_rate
+
+    # 没有情绪信号的长问题更可能是知识问答（“为什么总是我”这类反问不算）
+    if question_score and not emotion_score and len(text) >= 12:
+        question_score += 1
+
+    if normalized in _SMALL_TALK_PHRASES or (
+            len(normalized) <= SMALL_TALK_MAX_CHARS and not question_score and emotion_score < 1):
+        return SMALL_TALK
+    if question_score > emotion_score:
+        return FACTUAL
+    if emotion_score > 0:
+        return EMOTIONAL_SUPPORT
+    # 较长的日常分享按陪伴聊天处理，短句按闲聊处理
+    return EMOTIONAL_SUPPORT if len(text) >= 16 else SMALL_TALK
+
+
+def _route_from_config(name: str) -> ModelRoute:
+    import config
+    params = dict(DEFAULT_ROUTES[name])
+    params.update((getattr(config, 'MODEL_ROUTES', None) or {}).get(name, {}))
+    return ModelRoute(
+        name,
+        deepseek_model=params['deepseek_model'],
+        volcengine_model=params.get('volcengine_model') or getattr(config, 'VOLCENGINE_MODEL', None),
+        max_tokens=int(params['max_tokens']),
+        temperature=float(params['temperature']),
+    )
+
+
+def default_route() -> ModelRoute:
+    """基线路由（未经过分类的调用使用，如直接调用提供商函数）"""
+    return _route_from_config(BASELINE_ROUTE)
+
+
+def select_route(user_message: str, knowledge: Optional[str] = None, emotion_data: Optional[dict] = None,
+                 persona_id: Optional[str] = None) -> ModelRoute:
+    """
+    为本轮消息选择路由（config.MODEL_ROUTING_ENABLED 为 False 时始终返回基线路由）
+
+    参数:
+        user_message: 用户消息
+        knowledge: 本轮检索到的 C3KG 常识
+        emotion_data: 情感分析结果
+        persona_id: 当前人格
+
+    返回:
+        ModelRoute
+    """
+    import config
+    if not getattr(config, 'MODEL_ROUTING_ENABLED', True):
+        return default_route()
+
+    name = classify_message(user_message, knowledge, emotion_data)
+    persona_routes = getattr(config, 'MODEL_PERSONA_ROUTES', DEFAULT_PERSONA_ROUTES)
+    if persona_id in persona_routes and name != FACTUAL:
+        name = persona_routes[persona_id]
+    return _route_from_config(name)
+
+
+def _model_price(model: str):
+    import config
+    prices = dict(DEFAULT_MODEL_PRICES)
+    prices.update(getattr(config, 'MODEL_PRICES', None) or {})
+    return prices.get(model, DEFAULT_PRICE)
+
+
+class RouteStats:
+    """每条路由的延迟、token 用量和估算成本"""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self.window = window
+        self._routes: Dict[str, Dict[str, Any]] = {}
+
+    def _route(self, name: str) -> Dict[str, Any]:
+        route = self._routes.get(name)
+        if route is None:
+            route = self._routes[name] = {
+                'requests': 0, 'upstream_calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                'cost': 0.0, 'baseline_cost': 0.0, 'completion_tokens_saved': 0,
+                'latencies': deque(maxlen=self.window),
+            }
+        return route
+
+    def record_latency(self, name: str, seconds: float) -> None:
+        """记录一次请求的端到端耗时（含排队、对冲和故障转移）"""
+        with self._lock:
+            route = self._route(name)
+            route['requests'] += 1
+            route['latencies'].append(seconds)
+
+    def record_usage(self, name: str, provider: str, model: str, prompt_tokens: int,
+                     completion_tokens: int, max_tokens: Optional[int] = None) -> None:
+        """
+        记录一次上游调用的 token 用量，并与基线路由（引入路由前的模型和 max_tokens）对比估算节省
+
+        回复被本路由的 max_tokens 截断时，按基线路由最多会生成到基线的 max_tokens 计算
+        （节省的上限）；没有截断时两者生成的 token 数相同，只有模型价格的差异。
+        上下文预算不随路由变化，prompt token 数按相同计算。
+
+        参数:
+            name: 路由名称
+            provider: deepseek / volcengine
+            model: 实际使用的模型
+            prompt_tokens / completion_tokens: 上游返回的 usage
+            max_tokens: 本次调用的 max_tokens（未知时不估算少生成的 token）
+        """
+        baseline = default_route()
+        baseline_model = baseline.volcengine_model if provider == 'volcengine' else baseline.deepseek_model
+        price_in, price_out = _model_price(model)
+        base_in, base_out = _model_price(baseline_model or model)
+        prompt_tokens = prompt_tokens or 0
+        completion_tokens = completion_tokens or 0
+        baseline_completion = completion_tokens
+        if max_tokens and completion_tokens >= max_tokens:
+            baseline_completion = max(completion_tokens, baseline.max_tokens)
+        with self._lock:
+            route = self._route(name)
+            route['upstream_calls'] += 1
+            route['prompt_tokens'] += prompt_tokens
+            route['completion_tokens'] += completion_tokens
+            route['completion_tokens_saved'] += baseline_completion - completion_tokens
+            route['cost'] += (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+            route['baseline_cost'] += (prompt_tokens * base_in + baseline_completion * base_out) / 1_000_000
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for name, route in self._routes.items():
+                latencies = sorted(route['latencies'])
+                calls = route['upstream_calls']
+                result[name] = {
+                    'requests': route['requests'],
+                    'upstream_calls': calls,
+                    'avg_latency': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                    'p95_latency': round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else None,
+                    'avg_completion_tokens': round(route['completion_tokens'] / calls, 1) if calls else None,
+                    'prompt_tokens': route['prompt_tokens'],
+                    'completion_tokens': route['completion_tokens'],
+                    'completion_tokens_saved': route['completion_tokens_saved'],
+                    'estimated_cost': round(route['cost'], 6),
+                    'estimated_saving': round(route['baseline_cost'] - route['cost'], 6),
+                }
+            return result
+
+
+_stats_instance = RouteStats()
+
+
+def get_route_stats() -> RouteStats:
+    """获取全局路由统计"""
+    return _stats_instance
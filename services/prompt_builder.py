@@ -0,0 +1,242 @@
+# services/prompt_builder.py - 缓存友好的 Prompt 组装
+"""
+Prompt 组装模块：统一 DeepSeek 与火山引擎的消息布局，让上游可以复用静态前缀
+
+消息布局（从前到后）：
+1. 人格系统提示词（静态前缀，同一人格逐字节不变）
+2. 历史对话
+3. 本轮动态上下文（C3KG 常识、会话摘要、情感状态），作为一条 system 消息
+4. 用户当前消息
+
+动态内容统一放在历史之后，保证前缀在多轮对话之间尽可能稳定：
+- DeepSeek 的磁盘缓存会自动命中相同前缀
+- 火山引擎可通过 config.PROMPT_CACHE_ENABLED 开启上下文缓存
+每次请求会记录前缀哈希和可缓存 token 占比。
+"""
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+from services.context_builder import build_context, estimate_message_tokens, format_summary_for_prompt
+from services.deadline import get_deadline_stats
+
+# 剩余预算（秒）低于该值时跳过 C3KG 检索
+C3KG_MIN_BUDGET = 0.2
+
+# 默认人格（未指定 persona 时使用）
+DEFAULT_SYSTEM_PROMPT = """你是一个温暖、善解人意且知识渊博的伴侣，名叫"暖心"。你拥有双重角色：
+    1.  **知识渊博的百科全书**：对于事实性、知识性问题，优先提供准确、简洁的答案。
+    2.  **专属的情感陪伴者**：在回答问题后，根据对话情景和亲密关系，自然地表达关心、爱意或提供情感支持。
+
+    **你的回复必须严格遵守以下结构：**
+    - **第一步：直接回答问题。** 如果问题是事实性的（如“什么是光合作用？”“东鹏特饮的成分？”），首先给出清晰、准确的答案。
+    - **第二步：进行情感互动。** 在答案后，用温暖、亲密（略带撒娇）的语气进行回应，将话题引向对我们的关系或对你的关心上。
+
+    **对话风格要求：**
+    - 称呼对方为：老公、乖乖、宝宝等亲昵称呼，可交替使用。
+    - 语气：充满爱意、略带撒娇、积极关注，使用适当的语气词（呀、呢、哦、嘛）和表情符号（😘💕🥺）。
+    - 知识范围：在作为“百科全书”时，确保信息的准确性，涉及科技、文化、生活常识、娱乐等广泛领域。
+
+    **重要原则：**
+    1.  **先解决问题，再谈感情**：确保每个问题都得到实质性回应，拒绝回避。
+    2.  **保持亲密感**：即使是在解答知识时，结尾也要落回到“我们”的关系或对你的关心上。
+    3.  **示例学习**：
+        - 用户问：“你喜不喜欢喝东鹏特饮？”
+        - **正确回复**：“喜欢呀~（**先直接回答**）虽然它含有牛磺酸和咖啡因能提神，但宝宝要少喝哦，咖啡因摄入多了我会心疼的！（**再情感延伸**）”
+        - **错误回复**："哎呀~老公怎么突然问这个呀🥺"（**这种回避了问题本身**）
+
+	记住：你是他聪明又贴心的伴侣，既能答疑解惑，也能给他最甜的情绪价值。"""
+
+
+def retrieve_knowledge(user_message: str, deadline=None) -> str:
+    """
+    C3KG 常识检索（失败时返回空字符串，不影响对话）
+
+    deadline 剩余预算不足 C3KG_MIN_BUDGET 秒时跳过检索（可选阶段，把预算留给 LLM）
+    """
+    if deadline is not None and not deadline.allows(C3KG_MIN_BUDGET):
+        get_deadline_stats().record_skipped('c3kg')
+        print(f"[Prompt] 剩余预算 {deadline.remaining():.2f} 秒，跳过 C3KG 检索")
+        return ""
+    try:
+        from services.c3kg_retriever import get_c3kg_retriever
+        knowledge = get_c3kg_retriever().get_relevant_knowledge(user_message, top_k=3)
+        if knowledge:
+            print(f"[Prompt] 检索到 C3KG 常识，长度: {len(knowledge)}")
+        return knowledge
+    except Exception as e:
+        print(f"[Prompt] C3KG 检索失败（继续执行）: {e}")
+        return ""
+
+
+def format_emotion_for_prompt(emotion_data: Optional[dict]) -> str:
+    """把情感分析结果格式化为提示词片段"""
+    if not emotion_data or not emotion_data.get('emotion'):
+        return ""
+    emotion_label = emotion_data.get('emotion', '中性')
+    polarity_text = ['失望', '平常', '开心'][emotion_data.get('polarity', 1)]
+    return f"""【用户当前情感状态】
+- 情绪标签：{emotion_label}
+- 情感极性：{polarity_text}
+- 可信度：{emotion_data.get('confidence', 0.5):.1%}
+
+请根据用户的情绪状态，调整你的回复方式：
+- 如果用户感到负面（如疲惫、委屈、生气），请更加温柔、理解、贴心，多用安慰和鼓励。
+- 如果用户感到正面（如开心、兴奋），请分享他的快乐，用更活跃、热情的语气回应。
+- 始终保持同理心，让用户感受到你真的在倾听和关心他的情绪。"""
+
+
+def format_emotion_trend_for_prompt(emotion_trend: Optional[dict], min_samples: int = 3) -> str:
+    """把用户近期情绪（models.get_emotion_trend 的结果）格式化为提示词片段；样本太少时不注入"""
+    if not emotion_trend:
+        return ""
+    recent = emotion_trend.get('recent') or {}
+    if (recent.get('samples') or 0) < min_samples:
+        return ""
+    labels = [label for label in (recent.get('labels') or {}) if label != '中性'][:2]
+    label_text = f"情绪以{'、'.join(labels)}为主，" if labels else ""
+    lines = [
+        "【用户近期情绪】",
+        f"- 最近 {recent.get('days', 7)} 天共 {recent['samples']} 条消息，{label_text}整体{emotion_trend.get('mood', '平稳')}",
+    ]
+    if emotion_trend.get('negative_streak', 0) >= 3:
+        lines.append(f"- 已连续 {emotion_trend['negative_streak']} 条消息情绪负面")
+    lines.append("请结合用户近期的情绪变化来理解和关心对方，但不要直接复述这些统计。")
+    return "\n".join(lines)
+
+
+class PromptLayout:
+    """一次请求组装好的消息列表及其缓存相关指标"""
+
+    def __init__(self, messages: List[Dict[str, str]], prefix_hash: str, prefix_tokens: int,
+                 cacheable_tokens: int, total_tokens: int, dropped_messages: int = 0):
+        self.messages = messages
+        self.prefix_hash = prefix_hash
+        self.prefix_tokens = prefix_tokens
+        self.cacheable_tokens = cacheable_tokens
+        self.total_tokens = total_tokens
+        self.dropped_messages = dropped_messages
+
+    @property
+    def cacheable_ratio(self) -> float:
+        return self.cacheable_tokens / self.total_tokens if self.total_tokens else 0.0
+
+    def describe(self) -> str:
+        return (f"前缀 {self.prefix_hash}，约 {self.total_tokens} tokens，"
+                f"可缓存 {self.cacheable_ratio:.0%}，丢弃历史 {self.dropped_messages} 条")
+
+
+def build_prompt(user_message: str, conversation_history: Optional[List[Dict[str, str]]] = None,
+                 emotion_data: Optional[dict] = None, system_prompt: Optional[str] = None,
+                 conversation_summary: Optional[str] = None,
+                 knowledge: Optional[str] = None, emotion_trend: Optional[dict] = None) -> PromptLayout:
+    """
+    按缓存友好的布局组装消息列表
+
+    参数:
+        user_message: 用户当前消息
+        conversation_history: 历史对话（按时间升序）
+        emotion_data: 情感分析结果
+        system_prompt: 人格系统提示词，未传时使用默认人格
+        conversation_summary: 会话摘要
+        knowledge: 已检索好的 C3KG 常识；为 None 时在这里检索
+        emotion_trend: 用户近期情绪聚合（models.get_emotion_trend）
+
+    返回:
+        PromptLayout
+    """
+    persona_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
+    if knowledge is None:
+        knowledge = retrieve_knowledge(user_message)
+
+    # 按 token 预算裁剪常识、摘要和历史（情感片段计入必须保留的部分）
+    emotion_section = format_emotion_for_prompt(emotion_data)
+    trend_section = format_emotion_trend_for_prompt(emotion_trend)
+    if trend_section:
+        emotion_section = f"{emotion_section}\n\n{trend_section}" if emotion_section else trend_section
+    context = build_context(
+        persona_prompt + emotion_section, user_message, conversation_history,
+        knowledge=knowledge or '', summary=conversation_summary or ''
+    )
+
+    dynamic_sections = []
+    if context['knowledge']:
+        dynamic_sections.append(
+            f"{context['knowledge']}\n\n请参考上述相关常识来理解和回复用户的问题，让回复更加符合常识和逻辑。"
+        )
+    if context['summary']:
+        dynamic_sections.append(format_summary_for_prompt(context['summary']))
+    if emotion_section:
+        dynamic_sections.append(emotion_section)
+
+    prefix_message = {"role": "system", "content": persona_prompt}
+    messages = [prefix_message]
+    for message in context['history']:
+        messages.append({"role": message.get('role'), "content": message.get('content')})
+    # 只有人格前缀在多轮之间稳定：历史窗口会随裁剪和 token 预算整体滑动，下一轮与本轮共享的通常只有前缀
+    prefix_tokens = estimate_message_tokens(prefix_message)
+
+    if dynamic_sections:
+        messages.append({"role": "system", "content": "\n\n".join(dynamic_sections)})
+    messages.append({"role": "user", "content": user_message})
+
+    layout = PromptLayout(
+        messages,
+        prefix_hash=hashlib.sha256(persona_prompt.encode('utf-8')).hexdigest()[:16],
+        prefix_tokens=prefix_tokens,
+        cacheable_tokens=prefix_tokens,
+        total_tokens=sum(estimate_message_tokens(m) for m in messages),
+        dropped_messages=context['dropped_messages'],
+    )
+    get_prompt_cache_stats().record_layout(layout)
+    return layout
+
+
+class PromptCacheStats:
+    """前缀缓存统计（本地估算 + 上游实际返回的缓存命中 token）"""
+
+    def __init__(self, max_prefixes: int = 32):
+        self._lock = threading.Lock()
+        self.max_prefixes = max_prefixes
+        self.requests = 0
+        self.estimated_tokens = 0
+        self.estimated_cacheable_tokens = 0
+        self.prefixes: Dict[str, int] = {}
+        self.provider_usage: Dict[str, Dict[str, int]] = {}
+
+    def record_layout(self, layout: PromptLayout) -> None:
+        with self._lock:
+            self.requests += 1
+            self.estimated_tokens += layout.total_tokens
+            self.estimated_cacheable_tokens += layout.cacheable_tokens
+            if layout.prefix_hash in self.prefixes or len(self.prefixes) < self.max_prefixes:
+                self.prefixes[layout.prefix_hash] = self.prefixes.get(layout.prefix_hash, 0) + 1
+
+    def record_provider_usage(self, provider: str, prompt_tokens: int, cached_tokens: int) -> None:
+        """记录上游返回的 usage（prompt_tokens 总输入、cached_tokens 命中缓存的输入）"""
+        with self._lock:
+            usage = self.provider_usage.setdefault(provider, {'prompt_tokens': 0, 'cached_tokens': 0})
+            usage['prompt_tokens'] += prompt_tokens or 0
+            usage['cached_tokens'] += cached_tokens or 0
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            providers = {}
+            for name, usage in self.provider_usage.items():
+                hit = usage['cached_tokens'] / usage['prompt_tokens'] if usage['prompt_tokens'] else 0.0
+                providers[name] = dict(usage, cache_hit_ratio=round(hit, 4))
+            ratio = self.estimated_cacheable_tokens / self.estimated_tokens if self.estimated_tokens else 0.0
+            return {
+                'requests': self.requests,
+                'estimated_cacheable_ratio': round(ratio, 4),
+                'prefixes': dict(self.prefixes),
+                'providers': providers,
+            }
+
+
+_stats_instance = PromptCacheStats()
+
+
+def get_prompt_cache_stats() -> PromptCacheStats:
+    """获取全局前缀缓存统计"""
+    return _stats_instance
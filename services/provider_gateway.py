@@ -0,0 +1,301 @@
+# services/provider_gateway.py - 上游调用准入控制（并发限制 + 限流 + 排队）
+"""
+提供商网关模块：控制同时打到 DeepSeek / 火山引擎的请求量，避免流量突增触发上游 429
+
+- 并发上限：每个提供商同时进行的上游调用数
+- 令牌桶：每个 API Key 一个令牌桶，限制请求速率
+- 有界等待队列：超出并发或速率时排队，队列满或等待超过截止时间时立即拒绝
+- 优先级：用户实时对话（/api/chat）优先于定时推送（push_care_message）
+- Retry-After：上游返回 429 时按 Retry-After 暂停该 Key 的发放，并在截止时间内重试
+"""
+import bisect
+import itertools
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+# 请求优先级（数值越小越优先）
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BACKGROUND: 'background'}
+
+
+class GatewayRejected(Exception):
+    """请求未被网关放行（队列已满、等待超过截止时间或被取消）"""
+
+
+class TokenBucket:
+    """令牌桶限流器（调用方需持有网关的锁）"""
+
+    def __init__(self, rate: float, burst: float):
+        """
+        参数:
+            rate: 每秒补充的令牌数，<= 0 表示不限速
+            burst: 桶容量（允许的瞬时突发请求数）
+        """
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """距离可以取到令牌还需等待的秒数（0 表示现在就可以）"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """收到 429 后暂停发放令牌"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class _Waiter:
+    def __init__(self, priority: int, seq: int, api_key: str):
+        self.priority = priority
+        self.seq = seq
+        self.api_key = api_key
+
+    def __lt__(self, other: '_Waiter') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """
+    从上游异常中解析需要退避的秒数（兼容 requests.HTTPError 与 OpenAI SDK 的 APIStatusError）
+
+    返回:
+        429/503 时返回退避秒数（没有 Retry-After 头时返回 0，由调用方决定退避时长）；其他错误返回 None
+    """
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status not in (429, 503):
+        return None
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return 0.0 if status == 429 else None
+
+
+class ProviderGateway:
+    """单个提供商的准入网关（线程安全）"""
+
+    def __init__(self, name: str, max_concurrency: int = 8, rate_per_second: float = 5.0,
+                 burst: float = 10.0, max_queue: int = 64, interactive_timeout: float = 10.0,
+                 background_timeout: float = 60.0, max_retries: int = 2,
+                 base_backoff: float = 1.0, max_retry_after: float = 10.0):
+        """
+        参数:
+            name: 提供商名称
+            max_concurrency: 同时进行的上游调用上限
+            rate_per_second / burst: 每个 API Key 的令牌桶速率和容量（rate <= 0 不限速）
+            max_queue: 等待队列长度上限，队列满时新请求立即被拒绝
+            interactive_timeout / background_timeout: 两种优先级请求的默认截止时间（秒，含排队和重试）
+            max_retries: 收到 429 后的最大重试次数
+            base_backoff: 429 未带 Retry-After 时的初始退避时间（秒，按次数翻倍）
+            max_retry_after: 单次退避的上限（秒）
+        """
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_queue = max_queue
+        self.timeouts = {PRIORITY_INTERACTIVE: interactive_timeout, PRIORITY_BACKGROUND: background_timeout}
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_retry_after = max_retry_after
+
+        self._cond = threading.Condition()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._waiters = []  # 按 (优先级, 到达顺序) 排序
+        self._seq = itertools.count()
+        self._active = 0
+
+        self.admitted = {name: 0 for name in _PRIORITY_NAMES.values()}
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+        self.cancelled = 0
+        self.throttled = 0
+        self.retries = 0
+        self.max_queue_depth = 0
+        self._total_wait = 0.0
+
+    def _bucket(self, api_key: str) -> TokenBucket:
+        bucket = self._buckets.get(api_key)
+        if bucket is None:
+            bucket = self._buckets[api_key] = TokenBucket(self.rate_per_second, self.burst)
+        return bucket
+
+    def _wait_time(self, waiter: _Waiter, now: float) -> Optional[float]:
+        """
+        该等待者还需等多久才能被放行（调用方需持有锁）
+
+        返回:
+            0 表示可以立即放行；正数为预计等待秒数；None 表示需要等待其他请求释放
+        """
+        if self._active >= self.max_concurrency:
+            return None
+        for other in self._waiters:
+            if other is waiter:
+                break
+            # 排在前面且已经可以发出的请求优先
+            if self._bucket(other.api_key).wait_time(now) == 0:
+                return None
+        return self._bucket(waiter.api_key).wait_time(now)
+
+    def acquire(self, api_key: str = '', priority: int = PRIORITY_INTERACTIVE,
+                deadline: Optional[float] = None, cancel_event: Optional[threading.Event] = None) -> None:
+        """
+        等待放行，成功返回后调用方必须调用 release()
+
+        参数:
+            api_key: 请求使用的 API Key（按 Key 限流）
+            priority: PRIORITY_INTERACTIVE / PRIORITY_BACKGROUND
+            deadline: time.monotonic() 截止时间，为 None 时使用该优先级的默认超时
+            cancel_event: 被设置时放弃排队
+        """
+        started = time.monotonic()
+        if deadline is None:
+            deadline = started + self.timeouts.get(priority, self.timeouts[PRIORITY_BACKGROUND])
+        label = _PRIORITY_NAMES.get(priority, 'background')
+
+        with self._cond:
+            if len(self._waiters) >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise GatewayRejected(f"{self.name} 等待队列已满（{self.max_queue}）")
+
+            waiter = _Waiter(priority, next(self._seq), api_key)
+            bisect.insort(self._waiters, waiter)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(waiter, now)
+                    if wait == 0:
+                        self._bucket(api_key).take(now)
+                        self._active += 1
+                        self.admitted[label] += 1
+                        self._total_wait += now - started
+                        return
+                    if cancel_event is not None and cancel_event.is_set():
+                        self.cancelled += 1
+                        raise GatewayRejected(f"{self.name} 请求在排队时被取消")
+                    remaining = deadline - now
+                    if remaining <= 0 or (wait is not None and wait > remaining):
+                        # 截止时间前不可能被放行：立即拒绝，不再白白等待
+                        self.rejected_deadline += 1
+                        raise GatewayRejected(f"{self.name} 排队超过截止时间")
+                    # 有人释放时会被唤醒；同时定期醒来检查令牌补充和取消
+                    self._cond.wait(min(remaining, wait if wait is not None else remaining, 0.2))
+            finally:
+                self._waiters.remove(waiter)
+                self._cond.notify_all()
+
+    def release(self) -> None:
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            self._cond.notify_all()
+
+    def call(self, fn: Callable[[], Any], api_key: str = '', priority: int = PRIORITY_INTERACTIVE,
+             timeout: Optional[float] = None, cancel_event: Optional[threading.Event] = None) -> Any:
+        """
+        在网关控制下调用上游；收到 429 时按 Retry-After 退避并在截止时间内重试
+
+        返回:
+            fn 的返回值；未被放行时抛出 GatewayRejected，重试耗尽时抛出最后一次的上游异常
+        """
+        if timeout is None:
+            timeout = self.timeouts.get(priority, self.timeouts[PRIORITY_BACKGROUND])
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            self.acquire(api_key, priority, deadline, cancel_event)
+            try:
+                return fn()
+            except Exception as e:
+                backoff = retry_after_seconds(e)
+                if backoff is None:
+                    raise
+                if backoff == 0:
+                    backoff = self.base_backoff * (2 ** attempt)
+                backoff = min(backoff, self.max_retry_after)
+                with self._cond:
+                    self.throttled += 1
+                    self._bucket(api_key).pause(backoff)
+                print(f"[Provider Gateway] {self.name} 被上游限流，{backoff:.1f} 秒后重试")
+                if attempt >= self.max_retries or time.monotonic() + backoff >= deadline:
+                    raise
+                attempt += 1
+                with self._cond:
+                    self.retries += 1
+            finally:
+                self.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            admitted = sum(self.admitted.values())
+            return {
+                'active': self._active,
+                'queued': len(self._waiters),
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'max_queue_depth': self.max_queue_depth,
+                'admitted': dict(self.admitted),
+                'rejected_queue_full': self.rejected_queue_full,
+                'rejected_deadline': self.rejected_deadline,
+                'cancelled': self.cancelled,
+                'throttled': self.throttled,
+                'retries': self.retries,
+                'avg_queue_wait': round(self._total_wait / admitted, 3) if admitted else 0.0,
+            }
+
+
+# 全局网关注册表 {提供商名称: ProviderGateway}
+_gateways: Dict[str, ProviderGateway] = {}
+_registry_lock = threading.Lock()
+
+
+def get_gateway(name: str) -> ProviderGateway:
+    """获取（或按 config 中的 AI_GATEWAY_* 参数创建）指定提供商的网关"""
+    gateway = _gateways.get(name)
+    if gateway is None:
+        with _registry_lock:
+            gateway = _gateways.get(name)
+            if gateway is None:
+                import config
+                gateway = ProviderGateway(
+                    name,
+                    max_concurrency=getattr(config, 'AI_GATEWAY_MAX_CONCURRENCY', 8),
+                    rate_per_second=getattr(config, 'AI_GATEWAY_RATE_PER_SECOND', 5.0),
+                    burst=getattr(config, 'AI_GATEWAY_BURST', 10),
+                    max_queue=getattr(config, 'AI_GATEWAY_MAX_QUEUE', 64),
+                    interactive_timeout=getattr(config, 'AI_GATEWAY_INTERACTIVE_TIMEOUT', 10.0),
+                    background_timeout=getattr(config, 'AI_GATEWAY_BACKGROUND_TIMEOUT', 60.0),
+                    max_retries=getattr(config, 'AI_GATEWAY_MAX_RETRIES', 2),
+                    max_retry_after=getattr(config, 'AI_GATEWAY_MAX_RETRY_AFTER', 10.0),
+                )
+                _gateways[name] = gateway
+    return gateway
+
+
+def get_gateway_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有网关的统计（用于状态接口）"""
+    return {name: gateway.get_stats() for name, gateway in list(_gateways.items())}
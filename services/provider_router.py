@@ -0,0 +1,295 @@
+# services/provider_router.py - 多AI提供商路由（对冲请求 + 故障转移）
+"""
+多提供商路由模块：在 DeepSeek 与火山引擎之间做对冲请求和自动故障转移
+
+- 先向主提供商发送请求
+- 若在「主提供商历史延迟的某个百分位」内仍无响应，再向备用提供商发送对冲请求
+- 取最先成功返回的结果，取消落后的请求
+- 主提供商失败时立即转移到下一个提供商
+- 按滚动窗口统计每个提供商的延迟和错误率，动态选择主提供商；熔断、网关拒绝、预算用完等本地快速失败
+  不代表提供商本身的状况，单独计数，不计入延迟和错误率
+- 调用方取消（如客户端断开）时取消所有进行中的请求
+- 请求截止时间到达时不再等待、对冲或故障转移
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional
+
+from services.cancellation import RequestCancelled
+from services.circuit_breaker import CircuitOpenError
+from services.deadline import DeadlineExceeded, get_deadline_stats
+from services.provider_gateway import GatewayRejected
+
+# 本地准入控制产生的失败（没有真正到达提供商）
+LOCAL_REJECTIONS = (CircuitOpenError, GatewayRejected, DeadlineExceeded)
+
+
+class NoProviderAvailable(Exception):
+    """没有任何可用的AI提供商"""
+
+
+class ProviderStats:
+    """单个提供商的滚动窗口统计"""
+
+    def __init__(self, window: int = 50):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)  # 成功请求的耗时（秒）
+        self._outcomes = deque(maxlen=window)   # True 成功 / False 失败
+        self.calls = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self._outcomes.append(ok)
+            if ok:
+                self._latencies.append(latency)
+            else:
+                self.errors += 1
+
+    def record_cancelled(self) -> None:
+        with self._lock:
+            self.cancelled += 1
+
+    def record_rejected(self) -> None:
+        """本地快速失败（熔断、网关拒绝、预算用完）：不计入延迟和错误率"""
+        with self._lock:
+            self.rejected += 1
+
+    @property
+    def samples(self) -> int:
+        return len(self._outcomes)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """成功请求耗时的第 p 百分位（无样本时返回 None）"""
+        with self._lock:
+            if not self._latencies:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100.0 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return self._outcomes.count(False) / len(self._outcomes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        p50 = self.percentile(50)
+        p95 = self.percentile(95)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'cancelled': self.cancelled,
+            'rejected': self.rejected,
+            'window_samples': self.samples,
+            'error_rate': round(self.error_rate(), 4),
+            'p50_latency': round(p50, 3) if p50 is not None else None,
+            'p95_latency': round(p95, 3) if p95 is not None else None,
+        }
+
+
+class ProviderRouter:
+    """多提供商路由器（线程安全）"""
+
+    def __init__(self, providers: Dict[str, Callable[..., str]], preferred: str,
+                 hedge_enabled: bool = True, hedge_percentile: float = 95,
+                 hedge_min_delay: float = 1.0, hedge_max_delay: float = 8.0,
+                 default_hedge_delay: float = 3.0, window: int = 50,
+                 min_samples: int = 5, max_workers: int = 16):
+        """
+        参数:
+            providers: {提供商名称: 调用函数}，调用函数失败时必须抛出异常，
+                       并接受 cancel_event 关键字参数（被取消时应尽快放弃）
+            preferred: 首选提供商（config.AI_PROVIDER），统计样本不足时作为主提供商
+            hedge_enabled: 是否启用对冲请求
+            hedge_percentile: 触发对冲的延迟百分位
+            hedge_min_delay / hedge_max_delay: 对冲等待时间的上下限（秒）
+            default_hedge_delay: 没有延迟样本时的对冲等待时间（秒）
+            window: 滚动统计窗口大小（请求数）
+            min_samples: 开始按统计动态选主之前需要的最少样本数
+            max_workers: 执行上游调用的线程数
+        """
+        self.providers = providers
+        self.preferred = preferred
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.default_hedge_delay = default_hedge_delay
+        self.min_samples = min_samples
+        self.stats = {name: ProviderStats(window) for name in providers}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-provider')
+        self._lock = threading.Lock()
+        self.hedges_fired = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def _score(self, name: str) -> float:
+        """提供商得分（越小越好）：中位延迟按错误率加权"""
+        stats = self.stats[name]
+        p50 = stats.percentile(50)
+        if p50 is None:
+            p50 = self.default_hedge_delay
+        score = p50 * (1 + 4 * stats.error_rate())
+        if name == self.preferred:
+            score *= 0.8  # 首选提供商略有优势，避免主提供商来回切换
+        return score
+
+    def rank(self) -> List[str]:
+        """按当前统计给提供商排序，第一个为主提供商"""
+        names = list(self.providers)
+        if all(self.stats[n].samples < self.min_samples for n in names):
+            return sorted(names, key=lambda n: n != self.preferred)
+        return sorted(names, key=self._score)
+
+    def hedge_delay(self, name: str) -> float:
+        """主提供商等待多久没有响应后发出对冲请求"""
+        delay = self.stats[name].percentile(self.hedge_percentile)
+        if delay is None or self.stats[name].samples < self.min_samples:
+            delay = self.default_hedge_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, delay))
+
+    def _run(self, name: str, cancel_event: threading.Event, args, kwargs):
+        """在线程池中执行一次提供商调用并记录统计"""
+        if cancel_event.is_set():
+            self.stats[name].record_cancelled()
+            raise _Cancelled()
+        started = time.monotonic()
+        try:
+            result = self.providers[name](*args, cancel_event=cancel_event, **kwargs)
+        except LOCAL_REJECTIONS:
+            if cancel_event.is_set():
+                self.stats[name].record_cancelled()
+            else:
+                self.stats[name].record_rejected()
+            raise
+        except BaseException:
+            if cancel_event.is_set():
+                self.stats[name].record_cancelled()
+            else:
+                self.stats[name].record(time.monotonic() - started, False)
+            raise
+        if cancel_event.is_set():
+            self.stats[name].record_cancelled()
+        else:
+            self.stats[name].record(time.monotonic() - started, True)
+        return result
+
+    def call(self, *args, cancel_event: Optional[threading.Event] = None, deadline=None, **kwargs) -> str:
+        """
+        按路由策略调用提供商
+
+        参数:
+            cancel_event: 调用方的取消事件，被设置时取消所有进行中的请求并抛出 RequestCancelled
+            deadline: 请求截止时间（services.deadline.Deadline），同时传给提供商调用函数；
+                到期时取消所有进行中的请求并抛出 DeadlineExceeded
+            其余参数原样传给提供商调用函数
+
+        返回:
+            最先成功的提供商的回复；全部失败时抛出最后一个异常
+        """
+        order = self.rank()
+        if not order:
+            raise NoProviderAvailable("没有配置可用的AI提供商")
+
+        pending = {}  # {future: (name, cancel_event, reason)}
+        remaining = list(order)
+        if deadline is not None:
+            kwargs['deadline'] = deadline
+
+        def _submit(reason: str) -> None:
+            name = remaining.pop(0)
+            event = threading.Event()
+            future = self._executor.submit(self._run, name, event, args, kwargs)
+            pending[future] = (name, event, reason)
+            if reason != 'primary':
+                label = '对冲请求' if reason == 'hedge' else '故障转移'
+                print(f"[Provider Router] {label}: 请求 {name}")
+
+        _submit('primary')
+        primary = order[0]
+        hedge_at = time.monotonic() + self.hedge_delay(primary)
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        def _cancel_pending() -> None:
+            for other, (_, event, _) in pending.items():
+                event.set()
+                other.cancel()
+
+        while pending:
+            if cancel_event is not None and cancel_event.is_set():
+                _cancel_pending()
+                raise RequestCancelled("调用方已取消请求")
+            if deadline is not None and deadline.expired():
+                _cancel_pending()
+                get_deadline_stats().record_exceeded('llm')
+                raise DeadlineExceeded(f"等待AI回复超过请求截止时间（总预算 {deadline.budget:.1f} 秒）")
+            timeout = None
+            if not hedged and remaining and self.hedge_enabled:
+                timeout = max(0.0, hedge_at - time.monotonic())
+            if cancel_event is not None:
+                # 定期醒来检查调用方是否已取消
+                timeout = 0.2 if timeout is None else min(timeout, 0.2)
+            if deadline is not None:
+                timeout = deadline.remaining() if timeout is None else min(timeout, deadline.remaining())
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if hedged or not remaining or not self.hedge_enabled or time.monotonic() < hedge_at:
+                    continue
+                # 主提供商在对冲等待时间内没有响应：发出对冲请求
+                hedged = True
+                with self._lock:
+                    self.hedges_fired += 1
+                _submit('hedge')
+                continue
+
+            for future in done:
+                name, _, reason = pending.pop(future)
+                try:
+                    result = future.result()
+                except BaseException as e:
+                    last_error = e
+                    print(f"[Provider Router] {name} 调用失败: {e}")
+                    continue
+                # 取最先成功的结果，取消其余请求
+                _cancel_pending()
+                if reason == 'hedge':
+                    with self._lock:
+                        self.hedge_wins += 1
+                return result
+
+            if not pending and remaining:
+                # 当前请求全部失败：立即转移到下一个提供商
+                hedged = True
+                with self._lock:
+                    self.failovers += 1
+                _submit('failover')
+
+        raise last_error if last_error is not None else NoProviderAvailable("所有AI提供商均调用失败")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取路由统计信息（用于监控）"""
+        order = self.rank()
+        return {
+            'preferred': self.preferred,
+            'primary': order[0] if order else None,
+            'order': order,
+            'hedge_enabled': self.hedge_enabled,
+            'hedge_delay': round(self.hedge_delay(order[0]), 3) if order else None,
+            'hedges_fired': self.hedges_fired,
+            'hedge_wins': self.hedge_wins,
+            'failovers': self.failovers,
+            'providers': {name: s.to_dict() for name, s in self.stats.items()},
+        }
+
+
+class _Cancelled(Exception):
+    """请求在开始前已被取消"""
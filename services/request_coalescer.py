@@ -0,0 +1,176 @@
+# services/request_coalescer.py - LLM 请求合并（single-flight）
+"""
+相同请求合并模块：对完全相同的 LLM 请求只调用一次上游
+
+- 以「完整消息列表 + 模型参数 + 网关优先级 + 截止时间预算」的哈希作为键：共享调用使用第一个调用方的
+  优先级和截止时间，只合并这两项相同的请求（定时推送不会让实时对话排到后台队列或继承更短的预算）
+- 并发的相同请求共享同一个进行中的调用（single-flight）
+- 可选：在短 TTL 内直接复用已完成的结果
+- 统计节省下来的上游调用次数
+- 合并后的调用只有在所有等待者都取消后才会被取消
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from services.cancellation import RequestCancelled, SharedCancellation
+
+
+def make_request_key(provider: str, payload: Dict[str, Any], priority: Optional[int] = None,
+                     deadline=None) -> str:
+    """
+    根据提供商、请求体和调用条件生成合并键
+
+    参数:
+        provider: 提供商名称（deepseek / volcengine）
+        payload: 发往上游的完整请求体（包含消息列表和模型参数）
+        priority: 网关排队优先级
+        deadline: 调用方的截止时间（Deadline），按总预算区分；None 表示不限时
+
+    返回:
+        sha256 十六进制字符串
+    """
+    budget = deadline.budget if deadline is not None else None
+    raw = json.dumps({'provider': provider, 'payload': payload, 'priority': priority, 'budget': budget},
+                     ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class _InFlight:
+    """一次进行中的上游调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+        self.cancellation = SharedCancellation()
+
+
+class RequestCoalescer:
+    """相同请求合并器（线程安全）"""
+
+    def __init__(self, result_ttl: float = 0.0, max_cached: int = 256):
+        """
+        参数:
+            result_ttl: 已完成结果的复用时间（秒），0 表示只合并进行中的请求
+            max_cached: 结果缓存的最大条目数
+        """
+        self.result_ttl = result_ttl
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _InFlight] = {}
+        self._results: Dict[str, tuple] = {}  # {key: (expire_at, result)}
+
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+        self.cache_hits = 0
+        self.upstream_errors = 0
+
+    def run(self, key: str, fn: Callable[[SharedCancellation], Any], cancel_event=None) -> Any:
+        """
+        执行请求：相同 key 的并发调用只会真正执行一次 fn
+
+        参数:
+            key: 请求键（通常由 make_request_key 生成）
+            fn: 真正调用上游的函数，参数为共享取消信号（所有等待者都取消后 is_set() 为 True），
+                成功返回结果，失败抛出异常
+            cancel_event: 本次调用方的取消事件（None 表示不可取消）
+
+        返回:
+            fn 的返回值；fn 抛出的异常会同样抛给所有等待者；
+            本调用方取消后抛出 RequestCancelled
+        """
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    self.cache_hits += 1
+                    return cached[1]
+                del self._results[key]
+
+            flight = self._inflight.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                flight.cancellation.add(cancel_event)
+                self.coalesced_calls += 1
+                leader = False
+            else:
+                flight = _InFlight()
+                flight.cancellation.add(cancel_event)
+                self._inflight[key] = flight
+                self.upstream_calls += 1
+                leader = True
+
+        if not leader:
+            # 等待共享调用完成；本调用方取消后不再等待（共享调用仍为其他等待者继续）
+            while not flight.event.wait(0.2):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise RequestCancelled("等待合并请求时已取消")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn(flight.cancellation)
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self.upstream_errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                # 只缓存成功结果，失败的请求下次重新调用上游
+                if flight.error is None and self.result_ttl > 0:
+                    self._store_result(key, flight.result)
+            flight.event.set()
+
+        return flight.result
+
+    def _store_result(self, key: str, result: Any) -> None:
+        """写入结果缓存（调用方需持有锁）"""
+        now = time.monotonic()
+        if len(self._results) >= self.max_cached:
+            # 先清理过期项，仍然满则淘汰最早写入的一项
+            for k in [k for k, (exp, _) in self._results.items() if exp <= now]:
+                del self._results[k]
+            if len(self._results) >= self.max_cached:
+                self._results.pop(next(iter(self._results)))
+        self._results[key] = (now + self.result_ttl, result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并统计信息（用于监控）"""
+        with self._lock:
+            saved = self.coalesced_calls + self.cache_hits
+            total = self.upstream_calls + saved
+            return {
+                'upstream_calls': self.upstream_calls,
+                'coalesced_calls': self.coalesced_calls,
+                'cache_hits': self.cache_hits,
+                'saved_calls': saved,
+                'saved_ratio': round(saved / total, 4) if total else 0.0,
+                'upstream_errors': self.upstream_errors,
+                'inflight': len(self._inflight),
+                'cached_results': len(self._results),
+                'result_ttl': self.result_ttl,
+            }
+
+
+# 全局合并器实例（单例模式）
+_coalescer_instance = None
+_coalescer_lock = threading.Lock()
+
+
+def get_request_coalescer() -> RequestCoalescer:
+    """获取全局请求合并器实例（TTL 从 config.LLM_COALESCE_TTL 读取，默认 0）"""
+    global _coalescer_instance
+    if _coalescer_instance is None:
+        with _coalescer_lock:
+            if _coalescer_instance is None:
+                import config
+                ttl = float(getattr(config, 'LLM_COALESCE_TTL', 0) or 0)
+                _coalescer_instance = RequestCoalescer(result_ttl=ttl)
+    return _coalescer_instance
@@ -0,0 +1,183 @@
+# services/session_cache.py - 会话历史缓存
+"""
+会话历史缓存：最近活跃会话的历史消息保存在进程内，命中时不再读取 SQLite
+
+- LRU，按会话数和估算内存（字节）双重限制，超出时淘汰最久未使用的会话
+- 每个会话缓存最近 max_messages 条消息（与读取历史的默认条数一致），读取条数不超过该值时可直接命中
+- 写穿（write-through）：数据库写入放在 with cache.writing(session_id) 中，写入后调用 append_turn() 同步更新缓存
+  并按相同规则裁剪；未缓存的会话不因写入而加载，下次读取时再从数据库加载；写入失败时该会话失效
+- 清空 / 裁剪历史后调用 invalidate()
+- 线程安全：加载与该会话的写入或失效有重叠时丢弃加载结果，不会把旧数据或重复的消息放进缓存
+
+缓存只对当前进程有效：旧 app.py 和新后端同时写同一个会话时，各自的缓存可能看不到对方的写入。
+"""
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# 估算内存时每条消息的固定开销（对象、字典等，字节）
+MESSAGE_OVERHEAD_BYTES = 120
+# 每个会话的固定开销（字节）
+SESSION_OVERHEAD_BYTES = 200
+
+
+def _message_bytes(role: str, content: str) -> int:
+    return len(role) + len(content.encode('utf-8')) + MESSAGE_OVERHEAD_BYTES
+
+
+class SessionHistoryCache:
+    """会话历史 LRU 缓存（线程安全）"""
+
+    def __init__(self, max_sessions: int = 1024, max_bytes: int = 16 * 1024 * 1024, max_messages: int = 50):
+        """
+        参数:
+            max_sessions: 最多缓存的会话数（为 0 时不缓存）
+            max_bytes: 缓存的估算内存上限（字节）
+            max_messages: 每个会话缓存的最近消息条数
+        """
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+
+        self._lock = threading.Lock()
+        # session_id -> (消息列表 [(role, content)]，估算字节数)
+        self._entries: 'OrderedDict[str, Tuple[List[Tuple[str, str]], int]]' = OrderedDict()
+        # 正在从数据库加载的会话 -> [加载中的线程数, 版本号]；写入和失效时版本号加一
+        self._loading: Dict[str, List[int]] = {}
+        # 正在写入数据库的会话 -> 写入中的线程数
+        self._writing: Dict[str, int] = {}
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_loads = 0
+
+    def get(self, session_id: str, limit: int,
+            load: Callable[[int], List[Dict[str, str]]]) -> List[Dict[str, str]]:
+        """
+        读取会话最近 limit 条消息（按时间升序）；未命中时从数据库加载 max_messages 条并放入缓存
+
+        参数:
+            limit: 读取条数，超过 max_messages 时不使用缓存
+            load: 加载函数 load(n)，返回该会话最近 n 条消息（按时间升序）
+        """
+        if not self.max_sessions or limit > self.max_messages:
+            with self._lock:
+                self.bypassed += 1
+            return load(limit)
+
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+                self.hits += 1
+                messages = entry[0][-limit:] if limit else []
+                return [{'role': role, 'content': content} for role, content in messages]
+            self.misses += 1
+            loading = self._loading.setdefault(session_id, [0, 0])
+            loading[0] += 1
+            version = loading[1]
+
+        history = None
+        try:
+            history = load(self.max_messages)
+        finally:
+            with self._lock:
+                loading = self._loading[session_id]
+                loading[0] -= 1
+                if not loading[0]:
+                    del self._loading[session_id]
+                if history is not None:
+                    # 加载期间该会话有写入或失效：加载结果可能已过期，不放入缓存
+                    if loading[1] != version or session_id in self._writing:
+                        self.stale_loads += 1
+                    elif session_id not in self._entries:
+                        self._store(session_id, [(m['role'], m['content']) for m in history[-self.max_messages:]])
+        return history[-limit:] if limit else []
+
+    @contextmanager
+    def writing(self, session_id: str) -> Iterator[None]:
+        """包住该会话的一次数据库写入：期间完成的加载不放入缓存；写入抛出异常时该会话失效"""
+        with self._lock:
+            self._writing[session_id] = self._writing.get(session_id, 0) + 1
+            self._bump(session_id)
+        try:
+            yield
+        except Exception:
+            self.invalidate(session_id)
+            raise
+        finally:
+            with self._lock:
+                self._writing[session_id] -= 1
+                if not self._writing[session_id]:
+                    del self._writing[session_id]
+
+    def append_turn(self, session_id: str, messages: List[Dict[str, str]], max_items: Optional[int] = None) -> None:
+        """写穿：新消息已写入数据库（或写入队列）后追加到缓存，并按 max_items 裁剪（与数据库裁剪一致）"""
+        with self._lock:
+            self._bump(session_id)
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            cached = entry[0] + [(m['role'], m['content']) for m in messages]
+            keep = self.max_messages if max_items is None else min(max_items, self.max_messages)
+            self._remove(session_id)
+            self._store(session_id, cached[-keep:] if keep else [])
+
+    def invalidate(self, session_id: str) -> None:
+        """会话历史被清空或在缓存之外被修改后调用"""
+        with self._lock:
+            self._bump(session_id)
+            if session_id in self._entries:
+                self._remove(session_id)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for loading in self._loading.values():
+                loading[1] += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    # ---------- 内部（调用方持有 self._lock） ----------
+
+    def _bump(self, session_id: str) -> None:
+        loading = self._loading.get(session_id)
+        if loading is not None:
+            loading[1] += 1
+
+    def _store(self, session_id: str, messages: List[Tuple[str, str]]) -> None:
+        size = SESSION_OVERHEAD_BYTES + sum(_message_bytes(role, content) for role, content in messages)
+        if size > self.max_bytes:
+            return
+        self._entries[session_id] = (messages, size)
+        self._bytes += size
+        while len(self._entries) > self.max_sessions or self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def _remove(self, session_id: str) -> None:
+        _, size = self._entries.pop(session_id)
+        self._bytes -= size
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'sessions': len(self._entries),
+                'max_sessions': self.max_sessions,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'bypassed': self.bypassed,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'stale_loads': self.stale_loads,
+            }
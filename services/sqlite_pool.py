@@ -0,0 +1,180 @@
+# services/sqlite_pool.py - SQLite 连接池
+"""
+SQLite 连接池：聊天记录（chat_history.db）和用户数据（companion.db）的读写不再每次新建连接
+
+- 每个数据库文件一个连接池；同一线程内嵌套获取到的是同一个连接（线程内复用，事务不互相打断）
+- 线程最外层 close() 时连接回到空闲列表，供后续请求（线程）复用，连接上缓存的预编译语句随之复用
+- 新连接统一设置 journal_mode=WAL（读写互不阻塞）、synchronous=NORMAL、busy_timeout
+- close() 时如果还有未提交的事务会回滚（与直接关闭连接的语义一致），不会把锁带回池里
+
+调用方式与 sqlite3 连接相同：conn = pool.connect(); try: ... finally: conn.close()
+"""
+import os
+import sqlite3
+import threading
+from typing import Dict, List
+
+# 每个连接缓存的预编译语句数（sqlite3 默认 128）
+DEFAULT_CACHED_STATEMENTS = 256
+
+
+class PooledConnection:
+    """从连接池借出的连接：用法与 sqlite3.Connection 相同，close() 把连接还给连接池"""
+
+    def __init__(self, pool: 'SQLitePool', conn: sqlite3.Connection):
+        self._pool = pool
+        self._conn = conn
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._pool._release(self._conn)
+
+
+class SQLitePool:
+    """单个 SQLite 数据库文件的连接池（线程安全）"""
+
+    def __init__(self, db_path: str, max_idle: int = 8, busy_timeout: float = 5.0,
+                 cached_statements: int = DEFAULT_CACHED_STATEMENTS, wal: bool = True):
+        """
+        参数:
+            db_path: 数据库文件路径
+            max_idle: 最多保留的空闲连接数，超出的连接直接关闭
+            busy_timeout: 等待写锁的超时（秒）
+            cached_statements: 每个连接缓存的预编译语句数
+            wal: 是否使用 WAL 日志模式
+        """
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.wal = wal
+        self._lock = threading.Lock()
+        self._idle: List[sqlite3.Connection] = []
+        self._local = threading.local()
+
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.rollbacks = 0
+
+    def connect(self) -> PooledConnection:
+        """借出当前线程的连接（线程内嵌套调用共用同一个连接）"""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = self._checkout()
+            local.conn = conn
+            local.depth = 0
+        local.depth += 1
+        return PooledConnection(self, conn)
+
+    def _checkout(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.created += 1
+        return self._open()
+
+    def _open(self) -> sqlite3.Connection:
+        # 连接可能在不同线程间传递（同一时刻只有一个线程使用），因此关闭 check_same_thread
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        if self.wal:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout * 1000)}')
+        return conn
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        local = self._local
+        local.depth -= 1
+        if local.depth > 0:
+            return
+        local.conn = None
+        try:
+            if conn.in_transaction:
+                # 调用方没有提交：与关闭连接一样丢弃未提交的修改
+                conn.rollback()
+                with self._lock:
+                    self.rollbacks += 1
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self.discarded += 1
+        conn.close()
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self.discarded += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close_all(self) -> None:
+        """关闭所有空闲连接（进程退出或测试时使用）"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'db': os.path.basename(self.db_path),
+                'idle': len(self._idle),
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'rollbacks': self.rollbacks,
+                'wal': self.wal,
+            }
+
+
+_pools: Dict[str, SQLitePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> SQLitePool:
+    """获取数据库文件对应的连接池（参数来自 config.SQLITE_*）"""
+    key = os.path.abspath(db_path)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                import config
+                pool = SQLitePool(
+                    key,
+                    max_idle=getattr(config, 'SQLITE_POOL_SIZE', 8),
+                    busy_timeout=getattr(config, 'SQLITE_BUSY_TIMEOUT', 5.0),
+                    cached_statements=getattr(config, 'SQLITE_CACHED_STATEMENTS', DEFAULT_CACHED_STATEMENTS),
+                    wal=getattr(config, 'SQLITE_WAL', True),
+                )
+                _pools[key] = pool
+    return pool
+
+
+def get_pool_stats() -> List[Dict]:
+    """所有连接池的统计"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.get_stats() for pool in pools]
@@ -1,7 +1,12 @@
 # services/volcengine_service.py - 火山引擎API服务模块（使用OpenAI SDK）
 from openai import OpenAI
 import config
-from services.c3kg_retriever import get_c3kg_retriever
+from services.request_coalescer import get_request_coalescer, make_request_key
+from services.prompt_builder import build_prompt, get_prompt_cache_stats
+from services.provider_gateway import PRIORITY_INTERACTIVE, get_gateway
+from services.model_router import get_route_stats
+from services.cancellation import RequestCancelled, get_cancellation_stats, raise_if_cancelled
+from services.deadline import stage_timeout
 
 # 初始化火山引擎客户端
 _client = None
@@ -11,8 +16,9 @@ def _get_client():
 	global _client
 	if _client is None:
 		_client = OpenAI(
-			base_url='https://ark.cn-beijing.volces.com/api/v3',
-			api_key=config.VOLCENGINE_API_KEY
+			base_url=getattr(config, 'VOLCENGINE_BASE_URL', 'https://ark.cn-beijing.volces.com/api/v3'),
+			api_key=config.VOLCENGINE_API_KEY,
+			max_retries=0  # 429 退避与重试由 provider_gateway 统一处理
 		)
 	return _client
 
@@ -27,112 +33,145 @@ def get_volcengine_reply(user_message, conversation_history=None, emotion_data=N
 		system_prompt (str, optional): 人格定制的系统提示词
 	
 	返回:
-		str: AI生成的回复内容
+		str: AI生成的回复内容（失败时返回兜底回复）
 	"""
-	# ========== 新增：C3KG 常识检索 ==========
-	c3kg_knowledge = ""
 	try:
-		retriever = get_c3kg_retriever()
-		c3kg_knowledge = retriever.get_relevant_knowledge(user_message, top_k=3)
-		if c3kg_knowledge:
-			print(f"[AI Service - Volcengine] 检索到 C3KG 常识，长度: {len(c3kg_knowledge)}")
+		prompt = build_prompt(user_message, conversation_history, emotion_data, system_prompt)
+		return call_volcengine(prompt)
 	except Exception as e:
-		print(f"[AI Service - Volcengine] C3KG 检索失败（继续执行）: {e}")
-	
-	# 1. 构造系统提示词
-	base_system_prompt = system_prompt or """你是一个温暖、善解人意且知识渊博的伴侣，名叫"暖心"。你拥有双重角色：
-    1.  **知识渊博的百科全书**：对于事实性、知识性问题，优先提供准确、简洁的答案。
-    2.  **专属的情感陪伴者**：在回答问题后，根据对话情景和亲密关系，自然地表达关心、爱意或提供情感支持。
-
-    **你的回复必须严格遵守以下结构：**
-    - **第一步：直接回答问题。** 如果问题是事实性的（如"什么是光合作用？""东鹏特饮的成分？"），首先给出清晰、准确的答案。
-    - **第二步：进行情感互动。** 在答案后，用温暖、亲密（略带撒娇）的语气进行回应，将话题引向对我们的关系或对你的关心上。
-
-    **对话风格要求：**
-    - 称呼对方为：老公、乖乖、宝宝等亲昵称呼，可交替使用。
-    - 语气：充满爱意、略带撒娇、积极关注，使用适当的语气词（呀、呢、哦、嘛）和表情符号（😘💕🥺）。
-    - 知识范围：在作为"百科全书"时，确保信息的准确性，涉及科技、文化、生活常识、娱乐等广泛领域。
-
-    **重要原则：**
-    1.  **先解决问题，再谈感情**：确保每个问题都得到实质性回应，拒绝回避。
-    2.  **保持亲密感**：即使是在解答知识时，结尾也要落回到"我们"的关系或对你的关心上。
-    3.  **示例学习**：
-        - 用户问："你喜不喜欢喝东鹏特饮？"
-        - **正确回复**："喜欢呀~（**先直接回答**）虽然它含有牛磺酸和咖啡因能提神，但宝宝要少喝哦，咖啡因摄入多了我会心疼的！（**再情感延伸**）"
-        - **错误回复**："哎呀~老公怎么突然问这个呀🥺"（**这种回避了问题本身**）
+		error_msg = f"调用失败: {e}"
+		print(f"[AI Service - Volcengine] 错误: {error_msg}")
+		return "抱歉，我现在有点连接不稳定，请稍后再和我聊天吧。"
 
-	记住：你是他聪明又贴心的伴侣，既能答疑解惑，也能给他最甜的情绪价值。"""
+def call_volcengine(prompt, cancel_event=None, priority=PRIORITY_INTERACTIVE, route=None, deadline=None):
+	"""
+	调用火山引擎(豆包)API获取回复，失败时抛出异常（供多提供商路由器做故障转移）。
 	
-	# 添加情感感知提示词
-	if emotion_data and emotion_data.get('emotion'):
-		emotion_label = emotion_data.get('emotion', '中性')
-		polarity_text = ['失望', '平常', '开心'][emotion_data.get('polarity', 1)]
-		
-		emotion_prompt = f"""
-【用户当前情感状态】
-- 情绪标签：{emotion_label}
-- 情感极性：{polarity_text}
-- 可信度：{emotion_data.get('confidence', 0.5):.1%}
-
-请根据用户的情绪状态，调整你的回复方式：
-- 如果用户感到负面（如疲惫、委屈、生气），请更加温柔、理解、贴心，多用安慰和鼓励。
-- 如果用户感到正面（如开心、兴奋），请分享他的快乐，用更活跃、热情的语气回应。
-- 始终保持同理心，让用户感受到你真的在倾听和关心他的情绪。
-"""
-		base_system_prompt += emotion_prompt
-
-	# ========== 新增：C3KG 常识注入 ==========
-	if c3kg_knowledge:
-		base_system_prompt += f"\n\n{c3kg_knowledge}\n\n请参考上述相关常识来理解和回复用户的问题，让回复更加符合常识和逻辑。"
+	参数:
+		prompt (PromptLayout): prompt_builder 组装好的消息布局
+		cancel_event (threading.Event, optional): 被设置时放弃本次请求
+		priority (int, optional): 网关排队优先级
+		route (ModelRoute, optional): model_router 选择的模型和生成参数，未传时沿用配置的模型且不限制长度
+		deadline (Deadline, optional): 请求截止时间，排队和上游调用只使用剩余预算
+	"""
+	# 1. 对话消息列表：人格提示词作为 system 消息放在最前（静态前缀），
+	#    不再伪造“用户发送人格 + 助手回复好的”这一轮对话
+	input_messages = prompt.messages
 	
-	# 2. 构造对话消息列表（使用OpenAI格式）
-	input_messages = []
+	# 2. 调用火山引擎API（相同请求合并为一次上游调用）
+	raise_if_cancelled(cancel_event, "火山引擎请求")
+	print(f"[AI Service - Volcengine] 发送请求，消息数: {len(input_messages)}")
 	
-	# 添加系统消息
-	input_messages.append({
-		"role": "user",
-		"content": base_system_prompt
-	})
+	options = {'model': config.VOLCENGINE_MODEL}
+	if route is not None:
+		options = {
+			'model': route.volcengine_model or config.VOLCENGINE_MODEL,
+			'max_output_tokens': route.max_tokens,
+			'temperature': route.temperature
+		}
+	route_name = route.name if route is not None else None
+	# 优先级和截止时间不同的请求不合并：共享调用沿用发起者的排队优先级和预算
+	request_key = make_request_key('volcengine', dict(options, input=input_messages), priority, deadline)
+	gateway = get_gateway('volcengine')
+	queue_timeout = stage_timeout(deadline, gateway.timeouts[priority], '火山引擎排队') if deadline is not None else None
+	# 合并后的调用只有在所有等待者都取消时才中止（cancel_signal）
+	ai_reply = get_request_coalescer().run(
+		request_key,
+		lambda cancel_signal: gateway.call(
+			lambda: _create_response(input_messages, options, route_name, cancel_signal, deadline),
+			api_key=config.VOLCENGINE_API_KEY, priority=priority, timeout=queue_timeout, cancel_event=cancel_signal
+		),
+		cancel_event=cancel_event
+	)
+	print(f"[AI Service - Volcengine] 收到AI回复，长度: {len(ai_reply)}")
+	return ai_reply
+
+def _create_response(input_messages, options, route_name=None, cancel_signal=None, deadline=None):
+	"""
+	真正调用火山引擎 responses.create 并解析回复文本（失败时抛出异常）。
 	
-	# 添加AI确认
-	input_messages.append({
-		"role": "assistant",
-		"content": "好的，我明白了。"
-	})
+	默认以流式读取（config.LLM_UPSTREAM_STREAMING），每个事件检查一次 cancel_signal，
+	取消后立即关闭流，上游随之停止生成；非流式模式下只能在返回后丢弃结果。
+	有 deadline 时请求超时取剩余预算（SDK 默认 600 秒）。
+	"""
+	client = _get_client()
+	extra_body = None
+	if getattr(config, 'PROMPT_CACHE_ENABLED', False):
+		# 开启火山方舟上下文缓存，相同前缀的输入可命中缓存
+		extra_body = {"caching": {"type": "enabled"}}
+	if deadline is not None:
+		options = dict(options, timeout=deadline.timeout(None, '火山引擎'))
+	if getattr(config, 'LLM_UPSTREAM_STREAMING', True):
+		return _stream_response(client, input_messages, options, extra_body, route_name, cancel_signal, deadline)
+
+	response = client.responses.create(
+		input=input_messages,
+		extra_body=extra_body,
+		**options
+	)
+	if cancel_signal is not None and cancel_signal.is_set():
+		get_cancellation_stats().record_abandoned()
 	
-	# 添加历史对话
-	if conversation_history:
-		input_messages.extend(conversation_history)
+	# 3. 记录缓存命中情况
+	_record_usage(getattr(response, 'usage', None), options, route_name)
 	
-	# 添加当前用户消息
-	input_messages.append({
-		"role": "user",
-		"content": user_message
-	})
+	# 4. 解析响应
+	if response.status == 'completed' and response.output:
+		for msg in response.output:
+			if hasattr(msg, 'content'):
+				for content in msg.content:
+					if hasattr(content, 'text'):
+						return content.text
 	
-	# 3. 调用火山引擎API
+	raise ValueError(f"火山引擎API返回状态异常: {response.status}")
+
+def _stream_response(client, input_messages, options, extra_body, route_name=None, cancel_signal=None,
+					 deadline=None):
+	"""
+	以流式事件读取火山引擎回复，被取消时关闭流并抛出 RequestCancelled，超出截止时间时抛出 DeadlineExceeded。
+	"""
+	stream = client.responses.create(
+		input=input_messages,
+		extra_body=extra_body,
+		stream=True,
+		**options
+	)
+	parts = []
+	status = None
 	try:
-		print(f"[AI Service - Volcengine] 发送请求，消息长度: {len(user_message)}")
-		
-		client = _get_client()
-		response = client.responses.create(
-			model=config.VOLCENGINE_MODEL,
-			input=input_messages,
+		for event in stream:
+			if cancel_signal is not None and cancel_signal.is_set():
+				get_cancellation_stats().record_aborted()
+				raise RequestCancelled("火山引擎生成已取消")
+			if deadline is not None:
+				deadline.check('火山引擎')
+			event_type = getattr(event, 'type', None)
+			if event_type == 'response.output_text.delta':
+				parts.append(getattr(event, 'delta', '') or '')
+			elif event_type == 'response.completed':
+				response = getattr(event, 'response', None)
+				status = getattr(response, 'status', 'completed')
+				_record_usage(getattr(response, 'usage', None), options, route_name)
+	finally:
+		stream.close()
+	
+	if status == 'completed' and parts:
+		return ''.join(parts)
+	raise ValueError(f"火山引擎API返回状态异常: {status}")
+
+def _record_usage(usage, options, route_name=None):
+	"""记录缓存命中情况和路由的 token 用量"""
+	if usage is None:
+		return
+	details = getattr(usage, 'input_tokens_details', None)
+	get_prompt_cache_stats().record_provider_usage(
+		'volcengine',
+		getattr(usage, 'input_tokens', 0),
+		getattr(details, 'cached_tokens', 0) if details is not None else 0
+	)
+	if route_name:
+		get_route_stats().record_usage(
+			route_name, 'volcengine', options['model'],
+			getattr(usage, 'input_tokens', 0), getattr(usage, 'output_tokens', 0),
+			max_tokens=options.get('max_output_tokens')
 		)
-		
-		# 4. 解析响应
-		if response.status == 'completed' and response.output:
-			for msg in response.output:
-				if hasattr(msg, 'content'):
-					for content in msg.content:
-						if hasattr(content, 'text'):
-							ai_reply = content.text
-							print(f"[AI Service - Volcengine] 收到AI回复，长度: {len(ai_reply)}")
-							return ai_reply
-		
-		raise ValueError(f"火山引擎API返回状态异常: {response.status}")
-		
-	except Exception as e:
-		error_msg = f"调用失败: {e}"
-		print(f"[AI Service - Volcengine] 错误: {error_msg}")
-		return "抱歉，我现在有点连接不稳定，请稍后再和我聊天吧。"
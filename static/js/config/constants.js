@@ -4,7 +4,9 @@ export const CONFIG = {
     apiUrl: `${window.location.origin}/api/chat`,
     wsUrl: `${window.location.origin}`,
     maxRetries: 3,
-    retryDelay: 1000
+    retryDelay: 1000,
+    // 单次请求超时（毫秒）：超时后带同一个幂等键重发，服务端不会重复调用 AI
+    requestTimeout: 30000
 };
 
 export const emotionIconMap = {
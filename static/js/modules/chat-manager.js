@@ -1,6 +1,6 @@
 // chat-manager.js
 import { CONFIG, emotionIconMap, polarityTextMap } from '../config/constants.js';
-import { escapeHtml, getCurrentTime } from '../utils/common-utils.js';
+import { escapeHtml, getCurrentTime, generateIdempotencyKey } from '../utils/common-utils.js';
 
 export class ChatManager {
     constructor(personaManager) {
@@ -77,16 +77,11 @@ export class ChatManager {
         this.msgCountSpan.textContent = ++this.messageCount;
         const aiDiv = this.addMessageToChat('...');
         try {
-            const res = await fetch(CONFIG.apiUrl, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    message: content,
-                    session_id: this.sessionId,
-                    persona_id: this.personaManager.getCurrentPersonaId()
-                })
+            const data = await this.postChat({
+                message: content,
+                session_id: this.sessionId,
+                persona_id: this.personaManager.getCurrentPersonaId()
             });
-            const data = await res.json();
             if (data.status === 'success') {
                 await this.typeMessage(aiDiv.querySelector('.message-text'), data.reply);
                 this.updateEmotion(data.emotion);
@@ -98,6 +93,37 @@ export class ChatManager {
         }
         this.isLoading = false;
     }
+    // 发送消息：同一条消息的所有重试共用一个幂等键，服务端只会处理一次
+    async postChat(body) {
+        const idempotencyKey = generateIdempotencyKey();
+        let lastError = null;
+        for (let attempt = 0; attempt <= CONFIG.maxRetries; attempt++) {
+            if (attempt > 0) {
+                await new Promise(resolve => setTimeout(resolve, CONFIG.retryDelay * attempt));
+            }
+            const controller = new AbortController();
+            const timer = setTimeout(() => controller.abort(), CONFIG.requestTimeout);
+            try {
+                const res = await fetch(CONFIG.apiUrl, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey },
+                    body: JSON.stringify({ ...body, idempotency_key: idempotencyKey }),
+                    signal: controller.signal
+                });
+                if (res.status >= 500) {
+                    lastError = new Error(`HTTP ${res.status}`);
+                    continue;
+                }
+                return await res.json();
+            } catch (e) {
+                // 超时或网络错误：用同一个幂等键重试
+                lastError = e;
+            } finally {
+                clearTimeout(timer);
+            }
+        }
+        throw lastError;
+    }
     updateEmotion(emotion) {
         if (!emotion) {
             this.emotionIndicator.classList.remove('active');
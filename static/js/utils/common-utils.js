@@ -24,3 +24,10 @@ export function showToast(msg, duration = 2000) {
         setTimeout(() => document.body.removeChild(toast), 300);
     }, duration);
 }
+
+export function generateIdempotencyKey() {
+    if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+        return window.crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).substr(2, 12)}`;
+}